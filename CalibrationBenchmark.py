@@ -0,0 +1,230 @@
+####################################################################################
+#
+# CalibrationBenchmark.py runs MikeDeanSpeedMatch.py on the simulated testbed (see
+# TestbedSimulator.py) for every decoder brand the script knows, each with a set
+# of synthetic motor curves, and writes a table of what each calibration cost and
+# how close its speed table came to the targets. The sensors of the loop are
+# off the nominal block length by up to BlockError, and every case is run both
+# on a loop whose block lengths have been calibrated, as the testbed normally
+# is, and on one without a block length table (--blocks picks one):
+#
+#	blocks		calibrated or nominal
+#	wall_sec	real time the run took
+#	layout_min	layout time the run would have taken on the testbed
+#	laps		laps of the loop run
+#	measurements	measureSpeed() calls
+#	cv_writes	ops mode CV writes sent, retries included
+#	skipped_writes	writes the script left out because the decoder had the value
+#	reads		service mode CV reads
+#	err_N		steady speed at speed step N minus its target (MPH), in the
+#			direction the script calibrated, for N = 4, 8 .. 28; the speed
+#			is taken at the throttle setting the script gives for the step,
+#			which for a new TCS decoder is below N / 28
+#	max_err, rms_err	over those steps
+#	check		ok, or why the case failed: a status other than Done, or an
+#			rms_err over the script's VerifyTolerance
+#
+#	python CalibrationBenchmark.py --output baseline.csv
+#	python CalibrationBenchmark.py --baseline baseline.csv
+#
+# With --baseline the totals are compared with an earlier table, so a change to
+# the calibration can be judged by running the benchmark before and after it.
+# The failed cases are listed at the end, and the exit status is their number.
+#
+####################################################################################
+
+import argparse
+import csv
+import json
+import math
+import shutil
+import sys
+import time
+
+import TestbedSimulator
+
+# The brands of DecoderMap, with the TCS table behaviours as their own entries
+Decoders = [
+	("Tsunami", "Tsunami", "new"),
+	("Digitrax", "Digitrax", "new"),
+	("TCS old", "TCS", "old"),
+	("TCS new", "TCS", "new"),
+	("NCE", "NCE", "new"),
+	("QSI/BLI", "QSI/BLI", "new"),
+	("Lenz Gen 5", "Lenz Gen 5", "new"),
+	("ESU", "ESU", "new"),
+	("Atlas/Lenz XF", "Atlas/Lenz XF", "new"),
+]
+
+# Synthetic motor curves, as TestbedSimulator options
+MotorCurves = [
+	("linear", {"maxspeed": 100.0, "gamma": 1.0, "deadband": 0.02, "reverse": 0.97}),
+	("geared", {"maxspeed": 75.0, "gamma": 1.3, "deadband": 0.06, "reverse": 0.92, "inertia": 0.5}),
+	("fast-noisy", {"maxspeed": 140.0, "gamma": 1.1, "deadband": 0.03, "reverse": 1.03, "noise": 0.03}),
+	("cold-steep", {"maxspeed": 110.0, "gamma": 1.6, "deadband": 0.04, "reverse": 0.95, "warmup": 0.12}),
+]
+
+# How far the sensors are from where the nominal block length puts them
+BlockError = 0.05
+BlockModes = ["calibrated", "nominal"]
+
+Steps = [4, 8, 12, 16, 20, 24, 28]
+Columns = ["decoder", "curve", "blocks", "seed", "status", "wall_sec", "layout_min", "laps", "measurements",
+	"cv_writes", "skipped_writes", "reads"] + ["err_%d" % step for step in Steps] + ["max_err", "rms_err", "check"]
+
+####################################################################################
+#
+# runCase() calibrates one simulated locomotive and returns its row of the table
+#
+####################################################################################
+def runCase(decoder, curve, blocks, seed, arguments) :
+	name, brand, tcs = decoder
+	curvename, settings = curve
+	arguments = ["--quiet", "--brand", brand, "--tcs", tcs, "--seed", str(seed), "--blockerror", str(BlockError)] + arguments
+	if blocks == "calibrated" :
+		arguments = ["--calibratedblocks"] + arguments
+	options = TestbedSimulator.parseOptions(arguments)
+	for key, value in settings.items() :
+		setattr(options, key, value)
+	row = {"decoder": name, "curve": curvename, "blocks": blocks, "seed": seed}
+	counts = {"measurements": 0}
+
+	def prepare(calibration) :
+		measure = calibration.measureSpeed
+		def counted(targetspeed) :
+			counts["measurements"] = counts["measurements"] + 1
+			return measure(targetspeed)
+		calibration.measureSpeed = counted
+		return
+
+	start = time.time()
+	simulation = TestbedSimulator.Simulation(options)
+	try :
+		try :
+			result = simulation.run(prepare)
+			row["status"] = result.get("status")
+		except Exception, e :
+			result = {}
+			row["status"] = "error: %s" % e
+		row["wall_sec"] = round(time.time() - start, 2)
+		row["layout_min"] = round(simulation.clock.nanos() / 60000000000.0, 2)
+		row["laps"] = round(simulation.laps(), 1)
+		row["measurements"] = counts["measurements"]
+		row["cv_writes"] = simulation.writes()
+		if simulation.calibration != None :
+			row["skipped_writes"] = getattr(simulation.calibration, "skippedWrites", None)
+		row["reads"] = simulation.reads
+
+		targets = result.get("steptargets", {})
+		if targets :
+			settings = result.get("stepsettings", {})
+			errors = []
+			for step in Steps :
+				if targets.has_key(step) :
+					speed = simulation.speedAt(settings.get(step, step / 28.0), result.get("forward", True))
+					error = speed - targets[step]
+					row["err_%d" % step] = round(error, 2)
+					errors.append(error)
+			row["max_err"] = round(max([abs(e) for e in errors]), 2)
+			row["rms_err"] = round(math.sqrt(sum([e * e for e in errors]) / len(errors)), 2)
+
+		row["check"] = "ok"
+		if row["status"] <> "Done" :
+			row["check"] = "status"
+		elif row.get("rms_err") == None :
+			row["check"] = "no table"
+		elif row["rms_err"] > simulation.calibration.VerifyTolerance :
+			row["check"] = "rms over %s MPH" % simulation.calibration.VerifyTolerance
+	finally :
+		if options.userfiles == None :
+			shutil.rmtree(simulation.userfiles, True)
+	return row
+
+def writeTable(rows, path, format) :
+	if path == None :
+		out = sys.stdout
+	else :
+		out = open(path, "wb")
+	try :
+		if format == "json" :
+			json.dump(rows, out, indent = 1)
+			out.write("\n")
+		else :
+			writer = csv.DictWriter(out, Columns)
+			writer.writeheader()
+			for row in rows :
+				writer.writerow(row)
+	finally :
+		if path != None :
+			out.close()
+	return
+
+def readTable(path) :
+	f = open(path, "rb")
+	try :
+		if path.endswith(".json") :
+			return json.load(f)
+		return list(csv.DictReader(f))
+	finally :
+		f.close()
+
+####################################################################################
+#
+# compare() prints the totals of the rows both tables have, baseline first
+#
+####################################################################################
+def compare(rows, baseline) :
+	key = lambda row : (row["decoder"], row["curve"], row.get("blocks", "calibrated"), str(row["seed"]))
+	old = dict([(key(row), row) for row in baseline])
+	pairs = [(old[key(row)], row) for row in rows if old.has_key(key(row))]
+	sys.stderr.write("Compared with the baseline over %d runs:\n" % len(pairs))
+	for column in ["wall_sec", "layout_min", "laps", "measurements", "cv_writes", "reads", "max_err", "rms_err"] :
+		before = [float(a[column]) for a, b in pairs if a.get(column) not in (None, "") and b.get(column) not in (None, "")]
+		after = [float(b[column]) for a, b in pairs if a.get(column) not in (None, "") and b.get(column) not in (None, "")]
+		if before :
+			mean = sum(before) / len(before)
+			newmean = sum(after) / len(after)
+			sys.stderr.write("  %-14s %10.2f -> %10.2f\n" % (column, mean, newmean))
+	failures = [b for a, b in pairs if str(b["status"]).startswith("error") and not str(a["status"]).startswith("error")]
+	for row in failures :
+		sys.stderr.write("  now fails: %s %s %s seed %s: %s\n" % (row["decoder"], row["curve"], row["blocks"], row["seed"], row["status"]))
+	return
+
+if __name__ == "__main__" :
+	parser = argparse.ArgumentParser(description = "Benchmark the speed matching script on simulated decoders")
+	parser.add_argument("--seeds", type = int, default = 1, help = "runs of each decoder and curve")
+	parser.add_argument("--decoders", default = None, help = "comma separated decoder names (default: all)")
+	parser.add_argument("--curves", default = None, help = "comma separated curve names (default: all)")
+	parser.add_argument("--blocks", default = None, choices = BlockModes, help = "block length table (default: both)")
+	parser.add_argument("--format", default = "csv", choices = ["csv", "json"])
+	parser.add_argument("--output", default = None, help = "file for the table (default: standard output)")
+	parser.add_argument("--baseline", default = None, help = "earlier table to compare with")
+	parser.add_argument("--limitminutes", type = float, default = 60.0, help = "layout time after which a run counts as failed")
+	options, simulator = parser.parse_known_args()
+
+	decoders = Decoders
+	if options.decoders != None :
+		decoders = [d for d in Decoders if d[0] in options.decoders.split(",")]
+	curves = MotorCurves
+	if options.curves != None :
+		curves = [c for c in MotorCurves if c[0] in options.curves.split(",")]
+	blockmodes = BlockModes
+	if options.blocks != None :
+		blockmodes = [options.blocks]
+
+	rows = []
+	for decoder in decoders :
+		for curve in curves :
+			for blocks in blockmodes :
+				for seed in range(1, options.seeds + 1) :
+					row = runCase(decoder, curve, blocks, seed, ["--limitminutes", str(options.limitminutes)] + simulator)
+					sys.stderr.write("%-14s %-11s %-10s seed %d  %-10s %6.1f layout min  rms %s MPH\n" %
+						(row["decoder"], row["curve"], blocks, seed, row["status"], row["layout_min"], row.get("rms_err")))
+					rows.append(row)
+	writeTable(rows, options.output, options.format)
+	if options.baseline != None :
+		compare(rows, readTable(options.baseline))
+	failed = [row for row in rows if row["check"] <> "ok"]
+	for row in failed :
+		sys.stderr.write("FAILED: %s %s %s seed %s: %s, %s\n" % (row["decoder"], row["curve"], row["blocks"], row["seed"], row["status"], row["check"]))
+	sys.exit(len(failed))
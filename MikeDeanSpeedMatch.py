@@ -9,9 +9,31 @@
 #	7 Speed steps are measured; the rest are interpolated. The measured ones are 4, 8, 12, 16, 20,24, and 28
 #	These are written to the decoder and the locomotive is release from the throttle and the throttle is discarded.
 #
+#	Batch runs:
+#		Set testbedMode = "batch" (and testbedJobFile, if not speedmatch/jobs.json in the
+#		user files directory) in a script run before this one. The job file is a JSON list like
+#			[{"name": "sd40-1234", "type": "Diesel", "topspeed": 65, "address": 1234}, ...]
+#		"address" and the options "sweep", "sweepverify", "verifytable" and "blockcalibration"
+#		may be left out. The jobs run back to back; between jobs take the locomotive off the
+#		loop and put the next one on. The results of each job go to speedmatch/results.
+#
+#	Both loops:
+#		A session runs on the loop picked on the input panel (or by testbedJobFiles), with its
+#		own throttle, programmer, sensors and track power. Running the script again opens a
+#		panel for the other loop. Only one session uses the program track at a time, and loops
+#		that share block sensors (see TestbedLoops) take turns.
+#
 #	If something goes wrong and you need to start over; "Steal" it in another throttle and stop the locomotive
 #		Under the "Panels" tab, select "Thread Monitor" and "Kill" the script.
 #		Close the input panel
+#		The run is checkpointed after each phase and speed step; the next run of the same
+#		locomotive offers to resume where it stopped.
+#
+#	Logs:
+#		Each session is logged to speedmatch/logs/<loop>-<date>-<job>.jsonl, one JSON record
+#		per block transit, speed measurement, throttle search step, CV read or write and
+#		message (see EventLog). What used to be printed is the text of those records; set
+#		ConsoleLog = False to keep it off the console.
 #
 #	Notes:
 #		BEMF	Any adjustments should be made before running the script
@@ -91,348 +113,2585 @@
 import java
 import javax.swing
 import jmri
+import json
+import heapq
+import math
+import os
+import Queue
+import threading
+import time
+
+####################################################################################
+#
+# TestbedClock is where the script gets the time and does all its waiting: time
+# stamps, delays, sensor waits and the waits on the conditions the programmer and
+# sensor listeners signal. This one is the real clock. Set testbedClock to a
+# VirtualClock before running the script to run on virtual time instead.
+#
+####################################################################################
+class TestbedClock :
+
+	def millis(self) :
+		return java.lang.System.currentTimeMillis()
+
+	def nanos(self) :
+		return java.lang.System.nanoTime()
+
+	def condition(self) :
+		return threading.Condition()
+
+	def sleep(self, automaton, msec) :
+		automaton.waitMsec(msec)
+		return
+
+	def waitSensorActive(self, automaton, sensorlist) :
+		automaton.waitSensorActive(sensorlist)
+		return
+
+	def waitSensorInactive(self, automaton, sensorlist) :
+		automaton.waitSensorInactive(sensorlist)
+		return
+
+	def waitChange(self, automaton, beanlist) :
+		automaton.waitChange(beanlist)
+		return
+
+####################################################################################
+#
+# VirtualClock runs the script on virtual time, for a simulated layout. The layout
+# schedules what happens on it with schedule(); every wait jumps the clock straight
+# to the next scheduled event until what it is waiting for has happened, so a run
+# takes as long as the work it does rather than the time on the layout. Everything
+# runs on the automaton thread. Waiting longer than limit msec in total raises an
+# error, since a stuck run would otherwise never return.
+#
+####################################################################################
+class VirtualClock(TestbedClock) :
+
+	def __init__(self, limit = None) :
+		self.now = 0			# nsec
+		self.queue = []			# (time nsec, sequence, function), see heapq
+		self.sequence = 0
+		self.limit = limit
+		return
+
+	def millis(self) :
+		return self.now / 1000000
+
+	def nanos(self) :
+		return self.now
+
+	def condition(self) :
+		return VirtualCondition(self)
+
+	# Calls function() msec from now
+	def schedule(self, msec, function) :
+		self.sequence = self.sequence + 1
+		heapq.heappush(self.queue, (self.now + int(msec * 1000000), self.sequence, function))
+		return
+
+	# Runs the scheduled events for msec (or until the limit if None), stopping as
+	# soon as done() is true. Returns done().
+	def run(self, msec, done = None) :
+		if done != None and done() :
+			return True
+		end = None
+		if msec != None :
+			end = self.now + int(math.ceil(msec * 1000000))
+		if self.limit != None and (end == None or end > self.limit * 1000000) :
+			end = self.limit * 1000000
+		while self.queue and (end == None or self.queue[0][0] <= end) :
+			t, sequence, function = heapq.heappop(self.queue)
+			self.now = max(self.now, t)
+			function()
+			if done != None and done() :
+				return True
+		if end == None :
+			raise RuntimeError("Nothing left to happen on the virtual clock")
+		self.now = max(self.now, end)
+		if self.limit != None and self.now >= self.limit * 1000000 :
+			raise RuntimeError("The run went past the virtual clock limit of " + str(self.limit) + " msec")
+		return done != None and done()
+
+	def sleep(self, automaton, msec) :
+		self.run(msec)
+		return
+
+	def waitSensorActive(self, automaton, sensorlist) :
+		self.run(None, lambda : [s for s in sensorlist if s.getKnownState() == s.ACTIVE])
+		return
+
+	def waitSensorInactive(self, automaton, sensorlist) :
+		self.run(None, lambda : [s for s in sensorlist if s.getKnownState() == s.INACTIVE])
+		return
+
+	def waitChange(self, automaton, beanlist) :
+		states = [b.getKnownState() for b in beanlist]
+		self.run(None, lambda : [b.getKnownState() for b in beanlist] != states)
+		return
+
+####################################################################################
+#
+# VirtualCondition stands in for threading.Condition on a VirtualClock. There is
+# only one thread, so there is nothing to lock; wait() runs the clock until an
+# event calls notify() or the timeout (sec) is up.
+#
+####################################################################################
+class VirtualCondition :
+
+	def __init__(self, clock) :
+		self.clock = clock
+		self.notified = False
+		return
+
+	def acquire(self) :
+		return True
+
+	def release(self) :
+		return
+
+	def wait(self, timeout = None) :
+		self.notified = False
+		if timeout == None :
+			self.clock.run(None, lambda : self.notified)
+		else :
+			self.clock.run(timeout * 1000.0, lambda : self.notified)
+		return
+
+	def notify(self) :
+		self.notified = True
+		return
+
+	def notifyAll(self) :
+		self.notified = True
+		return
+
+# Every session shares the clock; one set before the script runs is kept
+try :
+	testbedClock
+except NameError :
+	testbedClock = TestbedClock()
+
+####################################################################################
+#
+# SensorEdgeCapture is a property change listener attached to the block sensors.
+# It stamps every sensor transition with the clock's nanos() the moment the event
+# arrives, so a speed measurement no longer includes the time it takes the
+# automaton thread to wake up after waitSensorActive() returns.
+#
+####################################################################################
+class SensorEdgeCapture(java.beans.PropertyChangeListener) :
+
+	def __init__(self, clock) :
+		self.clock = clock
+		self.sensorlist = []
+		self.observers = []		# called with (sensor, state, nanoTime) for every edge
+		self.lastEdge = 0		# nanoTime of the last edge on any sensor
+		return
+
+	def addObserver(self, observer) :
+		self.observers.append(observer)
+		return
+
+	def attach(self, sensorlist) :
+		for s in sensorlist :
+			if s not in self.sensorlist :
+				s.addPropertyChangeListener(self)
+				self.sensorlist.append(s)
+		return
+
+	def detach(self) :
+		for s in self.sensorlist :
+			s.removePropertyChangeListener(self)
+		self.sensorlist = []
+		return
+
+	def propertyChange(self, event) :
+		if (event.getPropertyName() == "KnownState") :
+			stamp = self.clock.nanos()
+			sensor = event.getSource()
+			self.lastEdge = stamp
+			for observer in self.observers :
+				observer(sensor, event.getNewValue(), stamp)
+		return
+
+####################################################################################
+#
+# SpeedEstimator keeps a sliding window of block transit times for the whole
+# session. Each rising edge on a loop sensor that follows an edge on the
+# neighbouring sensor is one block transit. When the throttle changes, the
+# transits that started before the change are dropped and measureSpeed() takes
+# its samples from the transits that follow, grouped into as many blocks as the
+# speed needs, without first waiting for a particular sensor to start the timing.
+#
+####################################################################################
+class SpeedEstimator :
+
+	def __init__(self, sensorlist, blocklengths, window, clock) :
+		self.clock = clock
+		self.sensorlist = list(sensorlist)	# loop sensors in track order
+		self.blocklengths = blocklengths	# length of the block that starts at each sensor
+		self.window = window		# maximum number of transits kept
+		self.transits = []			# (starttime, stoptime, direction, sensor index), oldest first
+		self.lastedge = None		# (sensor index, time) of the last rising edge
+		self.cutoff = 0.0			# transits must start after this time (msec)
+		self.used = 0				# transits already handed out since the last change
+		self.lock = clock.condition()
+		self.observers = []			# called with each transit as it is timed
+		return
+
+	def addObserver(self, observer) :
+		self.observers.append(observer)
+		return
+
+	# Observer for SensorEdgeCapture, called on the layout thread for every edge
+	def sensorEdge(self, sensor, state, stamp) :
+		if (state != sensor.ACTIVE) or (sensor not in self.sensorlist) :
+			return
+		index = self.sensorlist.index(sensor)
+		now = stamp / 1000000.0
+		n = len(self.sensorlist)
+		self.lock.acquire()
+		try :
+			if self.lastedge != None :
+				lastindex, lasttime = self.lastedge
+				if index == lastindex :
+					return		# same block dropped out and came back, keep the first edge
+				if index == (lastindex + 1) % n :
+					direction = 1
+				elif index == (lastindex - 1) % n :
+					direction = -1
+				else :
+					direction = 0	# missed a sensor, this edge can only start a transit
+				if direction != 0 and lasttime >= self.cutoff :
+					self.transits.append((lasttime, now, direction, lastindex))
+					for observer in self.observers :
+						observer(self.transits[-1])
+					if len(self.transits) > self.window :
+						del self.transits[0]
+						self.used = max(0, self.used - 1)
+			self.lastedge = (index, now)
+			self.lock.notifyAll()
+		finally :
+			self.lock.release()
+		return
+
+	# Called whenever the throttle speed or direction changes. Transits that start
+	# before the locomotive has had settle msec at the new setting are not used.
+	def markChange(self, settle) :
+		self.lock.acquire()
+		try :
+			self.cutoff = self.clock.nanos() / 1000000.0 + settle
+			self.transits = []
+			self.used = 0
+		finally :
+			self.lock.release()
+		return
+
+	# Returns the next nblocks unused transits that follow each other end to start
+	# in the same direction, waiting for the locomotive to cross them if they have
+	# not been seen yet. With stallmsec, returns None once no sensor has gone active
+	# for that long, since the locomotive has stalled.
+	def takeTransits(self, nblocks, stallmsec = None) :
+		self.lock.acquire()
+		try :
+			start = self.clock.nanos() / 1000000.0
+			while True :
+				first = self.used
+				for k in range(self.used, len(self.transits)) :
+					if k > first and (self.transits[k][0] != self.transits[k - 1][1] or self.transits[k][2] != self.transits[k - 1][2]) :
+						first = k		# chain broken, start the group again here
+					if k - first + 1 == nblocks :
+						self.used = k + 1
+						return self.transits[first:k + 1]
+				if stallmsec == None :
+					self.lock.wait(1.0)
+					continue
+				moved = start
+				if self.lastedge != None :
+					moved = max(moved, self.lastedge[1])
+				still = self.clock.nanos() / 1000000.0 - moved
+				if still >= stallmsec :
+					return None
+				self.lock.wait(min(1000.0, stallmsec - still) / 1000.0)
+		finally :
+			self.lock.release()
+
+	# Hands the last count transits out again, for when they were taken for one
+	# purpose but are also good speed samples
+	def rewind(self, count) :
+		self.lock.acquire()
+		try :
+			self.used = max(0, self.used - count)
+		finally :
+			self.lock.release()
+		return
+
+	# Returns (length, duration in msec) of the next nblocks blocks crossed. The
+	# length is the sum of the lengths of the blocks actually crossed. Returns
+	# None if the locomotive stalled, see takeTransits().
+	def takeSample(self, nblocks, stallmsec = None) :
+		transits = self.takeTransits(nblocks, stallmsec)
+		if transits == None :
+			return None
+		length = 0.0
+		for t in transits :
+			length = length + self.blocklengths[t[3]]
+		return length, transits[-1][1] - transits[0][0]
+
+####################################################################################
+#
+# ThrottleModel holds every (throttle setting, speed) point measured in one
+# direction during a run and predicts the throttle setting for a target speed.
+# The points get a monotone (pool adjacent violators) fit first, so one noisy
+# measurement can't make the speed drop as the throttle goes up, then the
+# prediction is the secant between the fitted points either side of the target.
+#
+####################################################################################
+class ThrottleModel :
+
+	def __init__(self) :
+		self.points = {}		# throttle setting -> measured speed (MPH)
+		self.anchors = {}		# throttle setting -> assumed speed, only used to predict
+		return
+
+	def setPoints(self, points) :
+		self.points = points
+		return
+
+	def addAnchor(self, setting, speed) :
+		self.anchors[setting] = speed
+		return
+
+	# Returns the measured settings either side of the target: the highest that was
+	# too slow and the lowest that was fast enough. Either may be None.
+	def bracket(self, target) :
+		lo = hi = None
+		for setting in self.points.keys() :
+			if self.points[setting] < target :
+				if lo == None or setting > lo :
+					lo = setting
+			elif hi == None or setting < hi :
+				hi = setting
+		return lo, hi
+
+	# Returns a list of (setting, speed) in throttle order with speed never decreasing
+	def fit(self) :
+		merged = dict(self.anchors)
+		merged.update(self.points)
+		blocks = []		# [total speed, number of points, settings] pooled together
+		keys = merged.keys()
+		keys.sort()
+		for setting in keys :
+			blocks.append([merged[setting], 1, [setting]])
+			while len(blocks) > 1 and blocks[-2][0] / blocks[-2][1] > blocks[-1][0] / blocks[-1][1] :
+				last = blocks.pop()
+				blocks[-1][0] = blocks[-1][0] + last[0]
+				blocks[-1][1] = blocks[-1][1] + last[1]
+				blocks[-1][2].extend(last[2])
+		fitted = []
+		for b in blocks :
+			for setting in b[2] :
+				fitted.append((setting, b[0] / b[1]))
+		return fitted
+
+	# Returns the (fractional) throttle setting predicted to give the target speed
+	def predict(self, target) :
+		fitted = self.fit()
+		if len(fitted) == 0 :
+			return 127.0
+		i = 0
+		while i < len(fitted) and fitted[i][1] < target :
+			i = i + 1
+		if i == 0 :
+			# below every point, extrapolate from the first two different speeds
+			lo = fitted[0]
+			hi = None
+			for p in fitted[1:] :
+				if p[1] > lo[1] :
+					hi = p
+					break
+		elif i == len(fitted) :
+			# above every point, extrapolate from the last two different speeds
+			hi = fitted[-1]
+			lo = None
+			for p in reversed(fitted[:-1]) :
+				if p[1] < hi[1] :
+					lo = p
+					break
+		else :
+			lo = fitted[i - 1]
+			hi = fitted[i]
+		if lo == None :
+			return float(hi[0])
+		if hi == None :
+			return float(lo[0])
+		return lo[0] + (target - lo[1]) * (hi[0] - lo[0]) / (hi[1] - lo[1])
+
+	# Returns the fitted speed at a throttle setting, interpolating between points
+	def speedAt(self, setting) :
+		fitted = self.fit()
+		if len(fitted) == 0 :
+			return 0.0
+		if setting <= fitted[0][0] :
+			return fitted[0][1]
+		for i in range(1, len(fitted)) :
+			if setting <= fitted[i][0] :
+				lo = fitted[i - 1]
+				hi = fitted[i]
+				return lo[1] + (setting - lo[0]) * (hi[1] - lo[1]) / (hi[0] - lo[0])
+		return fitted[-1][1]
+
+####################################################################################
+#
+# MeasurementCache remembers every speed measured during a run, keyed by
+# direction and throttle setting, with its precision and when it was measured.
+# Entries older than maxage msec are dropped, since the motor drifts as it runs.
+#
+####################################################################################
+class MeasurementCache :
+
+	def __init__(self, maxage, clock) :
+		self.maxage = maxage
+		self.clock = clock
+		self.entries = {}		# (forward, setting) -> (speed, precision, time msec)
+		return
+
+	def put(self, forward, setting, speed, precision) :
+		self.entries[(forward, setting)] = (speed, precision, self.clock.millis())
+		return
+
+	def expire(self) :
+		now = self.clock.millis()
+		for key in self.entries.keys() :
+			if now - self.entries[key][2] > self.maxage :
+				del self.entries[key]
+		return
+
+	# Returns (speed, precision, time msec) or None if there is no fresh measurement
+	def get(self, forward, setting) :
+		self.expire()
+		return self.entries.get((forward, setting))
+
+	# Returns {setting: speed} of the fresh measurements in one direction
+	def points(self, forward) :
+		self.expire()
+		points = {}
+		for key in self.entries.keys() :
+			if key[0] == forward :
+				points[key[1]] = self.entries[key][0]
+		return points
+
+	# Returns the fresh measurements as [forward, setting, speed, precision] lists
+	def save(self) :
+		self.expire()
+		return [[key[0], key[1], self.entries[key][0], self.entries[key][1]] for key in self.entries.keys()]
+
+	# Puts back measurements from save(); they count as taken now
+	def restore(self, saved) :
+		for forward, setting, speed, precision in saved :
+			self.put(forward, setting, speed, precision)
+		return
+
+####################################################################################
+#
+# CVWrite is the completion of one CV write. The automaton thread sleeps in
+# wait() until the programmer calls back through myCVListener(), instead of
+# spinning on a flag, and gives up after a timeout if the callback never comes.
+#
+####################################################################################
+class CVWrite :
+
+	def __init__(self, cv, value, clock) :
+		self.cv = cv
+		self.value = value
+		self.clock = clock
+		self.condition = clock.condition()
+		self.done = False
+		self.status = None
+		self.attempts = 0
+		self.sent = self.clock.nanos()
+		self.latency = None		# msec from the last send to the acknowledgement
+		return
+
+	def send(self) :
+		self.condition.acquire()
+		self.done = False
+		self.status = None
+		self.attempts = self.attempts + 1
+		self.sent = self.clock.nanos()
+		self.condition.release()
+		return
+
+	# msec since the write was last sent
+	def age(self) :
+		return (self.clock.nanos() - self.sent) / 1000000.0
+
+	def acknowledge(self, status) :
+		self.condition.acquire()
+		self.status = status
+		self.latency = (self.clock.nanos() - self.sent) / 1000000.0
+		self.done = True
+		self.condition.notifyAll()
+		self.condition.release()
+		return
+
+	# Returns True if the write was acknowledged within timeout msec
+	def wait(self, timeout) :
+		deadline = self.clock.millis() + timeout
+		self.condition.acquire()
+		try :
+			while not self.done :
+				remaining = deadline - self.clock.millis()
+				if remaining <= 0 :
+					break
+				self.condition.wait(remaining / 1000.0)
+			return self.done
+		finally :
+			self.condition.release()
+
+####################################################################################
+#
+# CVWritePipeline sends a batch of (CV, value) writes with up to inflight of them
+# outstanding at once. Each write has its own listener, so the acknowledgements
+# are matched to their writes and each one sends the next write in the batch;
+# no thread is needed. report(write, ok) is called as each write completes or
+# fails, and retries go to log(). wait() retries writes that time out and
+# returns once the batch is done, so the caller can run the locomotive home
+# while the batch is being written.
+#
+####################################################################################
+class CVWritePipeline :
+
+	def __init__(self, programmer, inflight, timeout, retries, report, clock, log) :
+		self.programmer = programmer
+		self.inflight = max(1, inflight)
+		self.timeout = timeout
+		self.retries = retries
+		self.report = report
+		self.log = log			# log(event, text, fields) for the retries
+		self.clock = clock
+		self.condition = clock.condition()
+		self.queue = []
+		self.sending = []
+		self.completed = []
+		self.failed = []
+		return
+
+	def submit(self, batch) :
+		self.condition.acquire()
+		for cv, value in batch :
+			self.queue.append(CVWrite(cv, value, self.clock))
+		self.sendNext()
+		self.condition.release()
+		return
+
+	# Called with the condition held. A write the programmer refuses because it is
+	# still busy counts as an attempt, as in testbedWriteCV(): it stays in sending
+	# with no reply to come, so wait() retries it once it has timed out.
+	def sendNext(self) :
+		while len(self.sending) < self.inflight and len(self.queue) > 0 :
+			write = self.queue.pop(0)
+			write.send()
+			self.sending.append(write)
+			try :
+				self.programmer.writeCV(write.cv, write.value, lambda value, status, write=write : self.reply(write, status))
+			except jmri.ProgrammerException, e :
+				write.status = "busy"
+				self.log("cv", "CV %d write refused, the programmer is busy, attempt %d of %d" % (write.cv, write.attempts, self.retries),
+					{"op": "write", "cv": write.cv, "value": write.value, "status": "busy", "attempt": write.attempts})
+				break
+		return
+
+	# Called with the condition held, for a write that failed or timed out
+	def retry(self, write) :
+		if write.attempts < self.retries :
+			self.queue.insert(0, write)
+		else :
+			self.failed.append(write)
+			self.report(write, False)
+		return
+
+	def reply(self, write, status) :
+		self.condition.acquire()
+		try :
+			if write not in self.sending :
+				return		# a late reply to a write that already timed out
+			self.sending.remove(write)
+			write.acknowledge(status)
+			if (status == jmri.ProgListener.OK) :
+				self.completed.append(write)
+				self.report(write, True)
+			else :
+				self.log("cv", "CV %d write failed with status %s, attempt %d of %d" % (write.cv, status, write.attempts, self.retries),
+					{"op": "write", "cv": write.cv, "value": write.value, "status": status, "attempt": write.attempts})
+				self.retry(write)
+			self.sendNext()
+			self.condition.notifyAll()
+		finally :
+			self.condition.release()
+		return
+
+	def busy(self) :
+		return len(self.queue) > 0 or len(self.sending) > 0
+
+	# Waits for the whole batch and returns True if every write succeeded
+	def wait(self) :
+		self.condition.acquire()
+		try :
+			while self.busy() :
+				for write in self.sending[:] :
+					if write.age() >= self.timeout :
+						if write.status <> "busy" :
+							self.log("cv", "CV %d write timed out, attempt %d of %d" % (write.cv, write.attempts, self.retries),
+								{"op": "write", "cv": write.cv, "value": write.value, "status": "timeout", "attempt": write.attempts})
+						self.sending.remove(write)
+						self.retry(write)
+				self.sendNext()
+				if self.busy() :
+					self.condition.wait(0.05)
+			return len(self.failed) == 0
+		finally :
+			self.condition.release()
+
+####################################################################################
+#
+# DecoderShadow is what we know of the CV values in the decoder, from the
+# service mode reads, the writes that were acknowledged, and the values saved in
+# the profile of the last run. A write is only sent if the value differs.
+#
+####################################################################################
+class DecoderShadow :
+
+	def __init__(self, values = None) :
+		self.values = {}
+		if values != None :
+			for cv in values.keys() :	# the keys are strings once saved as JSON
+				self.values[int(cv)] = int(values[cv])
+		return
+
+	def set(self, cv, value) :
+		self.values[int(cv)] = int(value)
+		return
+
+	def matches(self, cv, value) :
+		return self.values.get(int(cv)) == int(value)
+
+	def unknown(self, cvlist) :
+		return [cv for cv in cvlist if not self.values.has_key(cv)]
+
+####################################################################################
+#
+# TestbedLoops describes each track loop of the testbed: its block sensors in
+# track order, the home sensor, the nominal length of one block in scale feet
+# and the file its calibrated block lengths are kept in. The loop name is also
+# the DCCPower loop.
+#
+# Two sessions only run at the same time if their loops have separate sensors.
+# On Erich's testbed the HO and N loops share sensors Block:1 - Block:12, so
+# sessions on the two loops take turns there.
+#
+####################################################################################
+TestbedLoops = {
+	# 132.65 feet Erich's Speed Matching Track Kato Unitrack 19" Radius - 12 Sections / 24 Pieces
+	"N" : {"sensors": ["Block:%d" % i for i in range(1, 13)],
+		"home": "Block:12",
+		"blocklength": 132.65,
+		"blockfile": "blocklengths.txt"},
+	# 61.64 feet Erich's Speed Matching Track Kato Unitrack 21 5/8" Radius - 16 Sections / 16 Pieces
+	"HO" : {"sensors": ["Block:%d" % i for i in range(12, 17) + range(1, 12)],
+		"home": "Block:12",
+		"blocklength": 61.64,
+		"blockfile": "blocklengths_HO.txt"},
+}
+
+####################################################################################
+#
+# TestbedArbiter coordinates the calibration sessions running on different loops.
+#
+# The ProgMain turnout switches every loop between the main DCC and the program
+# track, so a session may only take the program track once no other session is
+# using the main, and sessions wanting it go ahead of new users of the main.
+# A session also waits until no other session is using any of its sensors.
+#
+####################################################################################
+class TestbedArbiter :
+
+	def __init__(self, clock) :
+		self.condition = clock.condition()
+		self.mainUsers = []		# loops running on the main DCC
+		self.programUser = None		# loop holding the program track
+		self.programWaiting = 0
+		self.sensorUsers = {}		# loop -> sensor names it is using
+		return
+
+	# say(text) tells the session's log when it has to wait
+	def acquireSensors(self, loop, names, say) :
+		self.condition.acquire()
+		try :
+			if self.sharesSensors(loop, names) :
+				say("Waiting for another loop to finish with its sensors")
+			while self.sharesSensors(loop, names) :
+				self.condition.wait(60.0)
+			self.sensorUsers[loop] = names
+		finally :
+			self.condition.release()
+		return
+
+	# Called with the condition held
+	def sharesSensors(self, loop, names) :
+		for other in self.sensorUsers.keys() :
+			if other <> loop :
+				for name in names :
+					if name in self.sensorUsers[other] :
+						return True
+		return False
+
+	def acquireMain(self, loop) :
+		self.condition.acquire()
+		try :
+			if self.programUser == loop :
+				self.programUser = None
+				self.condition.notifyAll()
+			while loop not in self.mainUsers and (self.programUser != None or self.programWaiting > 0) :
+				self.condition.wait(60.0)
+			if loop not in self.mainUsers :
+				self.mainUsers.append(loop)
+		finally :
+			self.condition.release()
+		return
+
+	def acquireProgram(self, loop, say) :
+		self.condition.acquire()
+		try :
+			if loop in self.mainUsers :
+				self.mainUsers.remove(loop)
+				self.condition.notifyAll()
+			self.programWaiting = self.programWaiting + 1
+			if self.programUser not in (None, loop) or len(self.mainUsers) > 0 :
+				say("Waiting for the program track")
+			while self.programUser not in (None, loop) or len(self.mainUsers) > 0 :
+				self.condition.wait(60.0)
+			self.programWaiting = self.programWaiting - 1
+			self.programUser = loop
+		finally :
+			self.condition.release()
+		return
+
+	def holdsProgram(self, loop) :
+		return self.programUser == loop
+
+	# Called by a session on the main while its locomotive is stopped. If another
+	# session is waiting for the program track, the main is handed over until that
+	# session is done with it. Returns True if the session had to wait.
+	def yieldMain(self, loop) :
+		self.condition.acquire()
+		try :
+			if self.programWaiting == 0 or loop not in self.mainUsers :
+				return False
+			self.mainUsers.remove(loop)
+			self.condition.notifyAll()
+			while self.programUser != None or self.programWaiting > 0 :
+				self.condition.wait(60.0)
+			self.mainUsers.append(loop)
+			return True
+		finally :
+			self.condition.release()
+
+	# Lets go of everything the loop's session is holding
+	def release(self, loop) :
+		self.condition.acquire()
+		if loop in self.mainUsers :
+			self.mainUsers.remove(loop)
+		if self.programUser == loop :
+			self.programUser = None
+		if self.sensorUsers.has_key(loop) :
+			del self.sensorUsers[loop]
+		self.condition.notifyAll()
+		self.condition.release()
+		return
+
+# The arbiter must be shared by every session, including ones started by running
+# this script again, so an existing one is kept
+try :
+	testbedArbiter
+except NameError :
+	testbedArbiter = TestbedArbiter(testbedClock)
+
+####################################################################################
+#
+# ProfileStore keeps what was learned about each locomotive between runs, as
+# JSON files in a directory. A locomotive profile is keyed by its address, the
+# manufacturer ID and version (CV8/CV7) and the private ID (CV105/CV106) the
+# testbed writes, and holds the throttle to speed points and the final table.
+# A model profile, keyed by manufacturer ID and version, holds the average
+# throttle to speed curve of every run of that model, as a fraction of full speed.
+#
+####################################################################################
+class ProfileStore :
+
+	def __init__(self, directory) :
+		self.directory = directory
+		if not os.path.isdir(directory) :
+			os.makedirs(directory)
+		return
+
+	def locomotiveKey(self, address, mfrID, mfrVersion, cv105, cv106) :
+		return "loco_%d_%d_%d_%d_%d" % (address, mfrID, mfrVersion, cv105, cv106)
+
+	def modelKey(self, mfrID, mfrVersion) :
+		return "model_%d_%d" % (mfrID, mfrVersion)
+
+	def identityKey(self, cv105, cv106) :
+		return "identity_%d_%d" % (cv105, cv106)
+
+	def checkpointKey(self, address, mfrID, mfrVersion, cv105, cv106) :
+		return "checkpoint_%d_%d_%d_%d_%d" % (address, mfrID, mfrVersion, cv105, cv106)
+
+	def load(self, key) :
+		path = os.path.join(self.directory, key + ".json")
+		if not os.path.exists(path) :
+			return None
+		f = open(path, "r")
+		try :
+			return json.load(f)
+		finally :
+			f.close()
+
+	def save(self, key, data) :
+		f = open(os.path.join(self.directory, key + ".json"), "w")
+		try :
+			json.dump(data, f, indent = 1)
+		finally :
+			f.close()
+		return
+
+	def remove(self, key) :
+		path = os.path.join(self.directory, key + ".json")
+		if os.path.exists(path) :
+			os.remove(path)
+		return
+
+	# Adds the points of one run, as fractions of its full throttle speed, to the
+	# running totals kept for the decoder model
+	def addToModel(self, mfrID, mfrVersion, points, maxspeed) :
+		key = self.modelKey(mfrID, mfrVersion)
+		data = self.load(key)
+		if data == None :
+			data = {"mfrID": mfrID, "mfrVersion": mfrVersion, "runs": 0, "totals": {}}
+		for setting, speed in points :
+			total = data["totals"].get(str(setting), [0.0, 0])
+			data["totals"][str(setting)] = [total[0] + speed / maxspeed, total[1] + 1]
+		data["runs"] = data["runs"] + 1
+		self.save(key, data)
+		return
+
+	# Returns [(setting, fraction of full speed)] averaged over every run of the model
+	def modelCurve(self, mfrID, mfrVersion) :
+		data = self.load(self.modelKey(mfrID, mfrVersion))
+		if data == None :
+			return None
+		curve = []
+		for setting in data["totals"].keys() :
+			total = data["totals"][setting]
+			curve.append((int(setting), total[0] / total[1]))
+		curve.sort()
+		return curve
+
+####################################################################################
+#
+# RecordWriter writes records to a file, one JSON line each, on its own thread.
+# write() only puts the record on a queue, so the automaton and the layout thread
+# never wait for the file or the console. A record can carry text to print on the
+# console as it is written. close() returns once everything queued is written.
+#
+####################################################################################
+class RecordWriter :
+
+	def __init__(self, path) :
+		self.path = path
+		self.queue = Queue.Queue()
+		self.file = open(path, "w")
+		self.thread = threading.Thread(target = self.run, name = "Testbed record writer")
+		self.thread.setDaemon(True)
+		self.thread.start()
+		return
+
+	def write(self, record, text = None) :
+		self.queue.put((record, text))
+		return
+
+	def run(self) :
+		while True :
+			item = self.queue.get()
+			if item == None :
+				break
+			record, text = item
+			self.file.write(json.dumps(record) + "\n")
+			if text != None :
+				print (text)
+		self.file.close()
+		return
+
+	def close(self) :
+		self.queue.put(None)
+		self.thread.join()
+		return
+
+####################################################################################
+#
+# EventLog is the record of a calibration run: one record per block transit,
+# speed measurement, throttle search step, CV operation, status change and
+# message, each with the time (msec) and the run it belongs to. The console shows
+# the text of the records that have it, when console is True.
+#
+#	transit		sensor, start, stop (msec), direction, length, speed
+#	measurement	target, n, blocks, length, msec, speed (one sample of measureSpeed())
+#	speed		target, speed, precision, count (the result of measureSpeed())
+#	search		action, target, setting and the speed found for it
+#	cv		op (read, write or skip), cv, value, and how the write went
+#	direction	forward, when a direction change was not taken
+#	status		status
+#	message		everything else the script used to print
+#
+####################################################################################
+class EventLog :
+
+	def __init__(self, path, clock, run, console) :
+		self.clock = clock
+		self.run = run
+		self.console = console
+		self.writer = RecordWriter(path)
+		self.path = path
+		return
+
+	def record(self, event, text, fields = None) :
+		record = {"time": self.clock.millis(), "run": self.run, "event": event}
+		if fields != None :
+			record.update(fields)
+		if text != None :
+			record["text"] = text
+		if not self.console :
+			text = None
+		self.writer.write(record, text)
+		return
+
+	def close(self) :
+		self.writer.close()
+		return
+
+####################################################################################
+#
+# TraceRecorder writes what happens during a run to a trace file, one event per
+# line as a JSON list: the time in usec since the trace started, the kind of event
+# and its fields. The lines are written by a RecordWriter. TraceReplay.py feeds
+# the sensor edges and throttle changes of a trace back through measureSpeed()
+# on a virtual clock.
+#
+#	H	header: a dictionary with the loop, its sensors and block lengths, and
+#		whether those came from a block length table
+#	E	sensor edge: sensor name, new state (time of the edge from the listener)
+#	S	throttle speed: setting, settle msec
+#	D	throttle direction: forward, settle msec
+#	R	service mode read: CV, value
+#	W	CV write: CV, value, whether it succeeded
+#	B	block lengths measured or estimated during the run: lengths
+#	M	measureSpeed() starts: target speed, last measured speed
+#	m	measureSpeed() result: speed, precision
+#	X	status: text
+#
+####################################################################################
+class TraceRecorder :
+
+	def __init__(self, path, clock, header) :
+		self.path = path
+		self.clock = clock
+		self.start = clock.nanos()
+		self.writer = RecordWriter(path)
+		self.record("H", header)
+		return
+
+	def record(self, kind, *fields) :
+		self.recordAt(self.clock.nanos(), kind, *fields)
+		return
+
+	def recordAt(self, stamp, kind, *fields) :
+		self.writer.write([int((stamp - self.start) / 1000), kind] + list(fields))
+		return
+
+	# Observer for SensorEdgeCapture
+	def sensorEdge(self, sensor, state, stamp) :
+		self.recordAt(stamp, "E", sensor.getDisplayName(), state)
+		return
+
+	def close(self) :
+		self.writer.close()
+		return
+
+####################################################################################
+#
+# Create an instance of the AbstractAutomation class 
+#
+####################################################################################	
+class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
+	
+####################################################################################
+#
+# self.init() called exactly once at the startup to do any necessary configuration
+#
+####################################################################################	
+	def init(self) :
+	    # individual block section length (scale feet)
+		self.scriptversion = 3.0
+		# Speed measurements stop as soon as the 95% confidence interval on the mean
+		# is within SpeedTolerance MPH, or when MaxSpeedMeasurements have been taken
+		self.MinSpeedMeasurements = 2
+		self.MaxSpeedMeasurements = 8
+		self.SpeedTolerance = 0.5
+		self.speedPrecision = 0.0	# confidence interval half width of the last measurement
+		# Student t values for a 95% two sided interval, by degrees of freedom
+		self.StudentT = {1:12.706, 2:4.303, 3:3.182, 4:2.776, 5:2.571, 6:2.447, 7:2.365, 8:2.306, 9:2.262, 10:2.228}
+		# Throttle settings measured by a single sweep, from low to high
+		self.SweepSettings = [6, 12, 20, 30, 42, 56, 72, 90, 110]
+		# The written table is checked at the measured speed steps. A step more than
+		# VerifyTolerance MPH (plus the measurement precision) from its target is
+		# corrected and the table rewritten, up to VerifyMaxIterations times.
+		self.VerifyTolerance = 1.0
+		self.VerifyMaxIterations = 3
+		self.SettleMsec = 100		# time allowed at a new throttle setting before a transit counts
+		self.EstimatorWindow = 96	# block transits kept by the speed estimator (8 laps)
+		self.long = False
+		self.addr = 0
+		# Warm-up ends once the last WarmupStableLaps lap times agree within
+		# WarmupTolerance (a fraction of the lap time), within the lap limits
+		self.WarmupMinLaps = 2
+		self.WarmupMaxLaps = 5
+		self.WarmupStableLaps = 2
+		self.WarmupTolerance = 0.01
+		self.warmupCurve = {}		# lap times (sec) of each warm-up, by direction
+		self.programmer = None
+		self.throttle = None
+		# Each CV write waits up to CVWriteTimeoutMsec for the programmer to
+		# acknowledge it and is sent up to CVWriteRetries times
+		self.CVWriteTimeoutMsec = 3000
+		self.CVWriteRetries = 3
+		self.writeLatencies = []	# msec of every acknowledged write
+		# The speed table and the CVs that go with it are written as one batch with
+		# up to CVWriteInFlight writes outstanding. JMRI's LocoNet ops mode programmer
+		# refuses a write while another one is outstanding, so only raise it for a
+		# command station that takes overlapping writes. With OverlapTableWrites the
+		# batch is written while the locomotive runs home.
+		self.CVWriteInFlight = 1
+		self.OverlapTableWrites = True
+		# CV writes are skipped when the shadow says the decoder already has the
+		# value. With ReadShadowCVs the CVs the run writes are read in service mode
+		# when neither the reads nor the last profile say what they hold.
+		self.shadow = DecoderShadow()
+		self.ReadShadowCVs = False
+		self.ShadowCVs = [2, 3, 4, 5, 6, 19, 25, 29, 62, 66, 95] + range(67, 95)
+		self.skippedWrites = 0
+		# Service mode reads try each of these modes the programmer supports on one
+		# read, in this order, and then use the one that read fastest. A direct bit
+		# read takes 8 verifies and a confirm; a direct byte read can take up to 256
+		# verifies on command stations that cannot read back. readModeMsec is how
+		# long the trial read took in each mode, None if it failed.
+		self.ReadModes = ["DIRECTBITMODE", "DIRECTBYTEMODE", "PAGEMODE"]
+		self.readModeMsec = {}
+		self.IdentityCVs = [29, 1, 17, 18, 7, 8]
+		self.fullSpeed = 100
+		self.clock = testbedClock
+
+		# The loop this session runs on, see TestbedLoops. Sessions on different
+		# loops can run at the same time; testbedArbiter shares the program track.
+		if not hasattr(self, "loopName") :
+			self.loopName = "N"
+		self.loop = TestbedLoops[self.loopName]
+		self.arbiter = testbedArbiter
+		self.block = self.loop["blocklength"]
+		self.homesensor = sensors.provideSensor(self.loop["home"])
+
+		# Every sensor of the loop, in track order. measureSpeed() groups as many
+		# of these blocks per measurement as the speed needs, see planBlocks().
+		self.LoopSensors = [sensors.provideSensor(name) for name in self.loop["sensors"]]
+
+		# Time stamp every transition of the measurement sensors as it arrives
+		self.edges = SensorEdgeCapture(self.clock)
+		self.edges.attach(self.LoopSensors)
+
+		# Effective length of the block that starts at each sensor of the loop. These
+		# are all self.block until a block calibration run has measured them, or the
+		# first warm-up of the run has estimated them.
+		self.BlockCalibrationLaps = 5
+		self.BlockCalibrationThrottle = 0.5
+		self.BlockLengthFile = self.loop["blockfile"]
+		self.BlockLengths = [self.block] * len(self.LoopSensors)
+		self.blockLengthsCalibrated = self.loadBlockLengths()
+
+		# Every speed measured during the run, so no setting is measured twice
+		self.CacheMaxAgeMsec = 600000
+		self.measurements = MeasurementCache(self.CacheMaxAgeMsec, self.clock)
+
+		# What earlier runs learned about each locomotive and decoder model
+		self.profiles = ProfileStore(self.testbedFile("profiles"))
+		self.profile = None
+
+		# Block transit times for the whole session, used by measureSpeed()
+		self.estimator = SpeedEstimator(self.LoopSensors, self.BlockLengths, self.EstimatorWindow, self.clock)
+		self.edges.addObserver(self.estimator.sensorEdge)
+
+		# Each session is recorded to a trace file in speedmatch/traces, and logged to
+		# an event log in speedmatch/logs. ConsoleLog shows the log on the console.
+		self.RecordTrace = True
+		self.trace = None
+		self.edges.addObserver(self.traceEdge)
+		self.LogEvents = True
+		self.ConsoleLog = True
+		self.eventLog = None
+		self.runId = None
+		self.estimator.addObserver(self.logTransit)
+				
+		# A measurement is grouped over enough blocks that its transit takes at least
+		# TransitPrecisionFactor times the detector timing uncertainty
+		self.DetectorUncertaintyMsec = 25
+		self.TransitPrecisionFactor = 20
+		self.lastMeasuredSpeed = 0.0
+		# A locomotive slower than StallSpeed (MPH) is taken to have stalled. The
+		# search never goes back to a setting at or below one that stalled.
+		self.StallSpeed = 1.0
+		self.speedStalled = False
+		self.stallFloor = {True: 0, False: 0}
+		
+		# Waits for the testbed to reach a state poll every WaitPollMsec and give up
+		# after the fixed delay they replace. Relays get RelaySettleMsec once their
+		# turnout reports the new state; a turnout without feedback gets the fixed
+		# delay.
+		self.WaitPollMsec = 20
+		self.RelaySettleMsec = 100
+		# The locomotive is stopped when its direction is changed, so the change is
+		# only confirmed by the first block it crosses afterwards, see checkDirection().
+		# directionChange is the msec of a change not yet confirmed, runSense the way
+		# round the loop (+1 or -1, in sensor order) the locomotive runs forward.
+		self.directionChange = None
+		self.runSense = None
+		self.estimator.addObserver(self.checkDirection)
+		# A locomotive has stopped once the occupied blocks have not changed for
+		# StopWindowFactor times the time it took to cross the longest block at the
+		# last speed measured, but never less than StopMinMsec. A locomotive whose
+		# blocks are still changing after StopMaxMsec is taken as stopped anyway.
+		self.StopWindowFactor = 2.0
+		self.StopMinMsec = 300
+		self.StopMaxMsec = 30000
+		self.waitLog = {}		# label -> [count, msec waited, msec of the fixed delays]
+
+		# Batch mode waits this long after the next locomotive is put on the loop
+		self.SwapSettleMsec = 5000
+		# Whether a batch job carries on from a checkpoint left by a stopped run
+		self.resumeStopped = True
+		self.jobNumber = 0
+		self.result = {}
+
+		self.DecoderMap = {141:"Tsunami", 129:"Digitrax", 153:"TCS", 11:"NCE", 113: "QSI/BLI", 99:"Lenz Gen 5", 151:"ESU", 127:"Atlas/Lenz XF"}
+		self.DecoderType = "Default"
 
+		#	These speed steps are measured.  All others are calculated
+		#	CV			70	74	78	82	86	90	94
+		#	Speedsteps	 4	 8	12	16	20	24	28
+
+		#	These lists are percentages of full speed
+		self.DigitraxStepList = [10, 22, 35, 47, 60, 72, 85]
+		self.Lenz5GenStepList = [17, 30, 44, 57, 71, 84, 98]
+		self.LenzXFStepList = [11, 26, 40.5, 55, 70, 84, 98.5]
+		self.NCEStepList = [10.5, 25, 39.5, 54,	68,	83,	98]
+		self.OldTCSStepList = [14.5, 28.5, 42.5, 57, 71.5, 86, 99]
+		self.NewTCSStepList = [13, 25.5, 38, 50.5, 63, 75.5, 88]
+		#	A new TCS decoder reaches the top of its table at about 88% throttle, so it
+		#	reads table entry z at speed step z * NewTCSTableScale
+		self.NewTCSTableScale = 0.88
+		self.tableScale = 1.0
+		self.QSIStepList = [11,	26,	41,	55,	70,	85,	99]
+		self.SoundtraxxDSDStepList = [14,	28,	42,	56,	70,	84,	99]
+		self.TsunamiStepList = [14.5,	28.5,	42.5,	57,	71,	85,	99]
+		self.ESUStepList = [12,	27,	41,	56,	70,	85,	99]
+		return
+
+####################################################################################
+#
+# self.testbedFile() returns the path of a file kept between runs in the
+# speedmatch directory of the JMRI user files location
+#
+####################################################################################
+	def testbedFile(self, name) :
+		directory = os.path.join(jmri.util.FileUtil.getUserFilesPath(), "speedmatch")
+		if not os.path.isdir(directory) :
+			os.makedirs(directory)
+		return os.path.join(directory, name)
+####################################################################################
+#
+# self.loadBlockLengths() reads the block length table written by a block
+# calibration run. Each line is a sensor name and the effective length (scale feet)
+# of the block that starts at that sensor. Returns True when every sensor of the
+# loop has a length.
+#
+####################################################################################
+	def loadBlockLengths(self) :
+		path = self.testbedFile(self.BlockLengthFile)
+		if not os.path.exists(path) :
+			return False
+		table = {}
+		f = open(path, "r")
+		for line in f.readlines() :
+			fields = line.split()
+			if len(fields) == 2 :
+				table[fields[0]] = float(fields[1])
+		f.close()
+		found = 0
+		for i in range(len(self.LoopSensors)) :
+			name = self.LoopSensors[i].getDisplayName()
+			if table.has_key(name) :
+				self.BlockLengths[i] = table[name]
+				found = found + 1
+		self.say("Loaded", found, "calibrated block lengths from", path)
+		return found == len(self.LoopSensors)
+####################################################################################
+#
+# self.saveBlockLengths() writes the block length table
+#
+####################################################################################
+	def saveBlockLengths(self) :
+		path = self.testbedFile(self.BlockLengthFile)
+		f = open(path, "w")
+		for i in range(len(self.LoopSensors)) :
+			f.write("%s %.3f\n" % (self.LoopSensors[i].getDisplayName(), self.BlockLengths[i]))
+		f.close()
+		self.say("Block lengths written to", path)
+		return
+####################################################################################
+#
+# self.calibrateBlockLengths() measures the effective length of every block
+#
+# A reference locomotive runs at a constant throttle setting for several laps.
+# A full lap is always the length of the loop, whatever the detector pickup
+# points are, so each block's share of the lap time gives its effective length.
+#
+####################################################################################
+	def calibrateBlockLengths(self) :
+		self.setStatus("Calibrating Block Lengths")
+		self.say("Calibrating block lengths over", self.BlockCalibrationLaps, "laps...")
+		n = len(self.LoopSensors)
+
+		self.setThrottleSpeed(self.BlockCalibrationThrottle, 2000)
+		laps = []
+		for lap in range(0, self.BlockCalibrationLaps) :
+			laps.append(self.estimator.takeTransits(n))
+			laptime = laps[-1][-1][1] - laps[-1][0][0]
+			self.say("    Lap ", lap+1, ", Time = ", str(round(laptime / 1000.0,3)), "sec")
+
+		self.fitBlockLengths(laps)
+		for i in range(n) :
+			self.say("    Block", self.LoopSensors[i].getDisplayName(), "=", str(round(self.BlockLengths[i],2)), "feet")
+		self.saveBlockLengths()
+		return
+####################################################################################
+#
+# self.fitBlockLengths() sets every block length to its share of the lap time
+# over the given laps, each a list of the transits of one whole lap
+#
+####################################################################################
+	def fitBlockLengths(self, laps) :
+		n = len(self.LoopSensors)
+		looplength = sum(self.BlockLengths)
+		fractions = [0.0] * n
+		for transits in laps :
+			laptime = transits[-1][1] - transits[0][0]
+			for t in transits :
+				fractions[t[3]] = fractions[t[3]] + (t[1] - t[0]) / laptime
+		for i in range(n) :
+			self.BlockLengths[i] = looplength * fractions[i] / len(laps)
+		self.blockLengthsCalibrated = True
+		self.traceEvent("B", self.BlockLengths)
+		return
+####################################################################################
+#
+# self.myCVListener() Provides an acknowledgement after a CV write operation
+# JMD: A listener is required for writeCV method, and this is the listener.
+# JMD: The writeCV call is made from testbedWriteCV.
+# The status is handed to the write it answers, which wakes the automaton thread.
+#
+####################################################################################	
+	def myCVListener(self, write, value, status) :
+		write.acknowledge(status)
+		return
+####################################################################################
+#
+# self.testbedWriteCV() Writes a CV and sleeps until the programmer acknowledges
+# it. A write that times out or comes back with an error status is sent again,
+# up to CVWriteRetries times. Returns True if the write succeeded.
+#
+# Each attempt has its own CVWrite, so a late acknowledgement of an attempt that
+# timed out is not taken for the next one. If the programmer is still busy with
+# that attempt it refuses the write, and the next attempt waits for it first.
+#
+####################################################################################	
+	def testbedWriteCV(self, cv, value) :
+		if self.shadow.matches(cv, value) :
+			self.skippedWrites = self.skippedWrites + 1
+			self.logEvent("cv", None, {"op": "skip", "cv": cv, "value": value})
+			return True
+		for attempt in range(1, self.CVWriteRetries + 1) :
+			write = CVWrite(cv, value, self.clock)
+			write.send()
+			try :
+				self.programmer.writeCV(cv, value, lambda v, status, write=write : self.myCVListener(write, v, status))
+			except jmri.ProgrammerException, e :
+				self.logEvent("cv", "CV %d write refused, the programmer is busy, attempt %d of %d" % (cv, attempt, self.CVWriteRetries),
+					{"op": "write", "cv": cv, "value": value, "status": "busy", "attempt": attempt})
+				self.pause(self.CVWriteTimeoutMsec)
+				continue
+			if not write.wait(self.CVWriteTimeoutMsec) :
+				self.logEvent("cv", "CV %d write timed out, attempt %d of %d" % (cv, attempt, self.CVWriteRetries),
+					{"op": "write", "cv": cv, "value": value, "status": "timeout", "attempt": attempt})
+			elif (write.status <> jmri.ProgListener.OK) :
+				self.logEvent("cv", "CV %d write failed with status %s, attempt %d of %d" % (cv, write.status, attempt, self.CVWriteRetries),
+					{"op": "write", "cv": cv, "value": value, "status": write.status, "attempt": attempt})
+			else :
+				self.writeLatencies.append(write.latency)
+				self.shadow.set(cv, value)
+				self.traceEvent("W", cv, value, True)
+				self.logEvent("cv", None, {"op": "write", "cv": cv, "value": value, "ok": True,
+					"attempt": attempt, "latency": write.latency})
+				return True
+		self.traceEvent("W", cv, value, False)
+		self.logEvent("cv", "CV %d could not be written with %d" % (cv, value), {"op": "write", "cv": cv, "value": value, "ok": False})
+		return False
+####################################################################################
+#
+# self.writeStats() Returns the count, mean and maximum latency in msec of the
+# acknowledged CV writes
+#
+####################################################################################	
+	def writeStats(self) :
+		n = len(self.writeLatencies)
+		if n == 0 :
+			return 0, 0.0, 0.0
+		return n, sum(self.writeLatencies) / n, max(self.writeLatencies)
+####################################################################################
+#
+# self.reportCVWrite() is called by the write pipeline as each write completes
+#
+####################################################################################	
+	def reportCVWrite(self, write, ok) :
+		self.traceEvent("W", write.cv, write.value, ok)
+		if ok :
+			self.writeLatencies.append(write.latency)
+			self.shadow.set(write.cv, write.value)
+			self.logEvent("cv", None, {"op": "write", "cv": write.cv, "value": write.value, "ok": True,
+				"attempt": write.attempts, "latency": write.latency})
+		else :
+			self.logEvent("cv", "CV %d could not be written with %d" % (write.cv, write.value),
+				{"op": "write", "cv": write.cv, "value": write.value, "ok": False})
+		return
+####################################################################################
+#
+# self.startCVWrites() starts writing a batch of (CV, value) pairs and returns the
+# pipeline, whose wait() returns once they are all written. Pairs the decoder
+# already holds are left out.
+#
+####################################################################################	
+	def startCVWrites(self, batch) :
+		changed = [(cv, value) for cv, value in batch if not self.shadow.matches(cv, value)]
+		for cv, value in batch :
+			if (cv, value) not in changed :
+				self.logEvent("cv", None, {"op": "skip", "cv": cv, "value": value})
+		self.skippedWrites = self.skippedWrites + len(batch) - len(changed)
+		pipeline = CVWritePipeline(self.programmer, self.CVWriteInFlight, self.CVWriteTimeoutMsec, self.CVWriteRetries, self.reportCVWrite, self.clock, self.logEvent)
+		pipeline.submit(changed)
+		return pipeline
+####################################################################################
+#
+# self.nextReadMode() returns the name of the mode for the next service mode read:
+# the first of ReadModes the programmer supports that has not been timed yet, then
+# the one that read fastest. None if no mode has worked, so the programmer's own
+# mode is used.
+#
+####################################################################################	
+	def nextReadMode(self, programmer) :
+		supported = programmer.getSupportedModes()
+		names = [name for name in self.ReadModes if getattr(jmri.ProgrammingMode, name, None) in supported]
+		untried = [name for name in names if not self.readModeMsec.has_key(name)]
+		if untried :
+			return untried[0]
+		worked = [name for name in names if self.readModeMsec[name] != None]
+		if worked :
+			return min(worked, key = lambda name : self.readModeMsec[name])
+		return None
+####################################################################################
+#
+# self.readServiceModeCVs() reads a list of CVs on the program track in the
+# fastest read mode and returns a dictionary of CV to value (-1 if the read failed).
+# The first read in each mode times it; a CV whose trial read failed is read again
+# in the next mode.
+#
+####################################################################################	
+	def readServiceModeCVs(self, cvlist) :
+		values = {}
+		programmer = programmers.getGlobalProgrammer()
+		oldmode = programmer.getMode()
+		try :
+			for cv in cvlist :
+				while True :
+					name = self.nextReadMode(programmer)
+					if name != None :
+						programmer.setMode(getattr(jmri.ProgrammingMode, name))
+					else :
+						programmer.setMode(oldmode)
+					start = self.clock.millis()
+					values[cv] = self.readServiceModeCV(str(cv))
+					if name == None or self.readModeMsec.has_key(name) :
+						break
+					if values[cv] == -1 :
+						self.readModeMsec[name] = None
+						self.say("A read in", name, "failed")
+						continue
+					self.readModeMsec[name] = self.clock.millis() - start
+					self.say("A read in", name, "took", self.readModeMsec[name], "msec")
+					break
+				self.traceEvent("R", cv, values[cv])
+				self.logEvent("cv", "CV %d = %d" % (cv, values[cv]), {"op": "read", "cv": cv, "value": values[cv]})
+		finally :
+			programmer.setMode(oldmode)
+		return values
+####################################################################################
+#
+# self.identifyDecoder() reads the CVs that identify the locomotive. CV105 and
+# CV106 are read first; if an earlier run saved the identity under them, only CV29
+# and the address CV are read to confirm it is the same locomotive. Only the long
+# address bit of CV29 is compared, since the run itself turns the speed table on.
+#
+####################################################################################	
+	def identifyDecoder(self) :
+		values = self.readServiceModeCVs([105, 106])
+		identity = None
+		if values[105] >= 0 and values[106] >= 0 :
+			identity = self.profiles.load(self.profiles.identityKey(values[105], values[106]))
+		if identity != None :
+			cached = {}
+			for cv in identity.keys() :	# the keys are strings once saved as JSON
+				cached[int(cv)] = identity[cv]
+			if (cached[29] & 32) == 32 :
+				addresscv = 18
+			else :
+				addresscv = 1
+			values.update(self.readServiceModeCVs([29, addresscv]))
+			if (values[29] & 32) == (cached[29] & 32) and values[addresscv] == cached[addresscv] :
+				self.say("Locomotive identified from an earlier run")
+				for cv in self.IdentityCVs :
+					if not values.has_key(cv) :
+						values[cv] = cached[cv]
+				return values
+			self.say("Locomotive does not match the identity saved for its private ID")
+		values.update(self.readServiceModeCVs([cv for cv in self.IdentityCVs if not values.has_key(cv)]))
+		return values
+####################################################################################
+#
+# self.saveIdentity() saves the identifying CVs under the private ID now in the
+# decoder, so the next run can skip most of the reads
+#
+####################################################################################	
+	def saveIdentity(self, previous105, previous106) :
+		if not (self.shadow.matches(105, self.val105) and self.shadow.matches(106, self.val106)) :
+			return		# the private ID was not written, so it cannot find this identity
+		identity = {}
+		for cv in self.IdentityCVs :
+			identity[cv] = self.shadow.values[cv]
+		self.profiles.save(self.profiles.identityKey(self.val105, self.val106), identity)
+		if previous105 <> self.val105 or previous106 <> self.val106 :
+			self.profiles.remove(self.profiles.identityKey(previous105, previous106))
+		return
+####################################################################################
+#
+# self.readShadowCVs() reads in service mode the CVs in ShadowCVs the shadow does
+# not know yet. The testbed must already be switched to the program track.
+#
+####################################################################################	
+	def readShadowCVs(self) :
+		for cv in self.shadow.unknown(self.ShadowCVs) :
+			value = self.readServiceModeCV(str(cv))
+			self.traceEvent("R", cv, value)
+			self.logEvent("cv", None, {"op": "read", "cv": cv, "value": value})
+			if value >= 0 :
+				self.shadow.set(cv, value)
+		return
+####################################################################################
+#
+# self.LoopActive() Returns true if there is a locomotive detected on the loop
+# JMD revised this to loop through all the sensors and if any of them is active,
+# then there is a locomotive on the track.
+#
+####################################################################################	
+	def LoopActive(self) :
+		retval = False
+		for blockSensor in self.LoopSensors:
+			if (blockSensor.getKnownState() == CLOSED) :
+				retval = True
+		return retval			
+
+####################################################################################
+#
+# self.DCCSourceSelect() configures the testbed DCC input to main or program
+#
+####################################################################################	
+	def DCCSourceSelect(self, Source):
+		if (Source == "MAIN") :
+			self.say("Testbed Track MAIN Selected")
+			turnouts.provideTurnout("ProgMain").setState(CLOSED)
+			pass
+		elif (Source == "PROG") :
+			self.say("Testbed Track PROG Selected")
+			turnouts.provideTurnout("ProgMain").setState(THROWN)
+			pass
+		else :
+			self.say("Please select either 'MAIN' or 'PROG'")
+			pass
+		return
+####################################################################################
+#
+# self.SWLed() controls the testbed software-controlled LEDs on/off
+#
+####################################################################################	
+	def SWLed(self, Led, Value):
+		if (Led == "WHT") :
+			if (Value == "ON") :
+				self.say("Testbed White Software LED On")
+				turnouts.provideTurnout("SWLEDWHT").setState(CLOSED)
+				pass
+			elif (Value == "OFF") :
+				self.say("Testbed White Software LED Off")
+				turnouts.provideTurnout("SWLEDWHT").setState(THROWN)
+				pass
+			else :
+				self.say("Please select either 'ON' or 'OFF'")
+				pass
+		elif (Led == "BLU") :
+			if (Value == "ON") :
+				self.say("Testbed Blue Software LED On")
+				turnouts.provideTurnout("SWLEDBLU").setState(CLOSED)
+				pass
+			elif (Value == "OFF") :
+				self.say("Testbed Blue Software LED Off")
+				turnouts.provideTurnout("SWLEDBLU").setState(THROWN)
+				pass
+			else :
+				self.say("Please select either 'ON' or 'OFF'")
+				pass
+		else :
+			self.say("Please select either 'WHT' or 'BLU' Led")
+			pass
+		return
+####################################################################################
+#
+# self.DCCPower() configures the testbed power controls for HO and N loops
+#
+####################################################################################	
+	def DCCPower(self, Loop, Value):
+		if (Loop == "HO") :
+			if (Value == "ON") :
+				self.say("Testbed HO Track Loop Powered On")
+				turnouts.provideTurnout("PowerHO").setState(CLOSED)
+				pass
+			elif (Value == "OFF") :
+				self.say("Testbed HO Track Loop Powered Off")
+				turnouts.provideTurnout("PowerHO").setState(THROWN)
+				pass
+			else :
+				self.say("Please select either 'ON' or 'OFF'")
+				pass
+		elif (Loop == "N") :
+			if (Value == "ON") :
+				self.say("Testbed N Track Loop Powered On")
+				turnouts.provideTurnout("PowerN").setState(CLOSED)
+				pass
+			elif (Value == "OFF") :
+				self.say("Testbed N Track Loop Powered Off")
+				turnouts.provideTurnout("PowerN").setState(THROWN)
+				pass
+			else :
+				self.say("Please select either 'ON' or 'OFF'")
+				pass
+		else :
+			self.say("Please select either 'HO' or 'N' track loops")
+			pass
+		return
+####################################################################################
+#
+# self.TrackNormal() configures the testbed to turn the main DCC power to both loops
+# JMD: For my project with a single track, this method can be eliminated.
+# The session hands back the program track if it held it and shares the main. The
+# source is only switched to MAIN once the session has the main, and the other
+# loops get their power back after that.
+#
+####################################################################################	
+	def TrackNormal(self):
+		programming = self.arbiter.holdsProgram(self.loopName)
+		self.arbiter.acquireMain(self.loopName)
+		self.DCCSourceSelect("MAIN")
+		self.waitTurnout("ProgMain", CLOSED, 500)
+		if programming :
+			self.otherLoopsPower("ON")
+		return
+####################################################################################
+#
+# self.TrackProgram() configures the testbed to select the DCC program on both loops
+# JMD: For my project with a single track, this method can be eliminated.
+# The program track feeds every loop, so it waits until no other session is using
+# the main, and holds both until TrackNormal() is called.
+#
+####################################################################################	
+	def TrackProgram(self):
+		self.arbiter.acquireProgram(self.loopName, self.say)
+		self.otherLoopsPower("OFF")	# so only this loop's decoder hears service mode
+		self.DCCSourceSelect("PROG")
+		self.waitTurnout("ProgMain", THROWN, 500)
+		return
+####################################################################################
+#
+# self.otherLoopsPower() turns the power to every loop but this one on or off
+#
+####################################################################################	
+	def otherLoopsPower(self, Value):
+		for name in TestbedLoops.keys() :
+			if name <> self.loopName :
+				self.DCCPower(name, Value)
+		return
+####################################################################################
+#
+# self.yieldTrack() lets a session on another loop use the program track while
+# this locomotive is stopped
+#
+####################################################################################	
+	def yieldTrack(self):
+		if self.arbiter.yieldMain(self.loopName) :
+			self.say("Waited while another loop used the program track")
+			self.waitTurnout("ProgMain", CLOSED, 500)
+		return
+####################################################################################
+#
+# self.waitNextActive() waits for the next sensor in the list to go active
+#
+####################################################################################	
+	def waitNextActiveSensor(self, sensorlist) :
+		inactivesensors = []
+		
+		if (len(sensorlist) == 1) :
+			if (sensorlist[0].getKnownState() == sensorlist[0].ACTIVE) :
+				self.clock.waitSensorInactive(self, sensorlist)
+			inactivesensors.append(sensorlist[0])
+		else :
+			for s in sensorlist:
+				if s.getKnownState() == s.INACTIVE :
+					inactivesensors.append(s)
+		self.clock.waitSensorActive(self, inactivesensors)
+		return
+####################################################################################
+#
+# self.setThrottleSpeed() and self.setThrottleDirection() change the throttle and
+# tell the speed estimator, so transits timed at the old setting are not used.
+# settle is the time (msec) the locomotive is given before a transit counts.
+#
+####################################################################################
+	def setThrottleSpeed(self, setting, settle = None) :
+		if (self.throttle.getSpeedSetting() != setting) :
+			self.throttle.setSpeedSetting(setting)
+			if settle == None :
+				settle = self.SettleMsec
+			self.traceEvent("S", setting, settle)
+			self.estimator.markChange(settle)
+		return
+
+	def setThrottleDirection(self, forward, settle = None) :
+		if (self.throttle.getIsForward() != forward) :
+			self.directionChange = self.clock.nanos() / 1000000.0
+			self.throttle.setIsForward(forward)
+			if settle == None :
+				settle = self.SettleMsec
+			self.traceEvent("D", forward, settle)
+			self.estimator.markChange(settle)
+		return
+####################################################################################
+#
+# self.pause() waits msec on the testbed clock
+#
+####################################################################################
+	def pause(self, msec) :
+		self.clock.sleep(self, msec)
+		return
+####################################################################################
+#
+# self.waitFor() waits until predicate() is true or timeout msec have passed, then
+# settle msec more, and logs how long it took against the fixed delay it replaces.
+# Returns True if the condition was met.
+#
+####################################################################################
+	def waitFor(self, predicate, timeout, label, olddelay = None, settle = 0) :
+		start = self.clock.millis()
+		met = predicate()
+		while not met and self.clock.millis() - start < timeout :
+			self.pause(self.WaitPollMsec)
+			met = predicate()
+		if settle > 0 :
+			self.pause(settle)
+		self.logWait(label, self.clock.millis() - start, olddelay)
+		if not met :
+			self.say("Timed out after", timeout, "msec waiting for", label)
+		return met
+####################################################################################
+#
+# self.logWait() adds a wait to the totals printed at the end of the run
+#
+####################################################################################
+	def logWait(self, label, waited, olddelay) :
+		if not self.waitLog.has_key(label) :
+			self.waitLog[label] = [0, 0, 0]
+		entry = self.waitLog[label]
+		entry[0] = entry[0] + 1
+		entry[1] = entry[1] + waited
+		if olddelay != None :
+			entry[2] = entry[2] + olddelay
+		return
+####################################################################################
+#
+# self.waitTurnout() waits for a testbed relay turnout to report its new state. A
+# turnout without feedback reports it as soon as it is set, so its relay still
+# gets the old delay to settle.
+#
+####################################################################################
+	def waitTurnout(self, name, state, olddelay) :
+		turnout = turnouts.provideTurnout(name)
+		if turnout.getFeedbackMode() == jmri.Turnout.DIRECT :
+			self.pause(olddelay)
+			self.logWait(name, olddelay, olddelay)
+			return
+		self.waitFor(lambda : turnout.getKnownState() == state, olddelay, name, olddelay, self.RelaySettleMsec)
+		return
+####################################################################################
+#
+# self.waitStopped() waits after the throttle is set to 0 until the blocks the
+# locomotive occupies have not changed for the stop window. A locomotive still
+# moving would cross into the next block within that time. Without a speed to go
+# on the window is the old fixed delay. A locomotive with heavy momentum keeps
+# the sensors changing for longer, so the wait only gives up after StopMaxMsec.
+#
+####################################################################################
+	def waitStopped(self, olddelay) :
+		window = self.stopWindow(olddelay)
+		stopped = self.clock.nanos()
+		quiet = window * 1000000
+		self.waitFor(lambda : self.clock.nanos() - max(stopped, self.edges.lastEdge) >= quiet,
+				max(olddelay, self.StopMaxMsec), "locomotive stopped", olddelay)
+		return
+####################################################################################
+#
+# self.stopWindow() returns the msec the occupied blocks must stay the same for
+# the locomotive to count as stopped, no more than longest
+#
+####################################################################################
+	def stopWindow(self, longest) :
+		if self.lastMeasuredSpeed <= 0 :
+			return longest
+		feetpersec = self.lastMeasuredSpeed * 5280.0 / 3600
+		window = self.StopWindowFactor * 1000.0 * max(self.BlockLengths) / feetpersec
+		return min(longest, max(self.StopMinMsec, window))
+####################################################################################
+#
+# self.waitDirection() gives the decoder the old delay to take a direction change,
+# if the direction has changed.
+# The locomotive is stopped, so nothing on the loop shows whether it has; the
+# first block crossed afterwards does, see checkDirection().
+#
+####################################################################################
+	def waitDirection(self, olddelay) :
+		if self.directionChange != None :
+			self.pause(olddelay)
+		return
+####################################################################################
+#
+# self.checkDirection() is called with every block transit the speed estimator
+# times. The first transit after a direction change has to go the way round the
+# loop that the new direction runs; the throttle reports the new direction as soon
+# as it is set, so that does not show that the decoder got it, and some Tsunamis
+# miss a direction change.
+#
+####################################################################################
+	def checkDirection(self, transit) :
+		sense = transit[2]
+		if not self.throttle.getIsForward() :
+			sense = -sense
+		if self.directionChange != None and transit[0] >= self.directionChange :
+			self.directionChange = None
+			if self.runSense != None and sense != self.runSense :
+				self.logEvent("direction", "The locomotive is still running the old way after the direction change",
+					{"forward": self.throttle.getIsForward()})
+				return
+		self.runSense = sense
+		return
+####################################################################################
+#
+# self.printWaits() prints the time spent waiting against the fixed delays
+#
+####################################################################################
+	def printWaits(self) :
+		labels = self.waitLog.keys()
+		labels.sort()
+		for label in labels :
+			count, waited, olddelay = self.waitLog[label]
+			self.say("Waited for", label, count, "times,", round(waited / 1000.0, 1), "sec instead of", round(olddelay / 1000.0, 1), "sec")
+		return
+####################################################################################
+#
+# self.getSpeed() is used as part of the speed measurement
+#
+# This takes several speed measurements and returns an average value. If more than
+# 4 values are given, the min and max values are omitted from the average.
+# The final speed value returned is an average of the remaining values, along with
+# the half width of the 95% confidence interval on that average (the precision).
+#
+####################################################################################
+	def getSpeed(self, speedlist) :
+
+		speedlist = list(speedlist)
+		if (len(speedlist) > 4):
+			speedlist.remove(min(speedlist))
+			speedlist.remove(max(speedlist))
+		
+		n = len(speedlist)
+		speed = sum(speedlist)/n
+		if (n < 2):
+			return speed, float("inf")
+
+		variance = sum([(s - speed) ** 2 for s in speedlist]) / (n - 1)
+		if self.StudentT.has_key(n - 1) :
+			t = self.StudentT[n - 1]
+		else :
+			t = 2.0
+		precision = t * math.sqrt(variance / n)
+		return speed, precision
+####################################################################################
+#
+# self.planBlocks() picks how many blocks to group into one speed measurement
+#
+# The detector timing uncertainty is fixed, so the precision of a measurement
+# depends on how long the transit takes. This returns the smallest number of
+# consecutive blocks that the locomotive takes at least TransitPrecisionFactor
+# times DetectorUncertaintyMsec to cross at the given speed (MPH), starting from
+# any sensor. The shortest group of that many blocks on the loop is used for the
+# prediction, so every group measured meets the minimum.
+#
+# Without a block length table, the lengths are estimated from the laps of the
+# first warm-up (see warmUp()); until then every measurement is a whole lap.
+#
+####################################################################################
+	def planBlocks(self, speed) :
+		n = len(self.BlockLengths)
+		if not self.blockLengthsCalibrated :
+			return n
+		mintransit = self.TransitPrecisionFactor * self.DetectorUncertaintyMsec
+		feetpersec = speed * 5280.0 / 3600
+		if (feetpersec <= 0) :
+			return 1
+		for k in range(1, n + 1) :
+			shortest = min([sum([self.BlockLengths[(i + j) % n] for j in range(k)]) for i in range(n)])
+			if (shortest / feetpersec) * 1000.0 >= mintransit :
+				return k
+		return n
+####################################################################################
+#
+# self.stallMsec() returns how long the locomotive may take to reach the next
+# block before it counts as stalled: the longest block at StallSpeed
+#
+####################################################################################
+	def stallMsec(self) :
+		return 1000.0 * max(self.BlockLengths) / (self.StallSpeed * 5280.0 / 3600)
+####################################################################################
+#
+# self.measureSpeed() performs the speed measurement algorithm
+#
+# Given which track loop and the length of a block, we can measure the speed by
+# measuring the time through each block. This version takes several measurements and
+# averaging them, throwing out the high and low values.
+#
+# Measurements are taken until the average is known to within SpeedTolerance, so a
+# steady locomotive is done after a few blocks and an erratic one gets more, up to
+# MaxSpeedMeasurements. The precision reached is left in self.speedPrecision.
+#
+# The block transits come from the session speed estimator, so a measurement can
+# start on any sensor and transits already timed at the current throttle setting
+# are used straight away.
+#
+# The number of blocks per measurement comes from planBlocks(), using the last
+# measured speed (or targetspeed before there is one) as the prediction. It is
+# planned again after every measurement with the speed measured so far.
+#
+# A locomotive that crosses no block for stallMsec() has stalled, in the deadband
+# of its decoder. The speed is then 0 and self.speedStalled is set.
+####################################################################################
+	def measureSpeed(self, targetspeed) :
+		"""converts time to speed, ft/sec - scale speed"""
+		self.traceEvent("M", targetspeed, self.lastMeasuredSpeed)
+		self.speedStalled = False
+		speed = 0.0
+		speedlist = []
+
+		if (self.lastMeasuredSpeed > 0) :
+			num_blocks = self.planBlocks(self.lastMeasuredSpeed)
+		else :
+			num_blocks = self.planBlocks(targetspeed)
+		self.say("Measuring speed over", num_blocks, "block(s)...")
+
+        # Measure the speed until the average is good enough and put those speeds into a list
+
+		precision = float("inf")
+		while (len(speedlist) < self.MaxSpeedMeasurements) :
+			sample = self.estimator.takeSample(num_blocks, self.stallMsec())
+			if sample == None :
+				self.speedStalled = True
+				self.speedPrecision = 0.0
+				self.lastMeasuredSpeed = 0.0
+				self.traceEvent("m", 0.0, 0.0)
+				self.logEvent("speed", "    Locomotive stalled, no block crossed in %d sec" % (self.stallMsec() / 1000),
+					{"target": targetspeed, "speed": 0.0, "precision": 0.0, "count": len(speedlist), "stalled": True})
+				return 0.0
+			blocklength, duration = sample
+
+			if duration == 0 :
+				self.say("Error: Got a zero for duration") # this should not happen
+				continue
+			speed = (blocklength / (duration / 1000.0)) * (3600.0 / 5280)
+			self.logEvent("measurement", "    Measurement %d, Speed = %s MPH" % (len(speedlist) + 1, round(speed, 3)),
+				{"target": targetspeed, "n": len(speedlist) + 1, "blocks": num_blocks, "length": blocklength, "msec": duration, "speed": speed})
+			self.setStatus("Speed = " + str(round(speed,3)) + " MPH")
+			speedlist.append(speed)
+
+			planned = self.planBlocks(sum(speedlist) / len(speedlist))
+			if (planned != num_blocks) :
+				num_blocks = planned
+				self.say("    Regrouping to", num_blocks, "block(s)...")
+
+			if (len(speedlist) >= self.MinSpeedMeasurements) :
+				speed, precision = self.getSpeed(speedlist)
+				if (precision <= self.SpeedTolerance) :
+					break
+
+		self.speedPrecision = precision
+		self.lastMeasuredSpeed = speed
+		self.traceEvent("m", speed, precision)
+		self.logEvent("speed", "    Speed = %s +/- %s MPH after %d measurements" % (round(speed, 3), round(precision, 3), len(speedlist)),
+			{"target": targetspeed, "speed": speed, "precision": precision, "count": len(speedlist)})
+		return speed
+####################################################################################
+#
+# self.warmUp() runs the locomotive at the current setting until it is warm
+#
+# Every lap is timed from the block transits, starting at whichever sensor comes
+# first. Warm-up ends once the last WarmupStableLaps laps agree within
+# WarmupTolerance, after at least WarmupMinLaps and at most WarmupMaxLaps laps, so
+# a locomotive that is still warm from the last run only does a couple of laps.
+# The lap times are kept in self.warmupCurve and saved with the profile. On a loop
+# without a block length table the laps also give the block lengths, see
+# fitBlockLengths().
+#
+####################################################################################
+	def warmUp(self, direction) :
+		n = len(self.LoopSensors)
+		laptimes = []
+		laps = []
+		self.say("Warming up in the", direction, "direction for", self.WarmupMinLaps, "to", self.WarmupMaxLaps, "laps...")
+		while (len(laptimes) < self.WarmupMaxLaps) :
+			transits = self.estimator.takeTransits(n)
+			laps.append(transits)
+			laptimes.append((transits[-1][1] - transits[0][0]) / 1000.0)
+			self.say("    Lap ", len(laptimes), ", Time = ", str(round(laptimes[-1],3)), "sec")
+			if (len(laptimes) >= max(self.WarmupMinLaps, self.WarmupStableLaps)) :
+				recent = laptimes[-self.WarmupStableLaps:]
+				if (max(recent) - min(recent)) <= self.WarmupTolerance * sum(recent) / len(recent) :
+					self.say("Lap times are steady after", len(laptimes), "laps")
+					break
+		self.warmupCurve[direction] = laptimes
+		if not self.blockLengthsCalibrated :
+			self.fitBlockLengths(laps)
+			self.say("Block lengths estimated from the warm-up laps:", ", ".join([str(round(x, 1)) for x in self.BlockLengths]), "feet")
+		self.lastMeasuredSpeed = (sum(self.BlockLengths) / laptimes[-1]) * (3600.0 / 5280)
+
+		# The last laps were run at a steady full throttle, so a maximum speed
+		# measurement straight after the warm-up can use them
+		self.estimator.rewind(n * self.WarmupStableLaps)
+		return
+####################################################################################
+#
+# self.probeSpeed() sets the throttle and measures the speed it gives
+#
+####################################################################################
+	def probeSpeed(self, throttlesetting, targetspeed) :
+		forward = self.throttle.getIsForward()
+		self.say()
+		self.logEvent("search", "Throttle Setting %d" % throttlesetting, {"action": "probe", "target": targetspeed, "setting": throttlesetting})
+		cached = self.measurements.get(forward, throttlesetting)
+		if (cached != None) :
+			speed = cached[0]
+			self.speedPrecision = cached[1]
+			self.logEvent("search", "Using the measurement from %d sec ago" % ((self.clock.millis() - cached[2]) / 1000),
+				{"action": "cached", "target": targetspeed, "setting": throttlesetting, "speed": speed})
+		else :
+			self.setThrottleSpeed(.0079365 * throttlesetting)
+			self.pause(100)
+			speed = self.measureSpeed(targetspeed)
+			self.measurements.put(forward, throttlesetting, speed, self.speedPrecision)
+			if self.speedStalled :
+				self.stallFloor[forward] = max(self.stallFloor[forward], throttlesetting)
+		self.logEvent("search", "Measured Speed = %s +/- %s Difference = %s at throttle setting %d" %
+			(round(speed, 3), round(self.speedPrecision, 3), round(speed - targetspeed, 3), throttlesetting),
+			{"action": "measured", "target": targetspeed, "setting": throttlesetting, "speed": speed,
+			"precision": self.speedPrecision, "difference": speed - targetspeed})
+		return speed
+####################################################################################
+#
+# self.refreshModel() gives the throttle model the fresh measurements for the
+# direction the locomotive is running
+#
+####################################################################################
+	def refreshModel(self, model) :
+		model.setPoints(self.measurements.points(self.throttle.getIsForward()))
+		return
+####################################################################################
+#
+# self.findThrottle() searches for the throttle setting closest to targetspeed
+#
+# Each probe goes to the throttle setting the model predicts for the target,
+# kept inside the settings already known to be too slow and too fast, and above
+# every setting the locomotive stalled at. The search ends when a probe is within
+# the measurement precision of the target and that precision reached
+# SpeedTolerance, or when the target is bracketed by neighbouring settings, in
+# which case the closer of the two is used. Returns the throttle setting and
+# (target - speed) for it. A setting of 0 means the locomotive is too fast even at
+# setting 1; one just above a stall is the slowest it runs.
+#
+####################################################################################
+	def findThrottle(self, targetspeed, model) :
+		while True :
+			self.refreshModel(model)
+			lo, hi = model.bracket(targetspeed)
+			if (lo != None and hi != None and hi - lo <= 1) :
+				break
+			if (lo != None and lo >= 127) or (hi != None and hi <= 1) :
+				break
+			if (hi != None and hi <= self.stallFloor[self.throttle.getIsForward()] + 1) :
+				break
+
+			throttlesetting = int(round(model.predict(targetspeed)))
+			lowest = self.stallFloor[self.throttle.getIsForward()] + 1
+			if lo != None :
+				lowest = max(lowest, lo + 1)
+			if hi == None :
+				highest = 127
+			else :
+				highest = hi - 1
+			throttlesetting = max(lowest, min(highest, throttlesetting))
+
+			speed = self.probeSpeed(throttlesetting, targetspeed)
+			if self.speedPrecision <= self.SpeedTolerance and abs(targetspeed - speed) <= self.speedPrecision :
+				self.logEvent("search", "Throttle setting %d is within the measurement precision" % throttlesetting,
+					{"action": "found", "target": targetspeed, "setting": throttlesetting, "speed": speed})
+				return throttlesetting, targetspeed - speed
+
+		if (lo == None) and self.stallFloor[self.throttle.getIsForward()] == 0 :
+			return 0, targetspeed - model.points[hi]
+		if (lo == None) :
+			return hi, targetspeed - model.points[hi]
+		if (hi == None) or abs(targetspeed - model.points[lo]) < abs(targetspeed - model.points[hi]) :
+			return lo, targetspeed - model.points[lo]
+		return hi, targetspeed - model.points[hi]
+####################################################################################
+#
+# self.seedModel() gives the throttle model a starting curve before any probe
+#
+# The points from the last run of this locomotive are used if it was measured in
+# the same direction, scaled by the change in full throttle speed. Otherwise the
+# average curve of the decoder model is used. Either way they only guide the
+# predictions; every setting chosen is still measured on this run.
+#
+####################################################################################
+	def seedModel(self, model, forward, maxspeed) :
+		if (self.profile != None and self.profile["forward"] == forward and self.profile["maxspeed"] > 0) :
+			scale = maxspeed / self.profile["maxspeed"]
+			for setting, speed in self.profile["points"] :
+				model.addAnchor(setting, speed * scale)
+			self.say("Throttle model seeded from the last run of this locomotive")
+			return
+		curve = self.profiles.modelCurve(self.mfrID, self.mfrVersion)
+		if (curve != None) :
+			for setting, fraction in curve :
+				model.addAnchor(setting, fraction * maxspeed)
+			self.say("Throttle model seeded from earlier runs of decoder", self.mfrID, "version", self.mfrVersion)
+		return
+####################################################################################
+#
+# self.saveProfile() stores this run for the next one and for the decoder model
+#
+####################################################################################
+	def saveProfile(self, model, forward, maxspeed, topspeed, stepvaluelist) :
+		points = model.points.items()
+		points.sort()
+		self.profiles.save(self.profileKey, {
+				"address": self.address,
+				"mfrID": self.mfrID,
+				"mfrVersion": self.mfrVersion,
+				"cv105": self.val105,
+				"cv106": self.val106,
+				"forward": forward,
+				"maxspeed": maxspeed,
+				"topspeed": topspeed,
+				"points": points,
+				"warmup": self.warmupCurve,
+				"stepvaluelist": [int(v) for v in stepvaluelist]})
+		if (maxspeed > 0) :
+			self.profiles.addToModel(self.mfrID, self.mfrVersion, points, maxspeed)
+		self.say("Profile saved for locomotive", self.address)
+		return
+####################################################################################
+#
+# self.saveShadow() adds the CV values the decoder now holds to the saved profile,
+# once all the writes have been acknowledged
+#
+####################################################################################
+	def saveShadow(self) :
+		profile = self.profiles.load(self.profileKey)
+		if (profile != None) :
+			profile["cvs"] = self.shadow.values
+			self.profiles.save(self.profileKey, profile)
+		return
 ####################################################################################
 #
-# Create an instance of the AbstractAutomation class 
+# self.sweepThrottle() measures the speed at each of the sweep settings
 #
-####################################################################################	
-class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
-	
+# The throttle goes up once through SweepSettings without stopping, adding each
+# speed to the model, and stops early once it is past the highest target speed.
+# The throttle settings for all the speed steps then come from the fitted curve.
+#
+####################################################################################
+	def sweepThrottle(self, model, highesttarget) :
+		self.setStatus("Sweeping Throttle")
+		self.say()
+		self.say("Sweeping the throttle from", self.SweepSettings[0], "to", self.SweepSettings[-1], "...")
+		for throttlesetting in self.SweepSettings :
+			speed = self.probeSpeed(throttlesetting, model.speedAt(throttlesetting))
+			self.refreshModel(model)
+			if speed > highesttarget * 1.05 :
+				break
+		return
 ####################################################################################
 #
-# self.init() called exactly once at the startup to do any necessary configuration
+# self.buildSpeedTable() fills in the speed steps between the measured ones
+# (every 4th entry of the 28) and keeps the table rising and within 255
 #
-####################################################################################	
-	def init(self) :
-	    # individual block section length (scale feet)
-		self.scriptversion = 3.0
-		self.block = float(132.65)  # 132.65 feet Erich's Speed Matching Track Kato Unitrack 19" Radius - 12 Sections / 24 Pieces
-		self.NumSpeedMeasurements = 5
-		self.long = False
-		self.addr = 0
-		self.warmupLaps = 5
-		self.programmer = None
-		self.throttle = None
-		self.writeLock = False
-		self.fullSpeed = 100
+####################################################################################
+	def buildSpeedTable(self, stepvaluelist) :
+		if stepvaluelist[4] < 4 :
+			stepvaluelist[4] = 4
 
-		# JMD:  I changed the sensor numbering since I will only have 12 blocks.
-		self.sensor1 = sensors.provideSensor("Block:1")
-		self.sensor2 = sensors.provideSensor("Block:2")
-		self.sensor3 = sensors.provideSensor("Block:3")
-		self.sensor4 = sensors.provideSensor("Block:4")
-		self.sensor5 = sensors.provideSensor("Block:5")
-		self.sensor6 = sensors.provideSensor("Block:6")
-		self.sensor7 = sensors.provideSensor("Block:7")
-		self.sensor8 = sensors.provideSensor("Block:8")
-		self.sensor9 = sensors.provideSensor("Block:9")
-		self.sensor10 = sensors.provideSensor("Block:10")
-		self.sensor11 = sensors.provideSensor("Block:11")
-		self.sensor12 = sensors.provideSensor("Block:12")
-		self.homesensor = sensors.provideSensor("Block:12")
-
-		# Different block sizes for different speeds or it would take
-		# forever to do the low speed if loco had to circle whole track
-		# for every measurement.
-
-		self.HighSpeedNBlocks = 12
-		self.MediumSpeedNBlocks = 3		
-		self.LowSpeedNBlocks = 1
-
-		self.HighSpeedArrayN = [self.homesensor]
-
-		self.MediumSpeedArrayN= (
-				self.sensor1,
-				self.sensor4,
-				self.sensor7,
-				self.sensor10)
-
-		self.LowSpeedArrayN = (
-				self.sensor1,
-				self.sensor2,
-				self.sensor3,
-				self.sensor4,
-				self.sensor5,
-				self.sensor6,
-				self.sensor7,
-				self.sensor8,
-				self.sensor9,
-				self.sensor10,
-				self.sensor11,
-				self.sensor12)
-				
-		self.MediumSpeedThreshold = 45
-		self.HighSpeedThreshold = 85
-		
-		self.DecoderMap = {141:"Tsunami", 129:"Digitrax", 153:"TCS", 11:"NCE", 113: "QSI/BLI", 99:"Lenz Gen 5", 151:"ESU", 127:"Atlas/Lenz XF"}
-		self.DecoderType = "Default"
+		stepvaluelist[0] = stepvaluelist[4] - (stepvaluelist[8] - stepvaluelist[4]) #trying to improve the bottom end performance
 
-		#	These speed steps are measured.  All others are calculated
-		#	CV			70	74	78	82	86	90	94
-		#	Speedsteps	 4	 8	12	16	20	24	28
+		# making sure none of the speedsteps are < 1
+		if ((stepvaluelist[4] - stepvaluelist[0]) / 4) + stepvaluelist[0] < 1 :
+			stepvaluelist[0] = 0
 
-		#	These lists are percentages of full speed
-		self.DigitraxStepList = [10, 22, 35, 47, 60, 72, 85]
-		self.Lenz5GenStepList = [17, 30, 44, 57, 71, 84, 98]
-		self.LenzXFStepList = [11, 26, 40.5, 55, 70, 84, 98.5]
-		self.NCEStepList = [10.5, 25, 39.5, 54,	68,	83,	98]
-		self.OldTCSStepList = [14.5, 28.5, 42.5, 57, 71.5, 86, 99]
-		self.NewTCSStepList = [13, 25.5, 38, 50.5, 63, 75.5, 88]
-		self.QSIStepList = [11,	26,	41,	55,	70,	85,	99]
-		self.SoundtraxxDSDStepList = [14,	28,	42,	56,	70,	84,	99]
-		self.TsunamiStepList = [14.5,	28.5,	42.5,	57,	71,	85,	99]
-		self.ESUStepList = [12,	27,	41,	56,	70,	85,	99]
-		return
+		for  z in range (4, 29, 4) :
+			# To prevent speedsteps from having the same value
+			# decided it was better to error faster than slower
+			if stepvaluelist[z] - stepvaluelist[z - 4] < 4 :
+				stepvaluelist[z] = stepvaluelist[z - 4] + 4
+
+			if stepvaluelist[z] > 255 :	#can't have a value greater than 255
+				stepvaluelist[z] = 255
+ 
 
+			# Create calculated speed steps
+			y = stepvaluelist[z] - stepvaluelist[z - 4]
+			x = (y/4)
+			stepvaluelist[z -3] = stepvaluelist[z] - round(x * 3)
+			stepvaluelist[z -2] = stepvaluelist[z] - round(x * 2)
+			stepvaluelist[z -1] = stepvaluelist[z] - round(x)
+
+            #01/09/09	some TCS decoders will stop if a speed step value is 250 or greater
+
+		if self.DecoderType == "TCS" :
+			self.say()
+			self.say("Values before TCS correction")
+			self.say(stepvaluelist)
+			counter = 0
+			for  z in range (21, 29, 1) :
+                #						print "z= ",z," ",stepvaluelist[z],"counter = ",counter
+				if stepvaluelist[z] > 242 + counter:
+					stepvaluelist[z] = 242 + counter
+				counter = counter + 1
+		return stepvaluelist
 ####################################################################################
 #
-# self.myCVListener() Provides an acknowledgement after a CV write operation
-# JMD: A listener is required for writeCV method, and this is the listener.
-# JMD: The writeCV call is made from testbedWriteCV.
+# self.speedTableCVs() returns the (CV, value) writes of the speed table and the
+# CVs that turn it on
 #
-####################################################################################	
-	def myCVListener(self, value, status) :
-		self.writeLock = False
+####################################################################################
+	def speedTableCVs(self, stepvaluelist) :
+		# Write Speed Table to locomotive
+		batch = []
+		for z in range (67, 95) :
+			batch.append((z, int(stepvaluelist[z - 66])))
+
+		# Turn on speed table
+		if self.DecoderType == "SoundtraxxDSD" or self.DecoderType == "Tsunami" :			
+			batch.append((25, 16))
+
+		if self.DecoderType == "QSI/BLI" :			
+			batch.append((25, 1))
+
+		if self.long == True :
+			batch.append((29, 50))
+		else:
+			batch.append((29, 18))
+		return batch
+####################################################################################
+#
+# self.verifySpeedTable() runs the locomotive at each measured speed step with the
+# table turned on and compares the speed to the target for that step
+#
+# A step that misses is scaled by target / measured speed, the steps between are
+# filled in again, and the table is rewritten; only the CVs that changed are sent.
+# This repeats until every step is within tolerance or VerifyMaxIterations
+# corrections have been made and measured. Each step is run at the throttle
+# setting that reads its table entry, see self.stepSetting().
+#
+####################################################################################
+	def verifySpeedTable(self, stepvaluelist, steptargets) :
+		self.setStatus("Verifying Speed Table")
+		steps = steptargets.keys()
+		steps.sort()
+		for iteration in range(1, self.VerifyMaxIterations + 2) :
+			self.say()
+			self.say("Verifying the speed table, pass", iteration)
+			corrections = {}
+			for z in steps :
+				targetspeed = steptargets[z]
+				self.setThrottleSpeed(self.stepSetting(z))
+				self.pause(100)
+				speed = self.measureSpeed(targetspeed)
+				self.say("Speed step", z, "Measured Speed = ", round(speed,3), "+/-", round(self.speedPrecision,3), "Target = ", targetspeed)
+				if abs(speed - targetspeed) > self.VerifyTolerance + self.speedPrecision :
+					if speed > 0 :
+						value = int(round(stepvaluelist[z] * targetspeed / speed))
+					else :
+						value = stepvaluelist[z] + 4
+					corrections[z] = max(1, min(255, value))
+			if not corrections :
+				self.say("Every speed step is within tolerance")
+				return True
+			if iteration > self.VerifyMaxIterations :
+				break
+			for z in corrections.keys() :
+				stepvaluelist[z] = corrections[z]
+			self.buildSpeedTable(stepvaluelist)
+			self.say("Corrected Values")
+			self.say(stepvaluelist)
+			self.startCVWrites(self.speedTableCVs(stepvaluelist)).wait()
+		self.say("Speed table still misses", len(corrections), "speed steps after", self.VerifyMaxIterations, "corrections")
+		return False
+####################################################################################
+#
+# self.stepSetting() returns the throttle setting (0 - 1) at which the decoder runs
+# on speed table entry z
+#
+####################################################################################
+	def stepSetting(self, z) :
+		return self.tableScale * z / 28.0
+####################################################################################
+#
+# self.resetRun() forgets what the last run measured, so back to back batch jobs
+# each start fresh
+#
+####################################################################################
+	def resetRun(self) :
+		self.measurements = MeasurementCache(self.CacheMaxAgeMsec, self.clock)
+		self.warmupCurve = {}
+		self.writeLatencies = []
+		self.skippedWrites = 0
+		self.lastMeasuredSpeed = 0.0
+		self.stallFloor = {True: 0, False: 0}
+		self.directionChange = None
+		self.runSense = None
+		self.profile = None
+		self.waitLog = {}
+		for name in self.readModeMsec.keys() :
+			if self.readModeMsec[name] == None :
+				del self.readModeMsec[name]	# tried again with the next locomotive
+		self.edges.attach(self.LoopSensors)
 		return
 ####################################################################################
 #
-# self.testbedWriteCV() Wraps the ops writes with a post write delay to give time
-# for the listener to respond
+# self.saveCheckpoint() saves what the run has done so far, so a run that is
+# stopped can be resumed from the phase it had finished
 #
-####################################################################################	
-	def testbedWriteCV(self, cv, value) :
-		self.writeLock = True
-		self.programmer.writeCV(cv, value, self.myCVListener)
-		while (self.writeLock) :	# will be set to False by myCVListener()
-			pass
+####################################################################################
+	def saveCheckpoint(self, phase) :
+		self.checkpoint["phase"] = phase
+		self.checkpoint["measurements"] = self.measurements.save()
+		self.checkpoint["identity"] = {"address": self.address, "long": self.long, "mfrID": self.mfrID,
+				"mfrVersion": self.mfrVersion, "cv105": self.val105, "cv106": self.val106, "decoder": self.DecoderType}
+		self.profiles.save(self.checkpointFile, self.checkpoint)
 		return
 ####################################################################################
 #
-# self.LoopActive() Returns true if there is a locomotive detected on the loop
-# JMD revised this to loop through all the sensors and if any of them is active,
-# then there is a locomotive on the track.
+# self.askResume() asks whether to carry on from a stopped run. Batch jobs
+# resume unless the job says "resume": false.
 #
-####################################################################################	
-	def LoopActive(self) :
-		retval = False
-		for blockSensor in self.lowSpeedArrayN:
-			if (blockSensor.getKnownState() == CLOSED) :
-				retval = True
-		return retval			
-
+####################################################################################
+	def askResume(self, checkpoint) :
+		if self.status == None :
+			return self.resumeStopped
+		answer = javax.swing.JOptionPane.showConfirmDialog(None,
+				"A run of this locomotive was stopped after " + checkpoint["phase"] + ". Resume it?",
+				"Testbed", javax.swing.JOptionPane.YES_NO_OPTION)
+		return answer == javax.swing.JOptionPane.YES_OPTION
 ####################################################################################
 #
-# self.DCCSourceSelect() configures the testbed DCC input to main or program
+# self.setStatus() shows the progress on the input panel, and keeps the last
+# status for the results of a batch job
 #
-####################################################################################	
-	def DCCSourceSelect(self, Source):
-		if (Source == "MAIN") :
-			print ("Testbed Track MAIN Selected")
-			turnouts.provideTurnout("ProgMain").setState(CLOSED)
-			pass
-		elif (Source == "PROG") :
-			print ("Testbed Track PROG Selected")
-			turnouts.provideTurnout("ProgMain").setState(THROWN)
-			pass
-		else :
-			print ("Please select either 'MAIN' or 'PROG'")
-			pass
+####################################################################################
+	def setStatus(self, text) :
+		self.result["status"] = text
+		self.traceEvent("X", text)
+		self.logEvent("status", None, {"status": text})
+		if self.status != None :
+			self.status.text = text
 		return
 ####################################################################################
 #
-# self.SWLed() controls the testbed software-controlled LEDs on/off
+# self.applyJob() takes the run settings from a batch job, which has the locomotive
+# "type" and "topspeed" and may give an "address" and the run options
 #
-####################################################################################	
-	def SWLed(self, Led, Value):
-		if (Led == "WHT") :
-			if (Value == "ON") :
-				print ("Testbed White Software LED On")
-				turnouts.provideTurnout("SWLEDWHT").setState(CLOSED)
-				pass
-			elif (Value == "OFF") :
-				print ("Testbed White Software LED Off")
-				turnouts.provideTurnout("SWLEDWHT").setState(THROWN)
-				pass
-			else :
-				print ("Please select either 'ON' or 'OFF'")
-				pass
-		elif (Led == "BLU") :
-			if (Value == "ON") :
-				print ("Testbed Blue Software LED On")
-				turnouts.provideTurnout("SWLEDBLU").setState(CLOSED)
-				pass
-			elif (Value == "OFF") :
-				print ("Testbed Blue Software LED Off")
-				turnouts.provideTurnout("SWLEDBLU").setState(THROWN)
-				pass
-			else :
-				print ("Please select either 'ON' or 'OFF'")
-				pass
-		else :
-			print ("Please select either 'WHT' or 'BLU' Led")
-			pass
+####################################################################################
+	def applyJob(self, job) :
+		self.locomotiveType = job.get("type", "Diesel")
+		self.topSpeed = job["topspeed"]
+		self.addressOverride = job.get("address")
+		self.blockCalibration = job.get("blockcalibration", False)
+		self.sweepMode = job.get("sweep", False)
+		self.sweepVerify = job.get("sweepverify", False)
+		self.verifyTable = job.get("verifytable", True)
+		self.resumeStopped = job.get("resume", True)
 		return
 ####################################################################################
 #
-# self.TrackNormal() configures the testbed to turn the main DCC power to both loops
-# JMD: For my project with a single track, this method can be eliminated.
+# self.waitForLocomotive() asks the operator to put the job's locomotive on the
+# loop. When swapping, it waits for the loop to go empty and then occupied again.
+# The main is only claimed once the locomotive is on the loop, so a session on the
+# other loop can have the program track during the swap.
 #
-####################################################################################	
-	def TrackNormal(self):
-		self.DCCSourceSelect("MAIN")
-		self.waitMsec(500)
+####################################################################################
+	def waitForLocomotive(self, job, swap) :
+		self.say()
+		self.say("Job", self.jobNumber, ":", job.get("name", ""), job.get("type", "Diesel"), job["topspeed"], "MPH")
+		if swap :
+			self.say("Take the last locomotive off the loop")
+			while self.LoopActive() :
+				self.pause(1000)
+		if not self.LoopActive() :
+			self.say("Put the locomotive for this job on the loop")
+			while not self.LoopActive() :
+				self.pause(1000)
+			self.pause(self.SwapSettleMsec)	# hands clear of the track
+		self.TrackNormal()
 		return
 ####################################################################################
 #
-# self.TrackProgram() configures the testbed to select the DCC program on both loops
-# JMD: For my project with a single track, this method can be eliminated.
+# self.loadJobs() reads a batch job file, a JSON list of jobs
 #
-####################################################################################	
-	def TrackProgram(self):
-		self.DCCSourceSelect("PROG")
-		self.waitMsec(500)
+####################################################################################
+	def loadJobs(self, path) :
+		f = open(path, "r")
+		try :
+			return json.load(f)
+		finally :
+			f.close()
+####################################################################################
+#
+# self.saveResult() writes the results of a batch job to its own file
+#
+####################################################################################
+	def saveResult(self, job) :
+		directory = self.testbedFile("results")
+		if not os.path.isdir(directory) :
+			os.makedirs(directory)
+		name = job.get("name", "job%d" % self.jobNumber)
+		f = open(os.path.join(directory, name + ".json"), "w")
+		try :
+			json.dump(self.result, f, indent = 1)
+		finally :
+			f.close()
+		self.say("Results for", name, "written")
 		return
 ####################################################################################
 #
-# self.waitNextActive() configures the testbed to turn the main DCC power to both loops
+# self.handle() runs a single test when started from the input panel. In batch
+# mode it runs one job each time it is called and returns True while jobs remain.
+# A job that fails stops its locomotive and has the error in its results, and the
+# queue goes on with the next job.
 #
-####################################################################################	
-	def waitNextActiveSensor(self, sensorlist) :
-		inactivesensors = []
-		
-		if (len(sensorlist) == 1) :
-			if (sensorlist[0].getKnownState() == sensorlist[0].ACTIVE) :
-				self.waitSensorInactive(sensorlist)
-			inactivesensors.append(sensorlist[0])
-		else :
-			for s in sensorlist:
-				if s.getKnownState() == s.INACTIVE :
-					inactivesensors.append(s)
-		self.waitSensorActive(inactivesensors)
+####################################################################################
+	def handle(self):
+		if self.jobs == None :
+			self.runSession(None)
+			return False
+
+		if len(self.jobs) == 0 :
+			self.say("No calibration jobs left on the", self.loopName, "loop")
+			return False
+		job = self.jobs.pop(0)
+		self.jobNumber = self.jobNumber + 1
+		self.applyJob(job)
+		self.result = {"job": job, "loop": self.loopName}
+		self.throttle = None
+		try :
+			self.runSession(job)
+		except (Exception, java.lang.Exception), e :
+			self.say("Job", self.jobNumber, "failed:", e)
+			self.result["error"] = str(e)
+			self.stopLocomotive()
+		self.saveResult(job)
+		return len(self.jobs) > 0
+####################################################################################
+#
+# self.stopLocomotive() stops and lets go of the locomotive after a job failed
+#
+####################################################################################
+	def stopLocomotive(self) :
+		if self.throttle != None :
+			self.throttle.setSpeedSetting(0.0)
+			self.throttle.release()
+			self.throttle = None
 		return
 ####################################################################################
 #
-# self.measureTime() is used as part of the speed measurement
+# self.runSession() calibrates the locomotive on this session's loop once no other
+# session is using its sensors, and always lets go of the testbed afterwards
 #
-# This has been rewritten to first get the set of only the inactive sensors then
-# wait just on a list of those sensors until one of them goes active.
+####################################################################################
+	def runSession(self, job):
+		self.arbiter.acquireSensors(self.loopName, self.loop["sensors"], self.say)
+		try :
+			self.runId = "%s-%s-%d" % (self.loopName, time.strftime("%Y%m%d-%H%M%S"), self.jobNumber)
+			if self.LogEvents :
+				self.startEventLog(job)
+			if self.RecordTrace :
+				self.startTrace(job)
+			if job != None :
+				self.waitForLocomotive(job, self.jobNumber > 1)
+			self.calibrateLocomotive()
+		finally :
+			self.stopTrace()
+			self.stopEventLog()
+			self.arbiter.release(self.loopName)
+		return
+####################################################################################
 #
-# This should eliminate the false triggering of the block sensors that have a long
-# timeout delay when they go from active to inactive.
+# self.startTrace() starts recording the session to a new trace file, see
+# TraceRecorder, and self.stopTrace() closes it
 #
 ####################################################################################
-	def measureTime(self, sensorlist, starttime, stoptime) :
-
-		"""Measures the time between virtual blocks"""
-
-        # At the start of a measurement loop, we have to get the start time at the beginning
-        # of the block then measure the time for the block.
-        #
-        # Otherwise, we take the stop time from the previous block, make it the start time
-        # for this block and measure this block.
-
-		if (starttime == 0):
-			self.waitNextActiveSensor(sensorlist)
-			stoptime = java.lang.System.currentTimeMillis()
-	
-		starttime = stoptime
-
-		self.waitNextActiveSensor(sensorlist)
-		stoptime = java.lang.System.currentTimeMillis()
+	def startTrace(self, job) :
+		directory = self.testbedFile("traces")
+		if not os.path.isdir(directory) :
+			os.makedirs(directory)
+		name = self.runId + ".trace"
+		header = {"loop": self.loopName, "sensors": self.loop["sensors"], "blocklengths": self.BlockLengths,
+			"blocklengthscalibrated": self.blockLengthsCalibrated,
+			"states": dict([(s.getDisplayName(), s.getKnownState()) for s in self.LoopSensors]), "job": job}
+		self.trace = TraceRecorder(os.path.join(directory, name), self.clock, header)
+		self.result["trace"] = self.trace.path
+		self.say("Recording the run in", self.trace.path)
+		return
 
-		runtime = stoptime - starttime
-		return runtime, starttime, stoptime
+	def stopTrace(self) :
+		if self.trace != None :
+			self.trace.close()
+			self.trace = None
+		return
 ####################################################################################
 #
-# self.getSpeed() is used as part of the speed measurement
+# self.startEventLog() starts the event log of the session, see EventLog, and
+# self.stopEventLog() closes it once everything logged is written
 #
-# This takes several speed measurements and returns an average value. If more than
-# 3 values are given, the min and max values are omitted from the average.
-# The final speed value returned is an average of the remaining values.
+####################################################################################
+	def startEventLog(self, job) :
+		directory = self.testbedFile("logs")
+		if not os.path.isdir(directory) :
+			os.makedirs(directory)
+		self.eventLog = EventLog(os.path.join(directory, self.runId + ".jsonl"), self.clock, self.runId, self.ConsoleLog)
+		self.result["log"] = self.eventLog.path
+		self.logEvent("message", None, {"loop": self.loopName, "job": job})
+		return
+
+	def stopEventLog(self) :
+		if self.eventLog != None :
+			self.eventLog.close()
+			self.eventLog = None
+		return
+####################################################################################
+#
+# self.logEvent() adds a record to the event log, see EventLog. Without a log the
+# text is printed, as it is before init() (setupBatch() runs first). self.say()
+# logs a message made of its parts, like print did.
 #
 ####################################################################################
-	def getSpeed(self, speedlist) :
+	def logEvent(self, event, text, fields = None) :
+		if getattr(self, "eventLog", None) != None :
+			self.eventLog.record(event, text, fields)
+		elif text != None :
+			print (text)
+		return
 
-		imin = imax = 0
-		minval = maxval = 0.0
-		
-		if (self.NumSpeedMeasurements > 3):
-			minval = min(speedlist)
-			maxval = max(speedlist)
-			for s in range(0, self.NumSpeedMeasurements):
-				if (speedlist[s] == minval):
-					imin = s
-				if (speedlist[s] == maxval):
-					imax = s
-			if (imin > imax):
-				del speedlist[imin]
-				del speedlist[imax]
-			else:
-				del speedlist[imax]
-				del speedlist[imin]
-		
-		speed = sum(speedlist)/len(speedlist)
-		return speed
+	def say(self, *parts) :
+		self.logEvent("message", " ".join([str(part) for part in parts]))
+		return
 ####################################################################################
 #
-# self.measureSpeed() performs the speed measurement algorithm
+# self.logTransit() logs each block transit the speed estimator times
 #
-# Given which track loop and the length of a block, we can measure the speed by
-# measuring the time through each block. This version takes several measurements and
-# averaging them, throwing out the high and low values.
+####################################################################################
+	def logTransit(self, transit) :
+		start, stop, direction, index = transit
+		length = self.BlockLengths[index]
+		self.logEvent("transit", None, {"sensor": self.LoopSensors[index].getDisplayName(), "start": start, "stop": stop,
+			"direction": direction, "length": length, "speed": (length / ((stop - start) / 1000.0)) * (3600.0 / 5280)})
+		return
+####################################################################################
+#
+# self.traceEvent() records an event in the trace of the session, if there is one,
+# and self.traceEdge() records the sensor edges
 #
-# The targetspeed parameter is used to select the appropriate sensor array
 ####################################################################################
-	def measureSpeed(self, targetspeed) :
-		"""converts time to speed, ft/sec - scale speed"""
-		starttime = stoptime = 0	# Needed when using every block
-		speed = 0.0
-		speedlist = []
-		num_measurements = self.NumSpeedMeasurements
-		num_blocks = 1
-		sensor_array = []
-		
-		self.memory24.value = str(targetspeed)
-
-		if (int(targetspeed) >= self.HighSpeedThreshold) :
-			num_blocks = self.HighSpeedNBlocks
-			sensor_array = self.HighSpeedArrayN
-			print ("Measuring speed using the high speed array,", num_blocks, "block(s)...")
-		elif (int(targetspeed) >= self.MediumSpeedThreshold) :
-			num_blocks = self.MediumSpeedNBlocks
-			sensor_array = self.MediumSpeedArrayN
-			print ("Measuring speed using the medium speed array,", num_blocks, "block(s)...")
-		else:
-			num_blocks = self.LowSpeedNBlocks
-			sensor_array = self.LowSpeedArrayN
-			print ("Measuring speed using the low speed array,", num_blocks, "block(s)...")
-
-		# Calculate the length of the selected block
-		blocklength = self.block * num_blocks
-
-        # Measure the speed a number of times and put those speeds into a list
-
-		for z in range(0,self.NumSpeedMeasurements) : # make 5 speed measurements
-			duration, starttime, stoptime = self.measureTime(sensor_array,starttime,stoptime)
-
-			if duration == 0 :
-				print ("Error: Got a zero for duration") # this should not happen
-				speed = 0.0
-			else :
-				speed = (blocklength / (duration / 1000.0)) * (3600.0 / 5280)
-				print ("    Measurement ", z+1, ", Speed = ", str(round(speed,3)) , "MPH")
-				self.status.text = "Speed = " + str(round(speed,3)) + " MPH"
-			speedlist.append(speed)
+	def traceEvent(self, kind, *fields) :
+		if self.trace != None :
+			self.trace.record(kind, *fields)
+		return
 
-		speed = self.getSpeed(speedlist)
-		return speed
+	def traceEdge(self, sensor, state, stamp) :
+		if self.trace != None :
+			self.trace.sensorEdge(sensor, state, stamp)
+		return
 ####################################################################################
 #
-# self.handle() will only be execute once here, to run a single test
+# self.calibrateLocomotive() builds the speed table for the locomotive on the loop
 #
 ####################################################################################
-	def handle(self):
+	def calibrateLocomotive(self):
+		self.resetRun()
 
 		long = False
 		address = 0
@@ -441,41 +2700,35 @@ class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
 		mfrVersion = 0
 				
 		# 01/02/2017 ECW: Ported to Erich's setup starting with v2.2
-		print ("Speed Table Script Version", self.scriptversion)
+		self.say("Speed Table Script Version", self.scriptversion)
 
-		topspeed = float(self.MaxSpeed.text)/100
-		print ("Top Target Speed is ", self.MaxSpeed.text, "MPH")
-		self.status.text = "Locomotive Setup"
+		topspeed = float(self.topSpeed)/100
+		self.say("Top Target Speed is ", self.topSpeed, "MPH")
+		self.setStatus("Locomotive Setup")
 
 		self.TrackNormal()
 	
 		if (self.LoopActive()) :
-			self.status.text = "Locomotive Detected"
-			print ("Locomotive found on track loop")
+			self.setStatus("Locomotive Detected")
+			self.say("Locomotive found on track loop")
 			pass
 		else :
-			print ("No locomotive detected on the track, cannot proceed")
+			self.say("No locomotive detected on the track, cannot proceed")
+			self.setStatus("Done - No Locomotive Detected")
 			return
 			
 		self.TrackProgram()	
 
-		print ("Reading Locomotive...")
-		self.val29 = self.readServiceModeCV("29")
-		print ("CV 29 = ", self.val29)
-		self.val1 = self.readServiceModeCV("1")
-		print ("CV 1 = ", self.val1)
-		self.val17 = self.readServiceModeCV("17")
-		print ("CV 17 = ", self.val17)
-		self.val18 = self.readServiceModeCV("18")
-		print ("CV 18 = ", self.val18)
-		self.val7 = self.readServiceModeCV("7")
-		print ("CV 7 = ", self.val7)
-		self.val8 = self.readServiceModeCV("8")
-		print ("CV 8 = ", self.val8)
-		self.val105 = self.readServiceModeCV("105")
-		print ("CV 105 = ", self.val105)
-		self.val106 = self.readServiceModeCV("106")
-		print ("CV 106 = ", self.val106)
+		self.say("Reading Locomotive...")
+		values = self.identifyDecoder()
+		self.val29 = values[29]
+		self.val1 = values[1]
+		self.val17 = values[17]
+		self.val18 = values[18]
+		self.val7 = values[7]
+		self.val8 = values[8]
+		self.val105 = values[105]
+		self.val106 = values[106]
 		
 		# Determine if this locomotive uses a long address
 		if ((self.val29 & 32) == 32) :
@@ -495,23 +2748,45 @@ class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
 		else:
 			self.DecoderType = "Unknown"
 			
-		print ("The Locomotive Address is: ", self.address)
-		print ("The Manufacturer is: ", self.DecoderType)
-		print ("The Manufacturer ID is: ", self.mfrID)
-		print ("The Manufacturer Version is: ", self.mfrVersion)
-		print ("The Current Private ID is ", self.val105, ", ", self.val106)
+		if self.addressOverride != None :
+			self.say("The address read was", self.address, "but the job says", self.addressOverride)
+			self.address = self.addressOverride
+			self.long = self.address > 127
+
+		self.say("The Locomotive Address is: ", self.address)
+		self.say("The Manufacturer is: ", self.DecoderType)
+		self.say("The Manufacturer ID is: ", self.mfrID)
+		self.say("The Manufacturer Version is: ", self.mfrVersion)
+		self.say("The Current Private ID is ", self.val105, ", ", self.val106)
+
+		# The profile saved by the last run was keyed by the private ID it wrote
+		previouskey = self.profiles.locomotiveKey(self.address, self.mfrID, self.mfrVersion, self.val105, self.val106)
+		self.profile = self.profiles.load(previouskey)
+		if (self.profile != None) :
+			self.say("Found the profile from the last run of this locomotive")
+
+		# Start the shadow from the CVs the last run left in the decoder, then the reads
+		if (self.profile != None and self.profile.has_key("cvs")) :
+			self.shadow = DecoderShadow(self.profile["cvs"])
+		else :
+			self.shadow = DecoderShadow()
+		for cv, value in [(1, self.val1), (7, self.val7), (8, self.val8), (17, self.val17), (18, self.val18), (29, self.val29), (105, self.val105), (106, self.val106)] :
+			self.shadow.set(cv, value)
+		if self.ReadShadowCVs :
+			self.say("Reading the CVs the calibration writes...")
+			self.readShadowCVs()
 
 		self.TrackNormal()	
 
         # Getting throttle
 		
-		self.status.text = "Getting throttle"
+		self.setStatus("Getting throttle")
 
 		self.throttle = self.getThrottle(self.address, self.long)
 		if (self.throttle == None) :
-			print ("ERROR: Couldn't assign throttle!")
+			self.say("ERROR: Couldn't assign throttle!")
 		else :
-			print ("Trottle assigned to locomotive: ", self.address)
+			self.say("Trottle assigned to locomotive: ", self.address)
 
             # Getting Programmer
 
@@ -519,26 +2794,53 @@ class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
 
 		self.SWLed("BLU", "ON")
 
-		print ("Turn on the headlight")
+		self.say("Turn on the headlight")
 		self.throttle.setF0(True)
-		print ("Mute the sound")
+		self.say("Mute the sound")
 		self.throttle.setF8(True)
 	
-		starttesttime = java.lang.System.currentTimeMillis()
+		starttesttime = self.clock.millis()
+		pipeline = None		# CV writes still going when the locomotive heads home
 		badlocomotive = False # will be true if locomotive will not go slow enough
 
-		if (self.val105 != 42) :
-			self.testbedWriteCV(105, 42) # Write Private ID #42 in Decoder CV 105
-		if (self.val106 < 255) :
-			self.val106 = self.val106+1
-			self.testbedWriteCV(106, self.val106) # Write count in Decoder CV 106
-
-		print ("Set Private ID to ", self.val105, ", ", self.val106)
-
-		print ("Decoder Brand is", self.DecoderType)
+		# A run that was stopped left a checkpoint under the private ID it wrote
+		self.checkpointFile = self.profiles.checkpointKey(self.address, self.mfrID, self.mfrVersion, self.val105, self.val106)
+		self.checkpoint = self.profiles.load(self.checkpointFile)
+		if (self.checkpoint != None) :
+			if self.askResume(self.checkpoint) :
+				self.say("Resuming the run stopped after", self.checkpoint["phase"])
+				self.profile = self.checkpoint["profile"]
+				self.measurements.restore(self.checkpoint["measurements"])
+			else :
+				self.profiles.remove(self.checkpointFile)
+				self.checkpoint = None
+
+		previous105 = self.val105
+		previous106 = self.val106
+		if (self.checkpoint == None) :
+			if (self.val105 != 42) :
+				self.testbedWriteCV(105, 42) # Write Private ID #42 in Decoder CV 105
+				self.val105 = 42
+			if (self.val106 < 255) :
+				self.val106 = self.val106+1
+				self.testbedWriteCV(106, self.val106) # Write count in Decoder CV 106
+			self.checkpointFile = self.profiles.checkpointKey(self.address, self.mfrID, self.mfrVersion, self.val105, self.val106)
+			self.checkpoint = {"profile": self.profile}
+
+		self.say("Set Private ID to ", self.val105, ", ", self.val106)
+		self.profileKey = self.profiles.locomotiveKey(self.address, self.mfrID, self.mfrVersion, self.val105, self.val106)
+		self.result["address"] = self.address
+		self.result["decoder"] = self.DecoderType
+		self.result["profile"] = self.profileKey
+		if (self.profile != None and previouskey != self.profileKey) :
+			self.profiles.remove(previouskey)
+		self.saveIdentity(previous105, previous106)
+		self.saveCheckpoint("identification")
+
+		self.say("Decoder Brand is", self.DecoderType)
 
  		
-		self.memory25.value = "Setting CVs to known state"
+		self.setStatus("Setting CVs to known state")
 		self.testbedWriteCV(62, 0) # Turn off verbal reporting on QSI decoders
 		self.testbedWriteCV(25, 0) # Turn off manufacture defined speed tables
 		self.testbedWriteCV(19, 0) # Clear Consist Address in locomotive
@@ -556,96 +2858,117 @@ class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
 		self.testbedWriteCV(66, 0) #Turn off Forward Trim
 		self.testbedWriteCV(95, 0) #Turn off reverse Trim
 
-		# Run Locomotive for 5 laps each direction to warm it up
+		# Run Locomotive each direction until the lap times settle to warm it up
 
-		self.status.text = "Warming up Locomotive"
-		print
-		print ("Warming up Locomotive")
-		self.throttle.setIsForward(True)
+		self.setStatus("Warming up Locomotive")
+		self.say()
+		self.say("Warming up Locomotive")
+		self.setThrottleDirection(True)
 
 		#01/09/09	TCS decoder would not move when setting throttle to 1.0
  
- 		print ("Set the throttle to 1.0")
-
-		self.throttle.setSpeedSetting(.99)
-		self.waitMsec(250)
-		self.throttle.setSpeedSetting(1.0)
-
-		print ("Wait for the locomotive to get to block", self.homesensor_num, "after", self.warmupLaps, "laps...")
+ 		self.say("Set the throttle to 1.0")
+
+		self.setThrottleSpeed(.99)
+		self.pause(250)
+		self.setThrottleSpeed(1.0)
+
+		self.warmUp("forward")
+
+		# A block calibration run only needs the warmed up locomotive
+		if (self.blockCalibration) :
+			self.calibrateBlockLengths()
+			self.setStatus("Done - Block Lengths Calibrated")
+			self.profiles.remove(self.checkpointFile)
+			self.finishRun(starttesttime)
+			return False
+
+		self.say("Stop the locomotive")
+		self.setThrottleSpeed(0.0)
+		self.waitStopped(2000)
+		self.yieldTrack()
+		
+		# Warm up reverse
 
-		for x in range (0, self.warmupLaps) :
-			self.waitNextActiveSensor([self.homesensor])
+		if self.locomotiveType <> "Steam" :
+			self.setThrottleDirection(False)
+			self.setThrottleSpeed(1.0)
 
-		print ("Stop the locomotive")
-		self.throttle.setSpeedSetting(0.0)
-		self.waitMsec(2000)
-		
-		# Warm up 5 laps reverse
+			self.warmUp("reverse")
 
-		if self.Locomotive.getSelectedItem() <> "Steam" :
-			self.throttle.setIsForward(False)
-			self.throttle.setSpeedSetting(1.0)
+		# Find maximum speed reverse, unless a stopped run already has
 
-			print ("Warming up in the reverse direction for", self.warmupLaps, "laps...")
-			for x in range (0, self.warmupLaps) :
+		if self.checkpoint.has_key("fwdmaxspeed") :
+			revmaxspeed = self.checkpoint["revmaxspeed"]
+			fwdmaxspeed = self.checkpoint["fwdmaxspeed"]
+			self.say("Maximum speeds from the stopped run: reverse", round(revmaxspeed), "forward", round(fwdmaxspeed))
+			self.setThrottleSpeed(0.0)
+			self.waitStopped(3000)
+		else :
+			if self.locomotiveType <> "Steam" :
+				self.say("Finding the maximum reverse speed...")
+				self.setStatus("Finding Maximum Reverse Speed")
+				self.setThrottleSpeed(1.0)	# already there, the warm-up laps count
+				self.pause(500)
+				revmaxspeed = self.measureSpeed(self.fullSpeed)
+				self.measurements.put(False, 127, revmaxspeed, self.speedPrecision)
+				self.say("Maximum reverse speed found = ",round(revmaxspeed))
+				self.say()
+				self.say("Returning locomotive to block", self.homesensor.getDisplayName(), "...")
 				self.waitNextActiveSensor([self.homesensor])
+				self.setThrottleSpeed(0.0)
+				self.setStatus("Max Reverse Speed " + str(int(revmaxspeed)))
+				self.waitStopped(3000)
+			else :
+				revmaxspeed = 0
 
-		# Find maximum speed reverse
+		# Find maximum speed forward
 
-			print ("Finding the maximum reverse speed...")
-			self.status.text = "Finding Maximum Reverse Speed"
-			self.throttle.setSpeedSetting(1.0)
-			self.waitMsec(500)
-			revmaxspeed = self.measureSpeed(self.fullSpeed)
-			print ("Maximum reverse speed found = ",round(revmaxspeed))
-			print
-			print ("Returning locomotive to block", self.homesensor_num, "...")
+			self.setStatus("Finding Maximum Forward Speed")
+			self.say("Finding the maximum forward speed over up to", self.MaxSpeedMeasurements, "laps...")
+			self.setThrottleDirection(True)
+			self.waitDirection(500)
+			self.setThrottleSpeed(1.0, 1000)
+			self.pause(1000)
+			fwdmaxspeed = self.measureSpeed(self.fullSpeed)
+			self.measurements.put(True, 127, fwdmaxspeed, self.speedPrecision)
+			self.say("Maximum forward speed found = ",round(fwdmaxspeed))
+			self.say()
+			self.say("Returning locomotive to block", self.homesensor.getDisplayName(), "...")
 			self.waitNextActiveSensor([self.homesensor])
-			self.throttle.setSpeedSetting(0.0)
-			self.status.text = "Max Reverse Speed " + str(int(revmaxspeed))
-			self.waitMsec(3000)
-		else :
-			revmaxspeed = 0
+			self.setThrottleSpeed(0.0)
+			self.setStatus("Max Forward Speed " + str(int(fwdmaxspeed)))
+			self.waitStopped(1000)
 
-		# Find maximum speed forward
-		
-		self.status.text = "Finding Maximum Forward Speed"
-		print ("Finding the maximum forward speed over", self.NumSpeedMeasurements, "laps...")
-		self.throttle.setIsForward(True)
-		self.waitMsec(500)
-		self.throttle.setSpeedSetting(1.0)
-		self.waitMsec(1000)
-		fwdmaxspeed = self.measureSpeed(self.fullSpeed)
-		print ("Maximum forward speed found = ",round(fwdmaxspeed))
-		print
-		print ("Returning locomotive to block", self.homesensor_num, "...")
-		self.waitNextActiveSensor([self.homesensor])
-		self.throttle.setSpeedSetting(0.0)
-		self.status.text = "Max Forward Speed " + str(int(fwdmaxspeed))
-		self.waitMsec(1000)
+			self.checkpoint["revmaxspeed"] = revmaxspeed
+			self.checkpoint["fwdmaxspeed"] = fwdmaxspeed
+			self.checkpoint["warmup"] = self.warmupCurve
+			self.saveCheckpoint("maximum speeds")
 
 		if (fwdmaxspeed > revmaxspeed) :
-			print ("Locomotive",self.address,"is faster in the forward direction")
-			self.throttle.setIsForward(True)
-			self.waitMsec(500)
+			self.say("Locomotive",self.address,"is faster in the forward direction")
+			self.setThrottleDirection(True)
+			self.waitDirection(500)
 		elif (revmaxspeed > fwdmaxspeed) :
-			print ("Locomotive",self.address,"is faster in the reverse direction")
-			self.throttle.setIsForward(False)
-			self.waitMsec(500)
+			self.say("Locomotive",self.address,"is faster in the reverse direction")
+			self.setThrottleDirection(False)
+			self.waitDirection(500)
 		else :
-			print ("Locomotive",self.address,"runs equally well in both directions")
-			self.throttle.setIsForward(True)
-			self.waitMsec(500)
+			self.say("Locomotive",self.address,"runs equally well in both directions")
+			self.setThrottleDirection(True)
+			self.waitDirection(500)
 
-		print
-		print ("Decoder Brand is ",self.DecoderType)
+		self.say()
+		self.say("Decoder Brand is ",self.DecoderType)
 
-		if self.DecoderType == "Digitrax" :
+		if self.checkpoint.has_key("steplist") :
+			steplist = self.checkpoint["steplist"]
+		elif self.DecoderType == "Digitrax" :
 			steplist = self.DigitraxStepList 
 		elif self.DecoderType == "TCS" :
 			#09/15/09
-			self.status.text = "Determining Type of TCS Decoder"
-			print ("Determining Type of TCS Decoder")
+			self.setStatus("Determining Type of TCS Decoder")
+			self.say("Determining Type of TCS Decoder")
 
 			# Set speed table CV's to determine which type of TCS decoder it is
 	
@@ -658,19 +2981,19 @@ class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
 			else:
 				self.testbedWriteCV(29, 18)
 
-			self.throttle.setSpeedSetting(.85)
-			self.waitMsec(2000)
+			self.setThrottleSpeed(.85, 2000)
+			self.pause(2000)
 			speed = self.measureSpeed(self.fullSpeed)
-			self.throttle.setSpeedSetting(0.0)
+			self.setThrottleSpeed(0.0)
 			if speed > (.9 * fwdmaxspeed) :
 				steplist = self.NewTCSStepList
-				print ("Using new TCS steplist")
+				self.say("Using new TCS steplist")
 			else :
 				steplist = self.OldTCSStepList
-				print ("Using old TCS steplist")
-			self.waitMsec(3000)
+				self.say("Using old TCS steplist")
+			self.waitStopped(3000)
 
-		elif self.DecoderType == "Lenz5Gen" :
+		elif self.DecoderType == "Lenz Gen 5" :
 			steplist = self.Lenz5GenStepList
 		elif self.DecoderType == "Atlas/Lenz XF" :
 			steplist = self.LenzXFStepList
@@ -687,16 +3010,24 @@ class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
 			steplist = self.ESUStepList
 		else :	#User doesn't know decoder type
 				#and we couldn't figure it out 
-			print ("Decoder is still unknown")
-		self.throttle.setSpeedSetting(0.0)
-		self.waitMsec(2000)
+			self.say("Decoder is still unknown")
+		self.setThrottleSpeed(0.0)
+		self.waitStopped(2000)
+		self.yieldTrack()
+		if self.DecoderType <> "Unknown" and not self.checkpoint.has_key("steplist") :
+			self.checkpoint["steplist"] = steplist
+			self.saveCheckpoint("choosing the speed steps")
 
 
 		#we are now ready to build a speedtable
 
 		if self.DecoderType <> "Unknown" :
 
-			self.status.text = "Measuring Speeds"
+			self.tableScale = 1.0
+			if self.DecoderType == "TCS" and steplist == self.NewTCSStepList :
+				self.tableScale = self.NewTCSTableScale
+
+			self.setStatus("Measuring Speeds")
 
 			#Turn off speed table for measurements
 			if self.long == True :
@@ -708,297 +3039,198 @@ class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
 			# if the locomotive is a diesel.  Steam locomotives with tenders that have offset
 			# pickups sometimes gave ambiguous readings
 
-			if self.Locomotive.getSelectedItem() <> "Steam" :
+			if self.checkpoint.has_key("forward") :
+				self.setThrottleDirection(self.checkpoint["forward"])
+			elif self.locomotiveType <> "Steam" :
 				if revmaxspeed > fwdmaxspeed :
-					self.throttle.setIsForward(False)
-					self.memory20.value = "Reverse"
+					self.setThrottleDirection(False)
 
 			#Find throttle setting that gives desired speed
 
-			stepvaluelist = [0]
-			throttlesetting = 35	# starting throttle setting(determined by lots of testing)
-			lowthrottle = 0
+			# Every fresh speed measured in this direction goes into one model of the
+			# locomotive, so each target starts from what the earlier targets have
+			# already shown. Full throttle is the maximum speed measured above.
+			model = ThrottleModel()
+			model.addAnchor(0, 0.0)
+			forward = self.throttle.getIsForward()
+			if forward :
+				maxspeed = fwdmaxspeed
+			else :
+				maxspeed = revmaxspeed
+			self.refreshModel(model)
+			self.seedModel(model, forward, maxspeed)
 
-            #			while badlocomotive == False :
+			stepvaluelist = [0]
+			steptargets = {}	# target speed of each measured speed step it can reach
+			if self.checkpoint.has_key("stepvaluelist") :
+				stepvaluelist = self.checkpoint["stepvaluelist"]
+				for z in self.checkpoint["steptargets"].keys() :	# the keys are strings once saved as JSON
+					steptargets[int(z)] = self.checkpoint["steptargets"][z]
+				badlocomotive = self.checkpoint["badlocomotive"]
+				self.say("Speed steps from the stopped run", stepvaluelist)
+			self.checkpoint["forward"] = forward
 
-            #			for targetspeed in steplist :
+			if (self.sweepMode) :
+				self.sweepThrottle(model, round(steplist[-1] * topspeed))
 
-			for speedvalue in steplist :
+			# after a resume, only the speed steps the stopped run did not get to
+			for speedvalue in steplist[(len(stepvaluelist) - 1) / 4:] :
 
 				targetspeed = round(speedvalue * topspeed)		
 
-				print
-				print ("Target Speed ",targetspeed)
-				print
-
+				self.say()
+				self.say("Target Speed ",targetspeed)
+				self.say()
 				stepvaluelist.extend([0,0,0]) #create spots in list for calculated speed steps
 
-				#initializing all variables for next measured speed step
-				Done = False
-				speed = 1000
-				minimumdifference = 20
-				beenupone = False
-				beendownone = False
-				lowspeed = 0	
-				hispeed = 1000
-				hithrottle = 127
-
+				reachable = True
                 #05/21/10
-				if ((self.Locomotive.getSelectedItem() == "Diesel") and (targetspeed > revmaxspeed)) or targetspeed > fwdmaxspeed :
-					print
-					print ("Locomotive can not reach ",targetspeed, " MPH")
-					print
-					Done = True
+				if ((self.locomotiveType == "Diesel") and (targetspeed > revmaxspeed)) or targetspeed > fwdmaxspeed :
+					self.say()
+					self.logEvent("search", "Locomotive can not reach %s MPH" % targetspeed, {"action": "unreachable", "target": targetspeed})
+					self.say()
 					throttlesetting = 127
+					difference = 0
+					reachable = False
+				elif (self.sweepMode and not self.sweepVerify) :
+					throttlesetting = max(0, min(127, int(round(model.predict(targetspeed)))))
+					difference = targetspeed - model.speedAt(throttlesetting)
+				else :
+					# after a sweep the first probe is the computed setting, so this verifies it
+					throttlesetting, difference = self.findThrottle(targetspeed, model)
 
-				while Done == False:
-
-					# Measure speed
-					self.throttle.setSpeedSetting(.0079365 * throttlesetting)
-					self.waitMsec(100)
-					print
-					print ("Throttle Setting ",throttlesetting)
-					speed = self.measureSpeed(targetspeed)
- 
-					# compare it to desired speed and decide whether or not to test a different throttle setting
-					difference = targetspeed - speed
-					print ("Measured Speed = ",round(speed,3), "Difference = ",round(speed - targetspeed,3), " at throttle setting ",throttlesetting)
-
-					#Coarse Measurement
-					if difference < -10 and targetspeed < 20 and throttlesetting > 15 : #started at 35 want to drop fast to reduce time
-						hithrottle = throttlesetting
-						throttlesetting = throttlesetting - 10
-						if throttlesetting < lowthrottle :
-							print ("throttlesetting ",throttlesetting,"is too slow")
-							throttlesetting = lowthrottle + 1
-                            #09/17/09
-							if hithrottle-lowthrottle < 2 :
-								Done = True
-								if (hispeed - targetspeed) > (targetspeed - lowspeed) :
-									throttlesetting = lowthrottle
-								else :
-									throttlesetting = hithrottlesetting
-
-					elif difference < -13 and throttlesetting > 15 : # keep throttle setting > 0
-						hithrottle = throttlesetting
-						throttlesetting = throttlesetting - 6	 # and don't want drastic changes
-						if throttlesetting < lowthrottle :
-							print ("throttlesetting ",throttlesetting,"is too slow")
-                            #08/29/09 This didn't resolve the issue			throttlesetting = lowthrottle
-                            #12-05-08 Having problems with some BEMF decoders	throttlesetting = lowthrottle + 1
-							throttlesetting = lowthrottle + 1
-                            #09/17/09
-							if hithrottle-lowthrottle < 2 :
-								Done = True
-								if (hispeed - targetspeed) > (targetspeed - lowspeed) :
-									throttlesetting = lowthrottle
-								else :
-									throttlesetting = hithrottlesetting
-
-					elif difference < -8 and throttlesetting > 6 : # keep throttle setting > 0
-						hithrottle = throttlesetting
-						throttlesetting = throttlesetting - 3
-						if throttlesetting < lowthrottle :
-							print ("throttlesetting ",throttlesetting,"is too slow")
-							throttlesetting = lowthrottle + 1
-                            #09/17/09
-							if hithrottle-lowthrottle < 2 :
-								Done = True
-								if (hispeed - targetspeed) > (targetspeed - lowspeed) :
-									throttlesetting = lowthrottle
-								else :
-									throttlesetting = hithrottlesetting
-
-					elif difference > 13 and throttlesetting < 121 : # keep throtte setting < 128
-						lowthrottle = throttlesetting
-						throttlesetting = throttlesetting + 7
-						if throttlesetting > hithrottle :
-							print ("throttlesetting ",throttlesetting,"is too fast")
-							throttlesetting = hithrottle - 1
-					elif difference > 8 and throttlesetting < 123 : # keep throtte setting < 128
-						lowthrottle = throttlesetting
-						throttlesetting = throttlesetting + 4
-						if throttlesetting > hithrottle :
-							print ("throttlesetting ",throttlesetting,"is too fast")
-							throttlesetting = hithrottle - 1
-					elif difference > 5 and targetspeed < 20 and throttlesetting > 10 : #for motors that need a lot at the beginning
-						lowthrottle = throttlesetting
-						throttlesetting = throttlesetting + 5
-						if throttlesetting > hithrottle :
-							print ("throttlesetting ",throttlesetting,"is too fast")
-							throttlesetting = hithrottle - 1
+				if throttlesetting < 1 :
+					self.say()
+					self.say("Cannot create speedtable")
+					self.say("Locomotive has mechanical or decoder problem")
+					self.say()
+					badlocomotive = True
+					throttlesetting = 1
 
-					else :
-						#Fine Measurement
-						if minimumdifference > abs(difference) :
-							minimumdifference = abs(difference)
-							savethrottlesetting = throttlesetting
-						elif beenupone == True and beendownone == True :
-							Done = True
-							throttlesetting = savethrottlesetting
-							lowthrottle = throttlesetting + 1
-                            #09/11/08	added print
-							print ("Closest throttle setting is", throttlesetting)
-                            #09/22/08
-
-						if difference < 0  and Done != True :
-							throttlesetting = throttlesetting - 1
-							beendownone = True
-						elif difference > 0 and Done != True :
-							throttlesetting = throttlesetting + 1
-							lowthrottle = throttlesetting
-							beenupone = True
-						else :
-							Done = True
-							throttlesetting = savethrottlesetting
-							lowthrottle = throttlesetting + 1
-
-					if throttlesetting < 1 :
-						print
-						print ("Cannot create speedtable")
-						print ("Locomotive has mechanical or decoder problem")
-						print
-						Done = True
-						badlocomotive = True
-						throttlesetting = 1
+                #09/11/08	added print
+				self.logEvent("search", "Closest throttle setting is %d" % throttlesetting,
+					{"action": "chosen", "target": targetspeed, "setting": throttlesetting, "difference": difference})
 
-	
-					if throttlesetting > 127 :
-						print
-						print ("Locomotive can not reach ",targetspeed, " MPH")
-						print
-						Done = True
-						throttlesetting = 127
-
-				lowthrottle = throttlesetting
 				if difference < -5 :
 					stepvaluelist.append(int(round((throttlesetting - .5) * 2)))
 				elif difference > 5 :
 					stepvaluelist.append(int(round((throttlesetting + .5) * 2)))
 				else :
 					stepvaluelist.append(int(round(throttlesetting * 2)))
-				throttlesetting = throttlesetting + 10 	# no need test a value already in the table
-											# time to do the next speed step
-                                            #09/17/09	had instance where prior statment set speed to 128
-				if throttlesetting > 127 :
-					throttlsetting = 127
+				if reachable :
+					steptargets[len(stepvaluelist) - 1] = targetspeed
+
+				self.checkpoint["stepvaluelist"] = stepvaluelist
+				self.checkpoint["steptargets"] = steptargets
+				self.checkpoint["badlocomotive"] = badlocomotive
+				self.saveCheckpoint("speed step " + str(len(stepvaluelist) - 1))
 
 			# Stop locomotive
 
-			self.throttle.setSpeedSetting(0.0)
-			self.waitMsec(3000)
+			self.setThrottleSpeed(0.0)
+			self.waitStopped(3000)
+			self.yieldTrack()
 
 			#Calculate speed step values inbetween measured ones
 
 			if badlocomotive == False :
-				print
-				print ("Measured Values")
-				print (stepvaluelist)
-
-				if stepvaluelist[4] < 4 :
-					stepvaluelist[4] = 4
+				self.say()
+				self.say("Measured Values")
+				self.say(stepvaluelist)
 
-				stepvaluelist[0] = stepvaluelist[4] - (stepvaluelist[8] - stepvaluelist[4]) #trying to improve the bottom end performance
+				self.buildSpeedTable(stepvaluelist)
 
-				# making sure none of the speedsteps are < 1
-				if ((stepvaluelist[4] - stepvaluelist[0]) / 4) + stepvaluelist[0] < 1 :
-					stepvaluelist[0] = 0
+				self.say()
+				self.say("All Values")
+				self.say(stepvaluelist)
 
-				for  z in range (4, 29, 4) :
-					# To prevent speedsteps from having the same value
-					# decided it was better to error faster than slower
-					if stepvaluelist[z] - stepvaluelist[z - 4] < 4 :
-						stepvaluelist[z] = stepvaluelist[z - 4] + 4
+				self.say("Writing Speed table to locomotive")
+				batch = self.speedTableCVs(stepvaluelist)
 
-					if stepvaluelist[z] > 255 :	#can't have a value greater than 255
-						stepvaluelist[z] = 255
- 
-
-					# Create calculated speed steps
-					y = stepvaluelist[z] - stepvaluelist[z - 4]
-					x = (y/4)
-					stepvaluelist[z -3] = stepvaluelist[z] - round(x * 3)
-					stepvaluelist[z -2] = stepvaluelist[z] - round(x * 2)
-					stepvaluelist[z -1] = stepvaluelist[z] - round(x)
-
-                    #01/09/09	some TCS decoders will stop if a speed step value is 250 or greater
-
-				if self.DecoderType == "TCS" :
-					print
-					print ("Values before TCS correction")
-					print (stepvaluelist)
-					counter = 0
-					for  z in range (21, 29, 1) :
-                        #						print "z= ",z," ",stepvaluelist[z],"counter = ",counter
-						if stepvaluelist[z] > 242 + counter:
-							stepvaluelist[z] = 242 + counter
-						counter = counter + 1
-
-				print
-				print ("All Values")
-				print (stepvaluelist)
-
-				print("Writing Speed table to locomotive")
-				# Write Speed Table to locomotive
-				for z in range (67, 95) :
-					self.testbedWriteCV(z, int(stepvaluelist[z - 66]))
-
-				# Turn on speed table
-				if self.DecoderType == "SoundtraxxDSD" or self.DecoderType == "Tsunami" :			
-					self.testbedWriteCV(25, 16)
-
-				if self.DecoderType == "QSI/BLI" :			
-					self.testbedWriteCV(25, 1)
-
-				if self.long == True :
-					self.testbedWriteCV(29, 50)
-				else:
-					self.testbedWriteCV(29, 18)
+				# Check the table with it turned on and correct the steps that miss
+				if (self.verifyTable) :
+					self.startCVWrites(batch).wait()
+					verified = self.verifySpeedTable(stepvaluelist, steptargets)
+					self.result["verified"] = verified
+					batch = self.speedTableCVs(stepvaluelist)
 
 				# Turn on acceleration and deceleration
-				self.testbedWriteCV(3, 1)	#Acceleration on
-				self.testbedWriteCV(4, 1)	#Deceleration on
-
-				self.status.text = "Done"
+				batch.append((3, 1))	#Acceleration on
+				batch.append((4, 1))	#Deceleration on
+
+				pipeline = self.startCVWrites(batch)
+				if not self.OverlapTableWrites :
+					pipeline.wait()
+
+				self.refreshModel(model)
+				self.saveProfile(model, forward, maxspeed, topspeed, stepvaluelist)
+				self.result["stepvaluelist"] = [int(v) for v in stepvaluelist]
+				self.result["steptargets"] = steptargets
+				self.result["forward"] = forward
+				self.result["stepsettings"] = dict([(z, self.stepSetting(z)) for z in steptargets.keys()])
+
+				if self.result.get("verified", True) :
+					self.setStatus("Done")
+				else :
+					self.setStatus("Done - Speed table misses its targets")
 			else :
-				self.status.text = "Done - Locomotive has decoder or mechanical problem; cannot create speed table"
+				self.setStatus("Done - Locomotive has decoder or mechanical problem; cannot create speed table")
 
 		else :
-			self.status.text = "Done - Unknown Decoder Cannot Proceed"
-
+			self.setStatus("Done - Unknown Decoder Cannot Proceed")
 
+		self.profiles.remove(self.checkpointFile)
+		self.finishRun(starttesttime, pipeline)
+		return False
+####################################################################################
+#
+# self.finishRun() returns the locomotive home, releases it and resets the testbed.
+# Any CV writes still in the pipeline finish while the locomotive runs home.
+#
+####################################################################################
+	def finishRun(self, starttesttime, pipeline = None) :
 		self.throttle.setF8(False)
 		self.throttle.setF0(False)
-		endtesttime = java.lang.System.currentTimeMillis()
-		print
-		print ("Test Time =",(endtesttime - starttesttime) / 1000, "sec.")
-
-		print ("Return to the home position")
-		self.throttle.setSpeedSetting(1.0)
-		self.waitChange([self.sensor1])
-		self.waitSensorActive(self.sensor1)
-		self.throttle.setSpeedSetting(0.0)
+		endtesttime = self.clock.millis()
+		self.say()
+		self.say("Test Time =",(endtesttime - starttesttime) / 1000, "sec.")
+		self.result["testtime"] = (endtesttime - starttesttime) / 1000
+
+		self.say("Return to the home position")
+		self.setThrottleSpeed(1.0)
+		self.clock.waitChange(self, [self.LoopSensors[0]])
+		self.clock.waitSensorActive(self, [self.LoopSensors[0]])
+		self.setThrottleSpeed(0.0)
+
+		if pipeline != None :
+			if not pipeline.wait() :
+				self.setStatus("Done - Some CVs could not be written")
+			self.saveShadow()
+		n, mean, longest = self.writeStats()
+		self.say("CV Writes =", n, "mean", round(mean,1), "msec, longest", round(longest,1), "msec,", self.skippedWrites, "skipped")
+		self.printWaits()
 
 		# done!
 
 		self.SWLed("BLU", "OFF")		
 
 		self.throttle.release()
+		self.edges.detach()
 		#re-enable button
-		self.startButton.enabled = True
+		if self.startButton != None :
+			self.startButton.enabled = True
 		# and stop
 
 
 		# cycle track power because some Digitrax decoders don't stop
-		self.DCCPower("N",  "OFF")
-		self.DCCPower("HO", "OFF")
-		self.waitMsec(500)
+		# only this loop, the other may have a session running
+		self.DCCPower(self.loopName, "OFF")
+		self.pause(500)
 
-		self.DCCPower("N",  "ON")
-		self.DCCPower("HO", "ON")
-		self.waitMsec(500)
+		self.DCCPower(self.loopName, "ON")
+		self.waitTurnout("Power" + self.loopName, CLOSED, 500)
 
-		return False
+		return
 		
 ####################################################################################
 #
@@ -1006,6 +3238,14 @@ class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
 #
 ####################################################################################
 	def whenMyButtonClicked(self,event) :
+		self.loopName = self.LoopName.getSelectedItem()
+		self.locomotiveType = self.Locomotive.getSelectedItem()
+		self.topSpeed = float(self.MaxSpeed.text)
+		self.addressOverride = None
+		self.blockCalibration = self.BlockCalibration.isSelected()
+		self.sweepMode = self.SweepMode.isSelected()
+		self.sweepVerify = self.SweepVerify.isSelected()
+		self.verifyTable = self.VerifyTable.isSelected()
 		self.start()
 		# we leave the button off
 		self.startButton.enabled = False
@@ -1019,7 +3259,11 @@ class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
 #
 ####################################################################################
 
-	def setup(self):
+	def setup(self, loop = "N"):
+		self.loopName = loop
+		self.jobs = None
+		self.result = {}
+
 		# create a frame to hold the button, set up for nice layout
 		f = javax.swing.JFrame("Testbed Input Panel")		# argument is the frames title
 		f.setLocation(300,200)
@@ -1041,14 +3285,35 @@ class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
 		
 		self.MaxSpeed = javax.swing.JTextField(3)
 
+		self.LoopName = javax.swing.JComboBox()
+		names = TestbedLoops.keys()
+		names.sort()
+		for name in names :
+			self.LoopName.addItem(name)
+		self.LoopName.setSelectedItem(self.loopName)
+
+		self.BlockCalibration = javax.swing.JCheckBox("Calibrate block lengths with this locomotive")
+		self.SweepMode = javax.swing.JCheckBox("Single throttle sweep")
+		self.SweepVerify = javax.swing.JCheckBox("Verify each swept setting")
+		self.VerifyTable = javax.swing.JCheckBox("Verify and correct the speed table", True)
+
 		temppanel3 = javax.swing.JPanel()
 		temppanel3.add(javax.swing.JLabel("Maximum Speed (MPH)"))
 		temppanel3.add(self.MaxSpeed)
 
+		temppanel4 = javax.swing.JPanel()
+		temppanel4.add(javax.swing.JLabel("Track Loop"))
+		temppanel4.add(self.LoopName)
+
 		temppanel2 = javax.swing.JPanel()
+		f.contentPane.add(temppanel4)
 		f.contentPane.add(templabel)
 		f.contentPane.add(self.Locomotive)
 		f.contentPane.add(temppanel3)
+		f.contentPane.add(self.BlockCalibration)
+		f.contentPane.add(self.SweepMode)
+		f.contentPane.add(self.SweepVerify)
+		f.contentPane.add(self.VerifyTable)
 		temppanel2.add(self.startButton)
 		f.contentPane.add(temppanel2)
 		f.contentPane.add(self.status)
@@ -1059,13 +3324,56 @@ class DCCDecoderCalibration(jmri.jmrit.automat.AbstractAutomaton) :
 
 ####################################################################################
 #
-# Instantiate the automation class and start it up
+# This method sets up a batch run from a job file instead of the input panel
 #
 ####################################################################################
-a = DCCDecoderCalibration()
 
-# set the name, as a example of configuring it
-a.setName("DCC Decoder Calibration")
+	def setupBatch(self, path, loop = "N"):
+		self.loopName = loop
+		self.jobs = self.loadJobs(path)
+		self.result = {}
+		self.status = None
+		self.startButton = None
+		self.say("Loaded", len(self.jobs), "calibration jobs for the", loop, "loop from", path)
+		return
 
-# This brings up the dialog box that will call self.start()
-a.setup()
+####################################################################################
+#
+# Instantiate the automation class and start it up
+#
+####################################################################################
+# testbedMode can be set before running this script:
+#	"panel"		the input panel starts each run (the default)
+#	"batch"		the jobs in testbedJobFile run back to back without the panel, or
+#			with testbedJobFiles = {"N": ..., "HO": ...} each loop runs its own jobs
+#	"library"	only the classes are defined, nothing is started
+# testbedClock may also be set, to a VirtualClock, to run on virtual time against a
+# simulated layout (TestbedSimulator.py does this)
+try :
+	testbedMode
+except NameError :
+	testbedMode = "panel"
+
+if testbedMode == "batch" :
+	# testbedJobFiles gives a job file for each loop to run at the same time
+	try :
+		testbedJobFiles
+	except NameError :
+		try :
+			testbedJobFile
+		except NameError :
+			testbedJobFile = os.path.join(jmri.util.FileUtil.getUserFilesPath(), "speedmatch", "jobs.json")
+		testbedJobFiles = {"N": testbedJobFile}
+	for loop in testbedJobFiles.keys() :
+		a = DCCDecoderCalibration()
+		a.setName("DCC Decoder Calibration " + loop)
+		a.setupBatch(testbedJobFiles[loop], loop)
+		a.start()
+elif testbedMode <> "library" :
+	a = DCCDecoderCalibration()
+
+	# set the name, as a example of configuring it
+	a.setName("DCC Decoder Calibration")
+
+	# This brings up the dialog box that will call self.start()
+	a.setup()
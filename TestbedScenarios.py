@@ -0,0 +1,186 @@
+####################################################################################
+#
+# TestbedScenarios.py runs MikeDeanSpeedMatch.py on the simulated testbed (see
+# TestbedSimulator.py) in situations the testbed seldom shows on the bench, and
+# checks that each run still finishes the way it should. Each scenario names the
+# simulator options it runs with, what to set up on the layout before the run, and
+# a check of the finished run, which returns what went wrong, or None when the
+# run passed:
+#
+#	python TestbedScenarios.py
+#	python TestbedScenarios.py --scenarios deadband
+#
+# The exit status is the number of scenarios that failed.
+#
+####################################################################################
+
+import argparse
+import os
+import shutil
+import sys
+import time
+
+import TestbedSimulator
+import TraceReplay
+
+####################################################################################
+#
+# A locomotive that does not move below an eighth of full throttle. The first
+# probes of the throttle search stall, so the search has to give up on them and
+# carry on above them.
+#
+####################################################################################
+def checkDeadband(simulation, result, counts) :
+	if result.get("status") <> "Done" :
+		return "status %s" % result.get("status")
+	if counts["stalls"] == 0 :
+		return "no measurement stalled"
+	if simulation.speeds(result.get("forward", True))[0] <= 0.0 :
+		return "speed step 1 does not move the locomotive"
+	return None
+
+####################################################################################
+#
+# A run on a loop with a block length table, replayed from its trace. Every
+# measurement that did not run into the next throttle change has to come out
+# as it was recorded.
+#
+####################################################################################
+def checkReplay(simulation, result, counts) :
+	if result.get("status") <> "Done" :
+		return "status %s" % result.get("status")
+	output = sys.stdout
+	sys.stdout = open(os.devnull, "w")
+	try :
+		replay = TraceReplay.TraceReplay(result["trace"], simulation.options.script, [])
+		try :
+			results = replay.run()
+		finally :
+			replay.close()
+	finally :
+		sys.stdout.close()
+		sys.stdout = output
+	if not results or results[-1][4] == None :
+		return "the trace ended before the last measurement was replayed"
+	differences = [abs(replayed - speed) for msec, target, speed, precision, replayed, replayedprecision, overrun in results if not overrun]
+	if max(differences) > 0.001 :
+		return "replayed speeds differ by up to %.3f MPH" % max(differences)
+	return None
+
+####################################################################################
+#
+# A session on the HO loop holds the sensors the two loops share and runs on the
+# main when the N session starts. It lets go of the sensors after a minute and of
+# the main after three, so the N session first waits for its sensors and then,
+# for its first service mode read, for the program track.
+#
+####################################################################################
+def setupTwoLoops(simulation) :
+	arbiter = simulation.namespace["testbedArbiter"]
+	sensors = simulation.namespace["TestbedLoops"]["HO"]["sensors"]
+	ignore = lambda text : None
+	arbiter.acquireSensors("HO", sensors, ignore)
+	arbiter.acquireMain("HO")
+
+	def sensorsDone() :
+		arbiter.release("HO")
+		arbiter.acquireMain("HO")
+		return
+	simulation.clock.schedule(60000, sensorsDone)
+	simulation.clock.schedule(180000, lambda : arbiter.release("HO"))
+	return
+
+def checkTwoLoops(simulation, result, counts) :
+	if result.get("status") <> "Done" :
+		return "status %s" % result.get("status")
+	f = open(os.path.join(simulation.userfiles, "simulated_run.log"), "r")
+	try :
+		log = f.read()
+	finally :
+		f.close()
+	for text in ["Waiting for another loop to finish with its sensors", "Waiting for the program track",
+			"Waited for ProgMain 3 times"] :
+		if text not in log :
+			return "no '%s' in the log" % text
+	return None
+
+####################################################################################
+#
+# A command station whose direct bit reads are slow. Every read mode is timed on
+# one read, and the rest of the reads have to use direct byte mode.
+#
+####################################################################################
+def setupSlowBitReads(simulation) :
+	simulation.options.readmsec["DIRECTBITMODE"] = 4000.0
+	return
+
+def checkSlowBitReads(simulation, result, counts) :
+	if result.get("status") <> "Done" :
+		return "status %s" % result.get("status")
+	timed = simulation.calibration.readModeMsec
+	if sorted(timed.keys()) <> sorted(simulation.calibration.ReadModes) :
+		return "timed %s" % ", ".join(timed.keys())
+	mode = simulation.calibration.nextReadMode(simulation.globalprogrammer)
+	if mode <> "DIRECTBYTEMODE" :
+		return "reads in %s" % mode
+	return None
+
+# name, simulator options, setup(simulation) or None, check
+Scenarios = [
+	("deadband", ["--calibratedblocks", "--deadband", "0.12", "--maxspeed", "150"], None, checkDeadband),
+	("replay", ["--calibratedblocks", "--blockerror", "0.05"], None, checkReplay),
+	("twoloops", ["--calibratedblocks"], setupTwoLoops, checkTwoLoops),
+	("readmodes", ["--calibratedblocks"], setupSlowBitReads, checkSlowBitReads),
+]
+
+####################################################################################
+#
+# runScenario() runs one scenario and returns what went wrong, or None
+#
+####################################################################################
+def runScenario(scenario, arguments) :
+	name, settings, setup, check = scenario
+	options = TestbedSimulator.parseOptions(["--quiet"] + settings + arguments)
+	counts = {"measurements": 0, "stalls": 0}
+
+	def prepare(calibration) :
+		measure = calibration.measureSpeed
+		def counted(targetspeed) :
+			speed = measure(targetspeed)
+			counts["measurements"] = counts["measurements"] + 1
+			if calibration.speedStalled :
+				counts["stalls"] = counts["stalls"] + 1
+			return speed
+		calibration.measureSpeed = counted
+		return
+
+	simulation = TestbedSimulator.Simulation(options)
+	if setup != None :
+		setup(simulation)
+	try :
+		try :
+			result = simulation.run(prepare)
+		except Exception, e :
+			return "error: %s" % e
+		return check(simulation, result, counts)
+	finally :
+		if options.userfiles == None :
+			shutil.rmtree(simulation.userfiles, True)
+
+if __name__ == "__main__" :
+	parser = argparse.ArgumentParser(description = "Check the speed matching script in simulated testbed scenarios")
+	parser.add_argument("--scenarios", default = None, help = "comma separated scenario names (default: all)")
+	options, simulator = parser.parse_known_args()
+
+	scenarios = Scenarios
+	if options.scenarios != None :
+		scenarios = [s for s in Scenarios if s[0] in options.scenarios.split(",")]
+
+	failed = 0
+	for scenario in scenarios :
+		start = time.time()
+		problem = runScenario(scenario, simulator)
+		if problem != None :
+			failed = failed + 1
+		sys.stderr.write("%-14s %-6s %6.1f sec  %s\n" % (scenario[0], problem == None and "pass" or "FAIL", time.time() - start, problem or ""))
+	sys.exit(failed)
@@ -0,0 +1,819 @@
+####################################################################################
+#
+# TestbedSimulator.py runs MikeDeanSpeedMatch.py without a layout. It stands in for
+# JMRI: the loop's block detectors, the throttle, the ops mode programmer and the
+# program track, and a locomotive with a throttle to speed curve, momentum, noise
+# and a decoder that keeps its CVs. The script runs unchanged as a batch job, on a
+# VirtualClock (see the script), so a whole calibration takes seconds and runs the
+# same each time for the same seed.
+#
+#	python TestbedSimulator.py --topspeed 60 --brand Digitrax --seed 3
+#
+# Run it with plain Python 2.7 from the testbed directory. The profiles, block
+# lengths and results the script saves go to --userfiles (a new temporary
+# directory unless given), so a second run with the same --userfiles sees the
+# first run's profile just like the testbed would.
+#
+####################################################################################
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import types
+
+SENSOR_ACTIVE = 2
+SENSOR_INACTIVE = 4
+TURNOUT_CLOSED = 2
+TURNOUT_THROWN = 4
+FEEDBACK_DIRECT = 1
+FEEDBACK_ONESENSOR = 16
+
+# Manufacturer IDs (CV8) of the decoders the script knows, see DecoderMap
+Brands = {"Tsunami": 141, "Digitrax": 129, "TCS": 153, "NCE": 11, "QSI/BLI": 113,
+	"Lenz Gen 5": 99, "ESU": 151, "Atlas/Lenz XF": 127}
+
+####################################################################################
+#
+# SimSensor, SimTurnout and their managers stand in for the JMRI beans the script
+# uses. Sensor changes go to the property change listeners like JMRI's do.
+#
+####################################################################################
+class SimEvent :
+
+	def __init__(self, source, name, old, new) :
+		self.source = source
+		self.name = name
+		self.old = old
+		self.new = new
+		return
+
+	def getSource(self) :
+		return self.source
+
+	def getPropertyName(self) :
+		return self.name
+
+	def getOldValue(self) :
+		return self.old
+
+	def getNewValue(self) :
+		return self.new
+
+class SimSensor :
+
+	ACTIVE = SENSOR_ACTIVE
+	INACTIVE = SENSOR_INACTIVE
+
+	def __init__(self, name) :
+		self.name = name
+		self.state = SENSOR_INACTIVE
+		self.listeners = []
+		return
+
+	def getDisplayName(self) :
+		return self.name
+
+	def getSystemName(self) :
+		return self.name
+
+	def getKnownState(self) :
+		return self.state
+
+	def setKnownState(self, state) :
+		if state == self.state :
+			return
+		old = self.state
+		self.state = state
+		for listener in list(self.listeners) :
+			listener.propertyChange(SimEvent(self, "KnownState", old, state))
+		return
+
+	def addPropertyChangeListener(self, listener) :
+		self.listeners.append(listener)
+		return
+
+	def removePropertyChangeListener(self, listener) :
+		if listener in self.listeners :
+			self.listeners.remove(listener)
+		return
+
+class SimSensorManager :
+
+	def __init__(self) :
+		self.sensors = {}
+		return
+
+	def provideSensor(self, name) :
+		if not self.sensors.has_key(name) :
+			self.sensors[name] = SimSensor(name)
+		return self.sensors[name]
+
+class SimTurnout :
+
+	def __init__(self, clock, name, relaymsec, feedback) :
+		self.clock = clock
+		self.name = name
+		self.relaymsec = relaymsec
+		self.feedback = feedback
+		self.commanded = TURNOUT_CLOSED
+		self.contacts = TURNOUT_CLOSED	# where the relay actually is
+		return
+
+	def setState(self, state) :
+		self.commanded = state
+		self.clock.schedule(self.relaymsec, lambda : self.settle(state))
+		return
+
+	def getFeedbackMode(self) :
+		if self.feedback :
+			return FEEDBACK_ONESENSOR
+		return FEEDBACK_DIRECT
+
+	def settle(self, state) :
+		if self.commanded == state :
+			self.contacts = state
+		return
+
+	def getState(self) :
+		return self.commanded
+
+	def getCommandedState(self) :
+		return self.commanded
+
+	# Without feedback the known state is the commanded one at once, as in JMRI
+	def getKnownState(self) :
+		if self.feedback :
+			return self.contacts
+		return self.commanded
+
+class SimTurnoutManager :
+
+	def __init__(self, clock, relaymsec, feedback = False) :
+		self.clock = clock
+		self.relaymsec = relaymsec
+		self.feedback = feedback
+		self.turnouts = {}
+		return
+
+	def provideTurnout(self, name) :
+		if not self.turnouts.has_key(name) :
+			self.turnouts[name] = SimTurnout(self.clock, name, self.relaymsec, self.feedback)
+		return self.turnouts[name]
+
+	def state(self, name) :
+		return self.provideTurnout(name).contacts
+
+####################################################################################
+#
+# SimDecoder is the locomotive's decoder: its CVs and how it turns a throttle
+# setting into motor drive, through the speed table when CV29 turns it on and
+# with the CV3/CV4 momentum. A TCS decoder stalls on table values above 249, and
+# a new one reaches the top of its table at about 88% throttle, which is how the
+# script tells old and new TCS decoders apart.
+#
+####################################################################################
+class SimDecoder :
+
+	def __init__(self, address, brand, version, tcs = "new") :
+		self.brand = brand
+		self.tcs = tcs
+		self.cvs = dict([(cv, 0) for cv in range(1, 257)])
+		self.cvs[7] = version
+		self.cvs[8] = Brands[brand]
+		self.cvs[29] = 6
+		if address > 127 :
+			self.cvs[17] = 192 + address / 256
+			self.cvs[18] = address % 256
+			self.cvs[29] = self.cvs[29] | 32
+		else :
+			self.cvs[1] = address
+		self.cvs[2] = 0
+		self.cvs[5] = 255
+		for step in range(28) :
+			self.cvs[67 + step] = int(round((step + 1) * 255 / 28.0))
+		self.drive = 0.0		# motor drive 0..1 after momentum
+		return
+
+	def address(self) :
+		if self.cvs[29] & 32 :
+			return (self.cvs[17] - 192) * 256 + self.cvs[18]
+		return self.cvs[1]
+
+	# Motor drive 0..1 the decoder aims for at a throttle setting 0..1 (128 steps)
+	def target(self, setting) :
+		step = min(126, int(setting * 126 + 0.5))
+		if step == 0 :
+			return 0.0
+		if self.cvs[29] & 16 :
+			position = step * 28 / 126.0
+			if self.brand == "TCS" :
+				# the nearest table entry, no interpolation
+				if self.tcs == "new" :
+					position = min(28.0, position / 0.88)
+				value = self.cvs[66 + max(1, int(round(position)))]
+				if value > 249 :
+					return 0.0
+				return value / 255.0
+			below = int(position)
+			low = 0.0
+			if below > 0 :
+				low = self.cvs[66 + below]
+			high = self.cvs[67 + min(27, below)]
+			return (low + (high - low) * (position - below)) / 255.0
+		return step / 126.0
+
+	# Moves the drive towards the target at the CV3/CV4 rate (CV x 0.896 sec full range)
+	def update(self, target, dt) :
+		if target > self.drive :
+			rate = self.cvs[3] * 0.896
+		else :
+			rate = self.cvs[4] * 0.896
+		if rate <= 0 :
+			self.drive = target
+		else :
+			step = dt / rate
+			if abs(target - self.drive) <= step :
+				self.drive = target
+			elif target > self.drive :
+				self.drive = self.drive + step
+			else :
+				self.drive = self.drive - step
+		return self.drive
+
+####################################################################################
+#
+# SimLocomotive is the mechanism: the motor curve from drive to speed, a bit slower
+# in reverse, slow until it warms up, with inertia and speed noise. Speeds are MPH
+# and positions are scale feet, like the script's block lengths.
+#
+####################################################################################
+class SimLocomotive :
+
+	def __init__(self, decoder, options) :
+		self.decoder = decoder
+		self.maxspeed = options.maxspeed
+		self.reverse = options.reverse
+		self.deadband = options.deadband
+		self.gamma = options.gamma
+		self.noise = options.noise
+		self.inertia = options.inertia
+		self.warmup = options.warmup
+		self.warmupminutes = options.warmupminutes
+		self.length = options.length
+		self.speed = 0.0		# MPH, signed by direction
+		self.position = 0.0		# front of the locomotive, unwrapped
+		self.distance = 0.0		# scale feet run in either direction
+		return
+
+	def curve(self, drive, forward, minutes) :
+		if drive <= self.deadband :
+			return 0.0
+		speed = self.maxspeed * ((drive - self.deadband) / (1.0 - self.deadband)) ** self.gamma
+		if not forward :
+			speed = speed * self.reverse
+		return speed * (1.0 - self.warmup * math.exp(-minutes / self.warmupminutes))
+
+	def move(self, setting, forward, powered, dt, minutes) :
+		if powered :
+			drive = self.decoder.update(self.decoder.target(setting), dt)
+		else :
+			drive = self.decoder.update(0.0, dt)
+			self.decoder.drive = 0.0
+		target = self.curve(drive, forward, minutes)
+		if target > 0 and self.noise > 0 :
+			target = target * (1.0 + random.gauss(0.0, self.noise))
+		if not forward :
+			target = -target
+		if self.inertia > 0 :
+			self.speed = self.speed + (target - self.speed) * min(1.0, dt / self.inertia)
+		else :
+			self.speed = target
+		self.position = self.position + self.speed * 5280.0 / 3600 * dt
+		self.distance = self.distance + abs(self.speed) * 5280.0 / 3600 * dt
+		return
+
+####################################################################################
+#
+# SimLayout ties the loop, the locomotive and the power and program track relays
+# together. It steps the locomotive along the loop and works out, to within the
+# step, when each end of the locomotive crosses a block boundary; the detectors
+# change after their pickup or dropout delay.
+#
+####################################################################################
+class SimLayout :
+
+	def __init__(self, clock, options, loop, sensors, turnouts, locomotive) :
+		self.clock = clock
+		self.options = options
+		self.loopname = options.loop
+		self.sensors = [sensors.provideSensor(name) for name in loop["sensors"]]
+		self.turnouts = turnouts
+		self.locomotive = locomotive
+		self.lengths = options.blocklengths
+		self.boundaries = [0.0]
+		for length in self.lengths :
+			self.boundaries.append(self.boundaries[-1] + length)
+		self.circumference = self.boundaries[-1]
+		self.throttle = None
+		self.occupied = [False] * len(self.sensors)
+		self.pending = [0] * len(self.sensors)
+		self.stepmsec = options.stepmsec
+		# Park the locomotive with its front just short of the home sensor's block
+		self.locomotive.position = self.circumference * 100 - 0.5
+		self.detect(self.locomotive.position)
+		for i in range(len(self.sensors)) :
+			self.sensors[i].state = self.occupied[i] and SENSOR_ACTIVE or SENSOR_INACTIVE
+		self.clock.schedule(self.stepmsec, self.step)
+		return
+
+	def powered(self) :
+		return self.turnouts.state("Power" + self.loopname) <> TURNOUT_THROWN
+
+	def onMain(self) :
+		return self.powered() and self.turnouts.state("ProgMain") <> TURNOUT_THROWN
+
+	def onProgram(self) :
+		return self.powered() and self.turnouts.state("ProgMain") == TURNOUT_THROWN
+
+	def blockAt(self, x) :
+		x = x % self.circumference
+		for i in range(len(self.lengths)) :
+			if x < self.boundaries[i + 1] :
+				return i
+		return len(self.lengths) - 1
+
+	# Sets occupied[] for the locomotive with its front at x, returns the blocks that changed
+	def detect(self, x) :
+		now = [False] * len(self.sensors)
+		rear = x - self.locomotive.length
+		i = self.blockAt(rear)
+		now[i] = True
+		covered = self.boundaries[i + 1] - (rear % self.circumference)
+		while covered < self.locomotive.length :
+			i = (i + 1) % len(self.lengths)
+			now[i] = True
+			covered = covered + self.lengths[i]
+		changed = [i for i in range(len(now)) if now[i] <> self.occupied[i]]
+		self.occupied = now
+		return changed
+
+	def report(self, index, when) :
+		self.pending[index] = self.pending[index] + 1
+		ticket = self.pending[index]
+		if self.occupied[index] :
+			state = SENSOR_ACTIVE
+			delay = random.gauss(self.options.pickupmsec, self.options.jittermsec)
+		else :
+			state = SENSOR_INACTIVE
+			delay = random.gauss(self.options.dropoutmsec, self.options.jittermsec)
+		def fire() :
+			if self.pending[index] == ticket :
+				self.sensors[index].setKnownState(state)
+		self.clock.schedule(when + max(0.0, delay), fire)
+		return
+
+	# Moves the locomotive over the next step, so the detector changes it causes
+	# can be scheduled at the time they happen
+	def step(self) :
+		dt = self.stepmsec / 1000.0
+		setting = 0.0
+		forward = True
+		if self.throttle != None :
+			setting = self.throttle.speed
+			forward = self.throttle.forward
+		start = self.locomotive.position
+		self.locomotive.move(setting, forward, self.onMain(), dt, self.clock.nanos() / 1000000.0 / 60000.0)
+		end = self.locomotive.position
+		if end <> start :
+			# Each end of the locomotive crossing a boundary changes the detectors there
+			crossings = []
+			for offset in [0.0, -self.locomotive.length] :
+				a = start + offset
+				b = end + offset
+				low = min(a, b)
+				high = max(a, b)
+				base = math.floor(low / self.circumference) * self.circumference
+				while base <= high :
+					for boundary in self.boundaries[:-1] :
+						x = base + boundary
+						if (a < x <= b) or (b <= x < a) :
+							crossings.append((abs(x - a) / abs(b - a), x))
+					base = base + self.circumference
+			crossings.sort()
+			for fraction, x in crossings :
+				front = start + (end - start) * (fraction + 1e-6)
+				for index in self.detect(front) :
+					self.report(index, self.stepmsec * fraction)
+		self.clock.schedule(self.stepmsec, self.step)
+		return
+
+####################################################################################
+#
+# SimThrottle and SimProgrammer are what the script gets from getThrottle() and
+# getAddressedProgrammer(). The command station keeps sending the throttle's speed,
+# so the locomotive follows it whenever it is powered on the main.
+#
+####################################################################################
+class SimThrottle :
+
+	def __init__(self, layout, address) :
+		self.layout = layout
+		self.address = address
+		self.speed = 0.0
+		self.forward = True
+		self.functions = {}
+		return
+
+	def setSpeedSetting(self, speed) :
+		self.speed = max(0.0, min(1.0, speed))
+		return
+
+	def getSpeedSetting(self) :
+		return self.speed
+
+	def setIsForward(self, forward) :
+		self.forward = forward
+		return
+
+	def getIsForward(self) :
+		return self.forward
+
+	def release(self, listener = None) :
+		if self.layout.throttle is self :
+			self.layout.throttle = None
+		return
+
+	def dispatch(self, listener = None) :
+		return self.release(listener)
+
+	def __getattr__(self, name) :
+		# setF0() .. setF28() and getF0() .. getF28()
+		if name.startswith("setF") :
+			return lambda on : self.functions.__setitem__(name[4:], on)
+		if name.startswith("getF") :
+			return lambda : self.functions.get(name[4:], False)
+		raise AttributeError(name)
+
+class ProgrammerException(Exception) :
+	pass
+
+class SimProgrammer :
+
+	def __init__(self, clock, layout, address, options) :
+		self.clock = clock
+		self.layout = layout
+		self.address = address
+		self.options = options
+		self.writes = 0
+		self.listener = None	# of the write in progress
+		return
+
+	# Like JMRI's LocoNet programmer, a write while another one is in progress for
+	# a different listener is refused
+	def writeCV(self, cv, value, listener) :
+		if self.listener != None and self.listener != listener :
+			raise ProgrammerException("programmer in use")
+		cv = int(cv)
+		self.writes = self.writes + 1
+		decoder = self.layout.locomotive.decoder
+		self.listener = listener
+		if random.random() < self.options.droprate :
+			# the reply never comes, the script times out and sends it again
+			self.clock.schedule(self.options.writemsec, self.release)
+			return
+		if self.layout.onMain() and decoder.address() == self.address :
+			decoder.cvs[cv] = value
+		latency = random.uniform(self.options.writemsec * 0.5, self.options.writemsec * 1.5)
+		self.clock.schedule(latency, lambda : self.reply(listener, value))
+		return
+
+	def release(self) :
+		self.listener = None
+		return
+
+	# Jython passes a plain function as the ProgListener itself
+	def reply(self, listener, value) :
+		self.release()
+		if hasattr(listener, "programmingOpReply") :
+			listener.programmingOpReply(value, 0)
+		else :
+			listener(value, 0)
+		return
+
+class SimProgrammerManager :
+
+	def __init__(self, clock, layout, options) :
+		self.clock = clock
+		self.layout = layout
+		self.options = options
+		self.programmers = []
+		return
+
+	def getAddressedProgrammer(self, long, address) :
+		programmer = SimProgrammer(self.clock, self.layout, address, self.options)
+		self.programmers.append(programmer)
+		return programmer
+
+class SimGlobalProgrammer :
+
+	def __init__(self, modes) :
+		self.modes = modes
+		self.mode = modes[0]
+		return
+
+	def getSupportedModes(self) :
+		return list(self.modes)
+
+	def getMode(self) :
+		return self.mode
+
+	def setMode(self, mode) :
+		self.mode = mode
+		return
+
+class SimGlobalProgrammerManager :
+
+	def __init__(self, programmer) :
+		self.programmer = programmer
+		return
+
+	def getGlobalProgrammer(self) :
+		return self.programmer
+
+####################################################################################
+#
+# The JMRI, Java and Swing modules the script imports, built on the simulation
+#
+####################################################################################
+class SimModes :
+	pass
+
+def buildModules(sim) :
+	java = types.ModuleType("java")
+	java.beans = types.ModuleType("java.beans")
+	java.beans.PropertyChangeListener = object
+	java.lang = types.ModuleType("java.lang")
+	java.lang.Exception = Exception
+
+	javax = types.ModuleType("javax")
+	javax.swing = types.ModuleType("javax.swing")
+	class JOptionPane :
+		YES_NO_OPTION = 0
+		YES_OPTION = 0
+		NO_OPTION = 1
+		@staticmethod
+		def showConfirmDialog(*args) :
+			return JOptionPane.YES_OPTION
+	javax.swing.JOptionPane = JOptionPane
+
+	jmri = types.ModuleType("jmri")
+	jmri.ProgListener = types.ModuleType("jmri.ProgListener")
+	jmri.ProgListener.OK = 0
+	jmri.ProgrammerException = ProgrammerException
+	jmri.Turnout = types.ModuleType("jmri.Turnout")
+	jmri.Turnout.DIRECT = FEEDBACK_DIRECT
+	jmri.ProgrammingMode = SimModes
+	for name in ["DIRECTBITMODE", "DIRECTBYTEMODE", "PAGEMODE", "REGISTERMODE"] :
+		setattr(SimModes, name, name)
+	jmri.util = types.ModuleType("jmri.util")
+	jmri.util.FileUtil = types.ModuleType("jmri.util.FileUtil")
+	jmri.util.FileUtil.getUserFilesPath = lambda : sim.userfiles + os.sep
+	jmri.jmrit = types.ModuleType("jmri.jmrit")
+	jmri.jmrit.automat = types.ModuleType("jmri.jmrit.automat")
+	jmri.jmrit.automat.AbstractAutomaton = buildAutomaton(sim)
+
+	return {"java": java, "java.beans": java.beans, "java.lang": java.lang,
+		"javax": javax, "javax.swing": javax.swing,
+		"jmri": jmri, "jmri.util": jmri.util, "jmri.jmrit": jmri.jmrit,
+		"jmri.jmrit.automat": jmri.jmrit.automat}
+
+####################################################################################
+#
+# AbstractAutomaton for the script: start() runs init() and then handle() until it
+# returns False. The script does its waiting through testbedClock.
+#
+####################################################################################
+def buildAutomaton(sim) :
+
+	class AbstractAutomaton(object) :
+
+		def setName(self, name) :
+			self.automatonName = name
+			return
+
+		def getName(self) :
+			return getattr(self, "automatonName", "")
+
+		def start(self) :
+			self.init()
+			while self.handle() :
+				pass
+			return
+
+		def getThrottle(self, address, long) :
+			throttle = SimThrottle(sim.layout, address)
+			if sim.locomotive.decoder.address() == address :
+				sim.layout.throttle = throttle
+			return throttle
+
+		def readServiceModeCV(self, cv) :
+			sim.clock.run(sim.options.readmsec[sim.globalprogrammer.getMode()])
+			sim.reads = sim.reads + 1
+			if not sim.layout.onProgram() :
+				return -1
+			return sim.locomotive.decoder.cvs[int(cv)]
+
+	return AbstractAutomaton
+
+####################################################################################
+#
+# loadScript() runs the script in library mode with the stand-in modules and
+# returns its namespace. host gives the modules the user files directory and
+# whatever the automaton uses.
+#
+####################################################################################
+def loadScript(path, host) :
+	modules = buildModules(host)
+	saved = dict([(name, sys.modules.get(name)) for name in modules.keys()])
+	sys.modules.update(modules)
+	try :
+		namespace = {"testbedMode": "library", "__name__": "MikeDeanSpeedMatch"}
+		execfile(path, namespace)
+	finally :
+		for name, module in saved.items() :
+			if module == None :
+				del sys.modules[name]
+			else :
+				sys.modules[name] = module
+	return namespace
+
+####################################################################################
+#
+# Simulation loads the script onto the simulated layout and runs one batch job
+#
+####################################################################################
+class Simulation :
+
+	def __init__(self, options) :
+		self.options = options
+		self.reads = 0
+		random.seed(options.seed)
+		self.userfiles = options.userfiles
+		if self.userfiles == None :
+			self.userfiles = tempfile.mkdtemp(prefix = "testbed")
+		elif not os.path.isdir(self.userfiles) :
+			os.makedirs(self.userfiles)
+		self.sensors = SimSensorManager()
+		self.globalprogrammer = SimGlobalProgrammer(["DIRECTBITMODE", "DIRECTBYTEMODE", "PAGEMODE"])
+		self.namespace = loadScript(options.script, self)
+		# The script and the layout share a virtual clock
+		self.clock = self.namespace["VirtualClock"](options.limitminutes * 60000)
+		self.turnouts = SimTurnoutManager(self.clock, options.relaymsec, options.turnoutfeedback)
+		self.namespace.update({"testbedClock": self.clock,
+			"testbedArbiter": self.namespace["TestbedArbiter"](self.clock),
+			"sensors": self.sensors, "turnouts": self.turnouts,
+			"programmers": SimGlobalProgrammerManager(self.globalprogrammer),
+			"CLOSED": TURNOUT_CLOSED, "THROWN": TURNOUT_THROWN})
+
+		loop = self.namespace["TestbedLoops"][options.loop]
+		if options.blocklengths == None :
+			# The lap length is known; only where the sensors divide it is not
+			lengths = [1.0 + random.uniform(-options.blockerror, options.blockerror) for name in loop["sensors"]]
+			options.blocklengths = [loop["blocklength"] * len(lengths) * x / sum(lengths) for x in lengths]
+		if options.calibratedblocks :
+			self.writeBlockLengths(loop)
+		self.decoder = SimDecoder(options.address, options.brand, options.version, options.tcs)
+		self.locomotive = SimLocomotive(self.decoder, options)
+		self.layout = SimLayout(self.clock, options, loop, self.sensors, self.turnouts, self.locomotive)
+		self.namespace["addressedProgrammers"] = SimProgrammerManager(self.clock, self.layout, options)
+		self.calibration = None
+		return
+
+	# Writes the true block lengths as the script's block length table, as if a
+	# block calibration run had already been made on the loop
+	def writeBlockLengths(self, loop) :
+		directory = os.path.join(self.userfiles, "speedmatch")
+		if not os.path.isdir(directory) :
+			os.makedirs(directory)
+		f = open(os.path.join(directory, loop["blockfile"]), "w")
+		try :
+			for name, length in zip(loop["sensors"], self.options.blocklengths) :
+				f.write("%s %.3f\n" % (name, length))
+		finally :
+			f.close()
+		return
+
+	# prepare(calibration) is called before the calibration starts, so a caller
+	# can instrument it
+	def run(self, prepare = None) :
+		job = {"name": self.options.name, "type": self.options.type, "topspeed": self.options.topspeed,
+			"blockcalibration": self.options.blockcalibration, "verifytable": self.options.verifytable,
+			"sweep": self.options.sweep}
+		path = os.path.join(self.userfiles, "simulated_jobs.json")
+		f = open(path, "w")
+		try :
+			json.dump([job], f)
+		finally :
+			f.close()
+		output = sys.stdout
+		if self.options.quiet :
+			sys.stdout = open(os.path.join(self.userfiles, "simulated_run.log"), "w")
+		try :
+			calibration = self.namespace["DCCDecoderCalibration"]()
+			calibration.setName("DCC Decoder Calibration " + self.options.loop)
+			calibration.setupBatch(path, self.options.loop)
+			self.calibration = calibration
+			if prepare != None :
+				prepare(calibration)
+			calibration.start()
+		finally :
+			if self.options.quiet :
+				sys.stdout.close()
+				sys.stdout = output
+		return calibration.result
+
+	def laps(self) :
+		return self.locomotive.distance / self.layout.circumference
+
+	# Ops mode writes sent, retries included
+	def writes(self) :
+		return sum([programmer.writes for programmer in self.namespace["addressedProgrammers"].programmers])
+
+	# Steady, warm, noise free speed at each of the 28 steps with the CVs the run left
+	def speeds(self, forward = True) :
+		return [self.speedAt(step / 28.0, forward) for step in range(1, 29)]
+
+	# The same at a throttle setting 0..1
+	def speedAt(self, setting, forward = True) :
+		return self.locomotive.curve(self.decoder.target(setting), forward, 1000.0)
+
+	def summary(self) :
+		print ("Layout time %.1f minutes, %d service mode reads" % (self.clock.nanos() / 1000000.0 / 60000.0, self.reads))
+		print ("Status: %s" % self.calibration.result.get("status"))
+		print ("Speed table (CV29 = %d)" % self.decoder.cvs[29])
+		forward = self.speeds(True)
+		reverse = self.speeds(False)
+		for step in range(28) :
+			print ("  step %2d  CV%d = %3d  %5.1f MPH forward  %5.1f MPH reverse" %
+				(step + 1, 67 + step, self.decoder.cvs[67 + step], forward[step], reverse[step]))
+		print ("Files in %s" % self.userfiles)
+		return
+
+def parseOptions(argv) :
+	here = os.path.dirname(os.path.abspath(__file__))
+	parser = argparse.ArgumentParser(description = "Run the speed matching script against a simulated testbed")
+	parser.add_argument("--script", default = os.path.join(here, "MikeDeanSpeedMatch.py"))
+	parser.add_argument("--userfiles", default = None, help = "JMRI user files directory (default: a new temporary one)")
+	parser.add_argument("--name", default = "simulated")
+	parser.add_argument("--loop", default = "N", help = "N or HO")
+	parser.add_argument("--type", default = "Diesel", help = "Diesel or Steam")
+	parser.add_argument("--topspeed", type = float, default = 60.0, help = "target top speed, MPH")
+	parser.add_argument("--brand", default = "Digitrax", choices = sorted(Brands.keys()))
+	parser.add_argument("--version", type = int, default = 50, help = "decoder version (CV7)")
+	parser.add_argument("--tcs", default = "new", choices = ["old", "new"], help = "TCS speed table behaviour")
+	parser.add_argument("--address", type = int, default = 3)
+	parser.add_argument("--blockcalibration", action = "store_true")
+	parser.add_argument("--sweep", action = "store_true")
+	parser.add_argument("--verifytable", type = int, default = 1)
+	parser.add_argument("--seed", type = int, default = 1)
+	parser.add_argument("--quiet", action = "store_true", help = "send the script's output to simulated_run.log")
+	parser.add_argument("--limitminutes", type = float, default = 600.0, help = "give up after this much layout time")
+	# The loop and its detectors
+	parser.add_argument("--blocklengths", type = lambda s : [float(x) for x in s.split(",")], default = None,
+		help = "comma separated block lengths, scale feet (default: the script's block length)")
+	parser.add_argument("--blockerror", type = float, default = 0.0,
+		help = "random error of each default block length, as a fraction; the lap length stays the same")
+	parser.add_argument("--calibratedblocks", action = "store_true",
+		help = "start with the block length table of a block calibration run")
+	parser.add_argument("--pickupmsec", type = float, default = 5.0)
+	parser.add_argument("--dropoutmsec", type = float, default = 150.0)
+	parser.add_argument("--jittermsec", type = float, default = 1.0)
+	parser.add_argument("--relaymsec", type = float, default = 30.0)
+	parser.add_argument("--turnoutfeedback", action = "store_true", help = "the relay turnouts report their state")
+	parser.add_argument("--stepmsec", type = float, default = 5.0, help = "physics time step")
+	# The locomotive
+	parser.add_argument("--maxspeed", type = float, default = 110.0, help = "forward speed at full drive, MPH")
+	parser.add_argument("--reverse", type = float, default = 0.95, help = "reverse speed as a fraction of forward")
+	parser.add_argument("--deadband", type = float, default = 0.03, help = "drive that just starts the motor")
+	parser.add_argument("--gamma", type = float, default = 1.15, help = "motor curve exponent")
+	parser.add_argument("--noise", type = float, default = 0.01, help = "speed noise, as a fraction")
+	parser.add_argument("--inertia", type = float, default = 0.3, help = "mechanical time constant, sec")
+	parser.add_argument("--warmup", type = float, default = 0.05, help = "cold slow down, as a fraction")
+	parser.add_argument("--warmupminutes", type = float, default = 3.0)
+	parser.add_argument("--length", type = float, default = 60.0, help = "locomotive length, scale feet")
+	# The programmers
+	parser.add_argument("--writemsec", type = float, default = 60.0, help = "ops mode write reply time")
+	parser.add_argument("--droprate", type = float, default = 0.0, help = "fraction of ops mode replies lost")
+	options = parser.parse_args(argv)
+	options.verifytable = options.verifytable <> 0
+	options.readmsec = {"DIRECTBITMODE": 900.0, "DIRECTBYTEMODE": 1800.0, "PAGEMODE": 2500.0, "REGISTERMODE": 3000.0}
+	return options
+
+if __name__ == "__main__" :
+	simulation = Simulation(parseOptions(sys.argv[1:]))
+	simulation.run()
+	simulation.summary()
@@ -0,0 +1,190 @@
+####################################################################################
+#
+# TraceReplay.py plays back a trace recorded by MikeDeanSpeedMatch.py (see
+# TraceRecorder) without the testbed. The sensor edges and throttle changes of
+# the trace happen again at their recorded times on a virtual clock, and every
+# measureSpeed() of the recorded run is made again at the time it was made, so
+# the speeds of a problem run can be looked at again, or measured again with
+# different settings:
+#
+#	python TraceReplay.py speedmatch/traces/N-20181104-101500-1.trace
+#	python TraceReplay.py --set TransitPrecisionFactor=30 --set SettleMsec=200 run.trace
+#
+# It prints the recorded and the replayed speed of each measurement. Replaying a
+# trace with the script that recorded it gives the same speeds. A replayed
+# measurement that takes longer than the recorded one can run past the next
+# throttle change of the trace; those are marked as overrun, since they measured
+# some of the next speed, and left out of the differences.
+#
+####################################################################################
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import TestbedSimulator
+
+class TraceReplay :
+
+	def __init__(self, path, script, settings) :
+		self.events = []
+		f = open(path, "r")
+		try :
+			for line in f :
+				if line.strip() :
+					self.events.append(json.loads(line))
+		finally :
+			f.close()
+		if not self.events or self.events[0][1] <> "H" :
+			raise ValueError(path + " is not a testbed trace")
+		header = self.events[0][2]
+		self.userfiles = tempfile.mkdtemp(prefix = "replay")
+		self.namespace = TestbedSimulator.loadScript(script, self)
+
+		# Waiting past the end of the trace means the trace ran out of edges
+		self.clock = self.namespace["VirtualClock"](self.events[-1][0] / 1000.0 + 60000)
+		self.sensors = TestbedSimulator.SimSensorManager()
+		for name, state in header["states"].items() :
+			self.sensors.provideSensor(name).state = state
+		loop = dict(self.namespace["TestbedLoops"][header["loop"]])
+		loop["sensors"] = header["sensors"]
+		self.namespace["TestbedLoops"][header["loop"]] = loop
+		self.namespace.update({"testbedClock": self.clock,
+			"testbedArbiter": self.namespace["TestbedArbiter"](self.clock),
+			"sensors": self.sensors, "turnouts": TestbedSimulator.SimTurnoutManager(self.clock, 0),
+			"CLOSED": TestbedSimulator.TURNOUT_CLOSED, "THROWN": TestbedSimulator.TURNOUT_THROWN})
+
+		calibration = self.namespace["DCCDecoderCalibration"]()
+		calibration.loopName = header["loop"]
+		calibration.init()
+		calibration.BlockLengths[:] = header["blocklengths"]
+		calibration.blockLengthsCalibrated = header.get("blocklengthscalibrated", False)
+		calibration.result = {}
+		calibration.status = None
+		calibration.throttle = TestbedSimulator.SimThrottle(None, 0)
+		for name, value in settings :
+			setattr(calibration, name, value)
+		self.calibration = calibration
+		return
+
+	def schedule(self, usec, function) :
+		self.clock.schedule(usec / 1000.0 - self.clock.nanos() / 1000000.0, function)
+		return
+
+	# The block lengths measured or estimated during the recorded run
+	def setBlockLengths(self, lengths) :
+		self.calibration.BlockLengths[:] = lengths
+		self.calibration.blockLengthsCalibrated = True
+		return
+
+	# Returns [(msec, target, recorded speed, recorded precision, replayed speed,
+	# replayed precision, overrun)] for every measureSpeed() of the trace
+	def run(self) :
+		calibration = self.calibration
+		measurements = []
+		changes = []		# usec of the throttle changes
+		for event in self.events[1:] :
+			usec, kind, fields = event[0], event[1], event[2:]
+			if kind == "E" :
+				sensor = self.sensors.provideSensor(fields[0])
+				self.schedule(usec, lambda sensor = sensor, state = fields[1] : sensor.setKnownState(state))
+			elif kind == "S" :
+				self.schedule(usec, lambda fields = fields : calibration.setThrottleSpeed(fields[0], fields[1]))
+				changes.append(usec)
+			elif kind == "D" :
+				self.schedule(usec, lambda fields = fields : calibration.setThrottleDirection(fields[0], fields[1]))
+				changes.append(usec)
+			elif kind == "B" :
+				self.schedule(usec, lambda fields = fields : self.setBlockLengths(fields[0]))
+			elif kind == "M" :
+				measurements.append([usec / 1000.0, fields[0], fields[1], None, None])
+			elif kind == "m" and measurements :
+				measurements[-1][3:5] = fields
+
+		results = []
+		for msec, target, last, speed, precision in measurements :
+			if msec > self.clock.nanos() / 1000000.0 :
+				self.clock.run(msec - self.clock.nanos() / 1000000.0)
+			calibration.lastMeasuredSpeed = last
+			try :
+				replayed = calibration.measureSpeed(target)
+				replayedprecision = calibration.speedPrecision
+			except RuntimeError :
+				# the trace ends before enough blocks were crossed
+				replayed = None
+				replayedprecision = None
+			later = [usec for usec in changes if usec > msec * 1000]
+			overrun = later != [] and self.clock.nanos() > later[0] * 1000
+			results.append((msec, target, speed, precision, replayed, replayedprecision, overrun))
+			if replayed == None :
+				break
+		return results
+
+	def close(self) :
+		shutil.rmtree(self.userfiles, True)
+		return
+
+def rounded(value) :
+	if value == None :
+		return ""
+	return round(value, 3)
+
+if __name__ == "__main__" :
+	here = os.path.dirname(os.path.abspath(__file__))
+	parser = argparse.ArgumentParser(description = "Replay a testbed trace through measureSpeed()")
+	parser.add_argument("trace")
+	parser.add_argument("--script", default = os.path.join(here, "MikeDeanSpeedMatch.py"))
+	parser.add_argument("--set", action = "append", default = [], metavar = "NAME=VALUE",
+		help = "change a setting of the script before replaying, e.g. SettleMsec=200")
+	parser.add_argument("--csv", action = "store_true", help = "write the table as CSV")
+	parser.add_argument("--verbose", action = "store_true", help = "show the script's output")
+	options = parser.parse_args()
+
+	settings = []
+	for setting in options.set :
+		name, value = setting.split("=", 1)
+		settings.append((name, json.loads(value)))
+
+	output = sys.stdout
+	if not options.verbose :
+		sys.stdout = open(os.devnull, "w")
+	try :
+		replay = TraceReplay(options.trace, options.script, settings)
+		try :
+			results = replay.run()
+		finally :
+			replay.close()
+	finally :
+		if not options.verbose :
+			sys.stdout.close()
+			sys.stdout = output
+
+	columns = ["time_sec", "target", "recorded", "recorded_precision", "replayed", "replayed_precision", "difference", "overrun"]
+	rows = []
+	for msec, target, speed, precision, replayed, replayedprecision, overrun in results :
+		difference = None
+		if speed != None and replayed != None :
+			difference = replayed - speed
+		rows.append([round(msec / 1000.0, 3), target, rounded(speed), rounded(precision),
+			rounded(replayed), rounded(replayedprecision), rounded(difference), overrun and "overrun" or ""])
+	if options.csv :
+		writer = csv.writer(sys.stdout)
+		writer.writerow(columns)
+		writer.writerows(rows)
+	else :
+		print ("%10s %7s %10s %7s %10s %7s %10s %s" % ("sec", "target", "recorded", "+/-", "replayed", "+/-", "diff", ""))
+		for row in rows :
+			print ("%10s %7s %10s %7s %10s %7s %10s %s" % tuple(row))
+	differences = [abs(row[6]) for row in rows if row[6] != "" and row[7] == ""]
+	if differences :
+		sys.stderr.write("%d measurements replayed, largest difference %.3f MPH, mean %.3f MPH\n" %
+			(len(differences), max(differences), sum(differences) / len(differences)))
+	overruns = len([row for row in rows if row[7] != ""])
+	if overruns :
+		sys.stderr.write("%d measurements ran past the next throttle change\n" % overruns)
+	if results and results[-1][4] == None :
+		sys.stderr.write("The trace ended before the last measurement could be made again\n")